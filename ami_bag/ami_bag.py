@@ -1,10 +1,13 @@
-import os, csv, re, logging
+import os, csv, re, time, logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import ami_bag.update_bag as update_bag
 import bagit
 
 # ami modules
 import ami_bag.ami_bag_constants as ami_bag_constants
+import ami_files.profiling as profiling
 from ami_md.ami_excel import ami_excel
 import ami_md.ami_json as aj
 
@@ -17,8 +20,81 @@ class ami_bagError(Exception):
     def __str__(self):
         return repr(self.message)
 
+
+# one record per payload file, path is relative to the bag root
+# dir is the path within data/, role is the filename code before the extension
+PayloadFile = namedtuple('PayloadFile', ['path', 'name', 'dir', 'ext', 'role', 'size'])
+
+
+def index_payload(snapshot):
+    """
+    Return a tuple of PayloadFile records sorted by path, built from a
+    payload snapshot of relative paths and sizes so data/ is not walked
+    or stat'ed again
+    """
+    records = []
+
+    for rel_path, size in snapshot.items():
+        rel_dir, name = os.path.split(rel_path)
+        stem, ext = os.path.splitext(name)
+        role = stem.rsplit('_', 1)[1] if '_' in stem else None
+        records.append(PayloadFile(
+            path = rel_path,
+            name = name,
+            dir = rel_dir[5:],
+            ext = ext.lower(),
+            role = role,
+            size = size
+        ))
+
+    return tuple(sorted(records))
+
+
+# filename level facts about a payload file, parsed once per bag
+# base is the filename before the role code, e.g. myd_263524_v01
+# volume, face, region and part are the two digit codes after _v, or None
+FilenameRecord = namedtuple('FilenameRecord', ['path', 'name', 'dir', 'ext', 'role',
+    'base', 'volume', 'face', 'region', 'part', 'standard', 'subobject', 'part_file'])
+
+
+def parse_filename(entry):
+    """
+    Return a FilenameRecord for a PayloadFile, running each filename
+    regex a single time
+    """
+    stem = os.path.splitext(entry.name)[0]
+    base = stem.rsplit('_', 1)[0] if entry.role else stem
+
+    volume = face = region = part = None
+    match = ami_bag_constants.VOLUME_REGEX.search(stem)
+    if match:
+        volume = match.group(1)
+        codes = dict((code.lower(), value) for code, value in
+            ami_bag_constants.SUBOBJECT_CODE_REGEX.findall(match.group(2)))
+        face = codes.get('f')
+        region = codes.get('r')
+        part = codes.get('p', codes.get('pt'))
+
+    return FilenameRecord(
+        path = entry.path,
+        name = entry.name,
+        dir = entry.dir,
+        ext = entry.ext,
+        role = entry.role,
+        base = base,
+        volume = volume,
+        face = face,
+        region = region,
+        part = part,
+        standard = bool(ami_bag_constants.FILENAME_REGEX.search(entry.name)),
+        subobject = bool(ami_bag_constants.SUBOBJECT_REGEX.search(entry.name)),
+        part_file = bool(ami_bag_constants.SUBOBJECT_PART_REGEX.search(entry.name))
+    )
+
+
 class ami_bag(update_bag.Repairable_Bag):
 
+    @profiling.timed("load")
     def __init__(self, *args, **kwargs):
         super(ami_bag, self).__init__(*args, **kwargs)
 
@@ -30,34 +106,45 @@ class ami_bag(update_bag.Repairable_Bag):
 
         self.name = os.path.basename(self.path)
 
-        self.data_files = set(self.payload_entries().keys())
-        self.data_count = len(self.data_files)
-        self.data_size = self.get_total_bytes(self.data_files)
-        self.data_exts = set([os.path.splitext(filename)[1].lower() for filename in self.data_files])
+        # the completeness check above already walked data/ for the snapshot
+        self.payload_index = index_payload(self.payload_snapshot())
+
+        self.data_files = set(entry.path for entry in self.payload_index)
+        self.data_count = len(self.payload_index)
+        self.data_size = sum(entry.size for entry in self.payload_index)
+        self.data_exts = set(entry.ext for entry in self.payload_index)
 
-        self.data_dirs = set([os.path.split(path)[0][5:] for path in self.data_files])
+        self.data_dirs = set(entry.dir for entry in self.payload_index)
         if "PreservationMasters" not in self.data_dirs:
             raise ami_bagError("Payload does not contain a PreservationMasters directory")
 
-        self.media_filepaths = set([os.path.join(self.path, path) for
-            path in self.data_files if any(path.lower().endswith(ext) for ext in ami_bag_constants.MEDIA_EXTS)])
+        self.media_index = tuple(entry for entry in self.payload_index
+            if entry.ext in ami_bag_constants.MEDIA_EXTS)
+        self.media_filepaths = set([os.path.join(self.path, entry.path) for entry in self.media_index])
         if not self.media_filepaths:
             raise ami_bagError("Payload does not contain files with accepted extensions: {}".format(
                 ami_bag_constants.MEDIA_EXTS
             ))
-        self.media_count = len(self.media_filepaths)
-        self.media_size = self.get_total_bytes(self.media_filepaths)
+        self.media_count = len(self.media_index)
+        self.media_size = sum(entry.size for entry in self.media_index)
+
 
+        self.filename_index = tuple(parse_filename(entry) for entry in self.payload_index)
+        self.media_bases = {}
+        for record in self.filename_index:
+            if record.ext in ami_bag_constants.MEDIA_EXTS:
+                self.media_bases.setdefault(record.role, set()).add(record.base)
 
-        self.pm_filepaths = set([path for path in self.media_filepaths if '_pm.' in path])
+        self.pm_filepaths = self.get_media_filepaths('pm')
         if not self.pm_filepaths:
             raise ami_bagError("Payload does not contain preservation master files")
-        self.mz_filepaths = set([path for path in self.media_filepaths if '_mz.' in path])
-        self.em_filepaths = set([path for path in self.media_filepaths if '_em.' in path])
-        self.sc_filepaths = set([path for path in self.media_filepaths if '_sc.' in path])
+        self.mz_filepaths = self.get_media_filepaths('mz')
+        self.em_filepaths = self.get_media_filepaths('em')
+        self.sc_filepaths = self.get_media_filepaths('sc')
 
         self.set_compression()
 
+        self._media_files_md = None
         self.set_type()
         if self.type == "excel":
             self.set_subtype_excel()
@@ -76,6 +163,11 @@ class ami_bag(update_bag.Repairable_Bag):
         ))
 
 
+    def get_media_filepaths(self, role):
+        return set([os.path.join(self.path, entry.path) for entry in self.media_index
+            if entry.role == role])
+
+
     def get_total_bytes(self, fileset):
         total_bytes = 0
 
@@ -89,7 +181,7 @@ class ami_bag(update_bag.Repairable_Bag):
     def set_compression(self):
         self.compression = None
 
-        pm_exts = set([os.path.splitext(filename)[1].lower() for filename in self.pm_filepaths])
+        pm_exts = set([entry.ext for entry in self.media_index if entry.role == 'pm'])
 
         if pm_exts.issubset(ami_bag_constants.COMPRESSED_EXTS):
             self.compressed = 'compressed'
@@ -110,17 +202,25 @@ class ami_bag(update_bag.Repairable_Bag):
             self.tagged = 'tagging not needed'
 
 
-    def check_amibag(self, fast = True, metadata = False):
+    def check_amibag(self, fast = True, metadata = False, metadata_workers = 1,
+        checkpoint = False):
         '''
         run each of the validation checks against an AMI Bag
         return if out of spec but okay, or if not media ingestable
+        metadata_workers sets how many JSON sidecars are validated at once
+        checkpoint makes a full fixity check resumable, see validate_fixity
         '''
 
         error = False
         warning = False
 
         try:
-            self.validate(fast = fast, completeness_only = fast)
+            with profiling.phase("validate", nbytes = 0 if fast else self.data_size):
+                if fast or not checkpoint:
+                    self.validate(fast = fast, completeness_only = fast)
+                else:
+                    self.validate(completeness_only = True)
+                    self.validate_fixity()
         except bagit.BagValidationError as e:
             LOGGER.error("Bag out of spec: {0}".format(e.message))
             error = True
@@ -231,7 +331,7 @@ class ami_bag(update_bag.Repairable_Bag):
 
             if metadata:
                 try:
-                    self.check_metadata_json()
+                    self.check_metadata_json(workers = metadata_workers)
                 except ami_bagError as e:
                     LOGGER.warning("JSON metadata out of spec: {0}".format(e.message))
                     warning = True
@@ -245,13 +345,14 @@ class ami_bag(update_bag.Repairable_Bag):
         return warning, error
 
 
-    def validate_amibag(self, fast = True, metadata = False):
+    def validate_amibag(self, fast = True, metadata = False, metadata_workers = 1):
         '''
         run each of the validation checks against an AMI Bag
         return a boolean
         '''
 
-        warning, error = self.check_amibag(fast = fast, metadata = metadata)
+        warning, error = self.check_amibag(fast = fast, metadata = metadata,
+            metadata_workers = metadata_workers)
         if warning or error:
             valid = False
         else:
@@ -260,13 +361,9 @@ class ami_bag(update_bag.Repairable_Bag):
         return valid
 
 
+    @profiling.timed("check_filenames")
     def check_filenames(self):
-        bad_filenames = []
-
-        for filepath in self.data_files:
-            filename = os.path.split(filepath)[1]
-            if not ami_bag_constants.FILENAME_REGEX.search(filename):
-                bad_filenames.append(filename)
+        bad_filenames = [record.name for record in self.filename_index if not record.standard]
 
         if bad_filenames:
             raise ami_bagError("Non-standard filenames for the following: {}".format(bad_filenames))
@@ -274,13 +371,9 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_simple_filenames")
     def check_simple_filenames(self):
-        complex_filenames = []
-
-        for filepath in self.data_files:
-            filename = os.path.split(filepath)[1]
-            if ami_bag_constants.SUBOBJECT_REGEX.search(filename):
-                complex_filenames.append(filename)
+        complex_filenames = [record.name for record in self.filename_index if record.subobject]
 
         if complex_filenames:
             raise ami_bagError("Complex digitized objects represented by: {}".format(complex_filenames))
@@ -288,13 +381,9 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_part_filenames")
     def check_part_filenames(self):
-        part_filenames = []
-
-        for filepath in self.data_files:
-            filename = os.path.split(filepath)[1]
-            if ami_bag_constants.SUBOBJECT_PART_REGEX.search(filename):
-                part_filenames.append(filename)
+        part_filenames = [record.name for record in self.filename_index if record.part_file]
 
         if part_filenames:
             raise ami_bagError("Part files represented by: {}".format(part_filenames))
@@ -302,6 +391,7 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_directory_depth")
     def check_directory_depth(self):
         bad_dirs = []
 
@@ -315,61 +405,62 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_file_in_roledir")
     def check_file_in_roledir(self):
         misplaced_files = []
+        role_dirs = {
+            "pm": ami_bag_constants.PM_DIR,
+            "em": ami_bag_constants.EM_DIR,
+            "sc": ami_bag_constants.SC_DIR,
+            "ao": ami_bag_constants.AO_DIR
+        }
 
-        for path in self.data_files:
-            role = os.path.splitext(path)[0].rsplit('_', 1)[1]
-
-            if role == "pm":
-                if ami_bag_constants.PM_DIR not in path:
-                    misplaced_files.append(path)
+        for entry in self.payload_index:
+            if entry.role in role_dirs and role_dirs[entry.role] not in entry.path:
+                misplaced_files.append(entry.path)
 
-            if role == "em":
-                if ami_bag_constants.EM_DIR not in path:
-                    misplaced_files.append(path)
+        if misplaced_files:
+            raise ami_bagError("Files in the wrong directory: {}".format(misplaced_files))
 
-            if role == "sc":
-                if ami_bag_constants.SC_DIR not in path:
-                    misplaced_files.append(path)
+        return True
 
-            if role == "ao":
-                if ami_bag_constants.AO_DIR not in path:
-                    misplaced_files.append(path)
 
+    def get_role_mismatch(self, role):
+        '''
+        base filenames found for only one of pm and role
+        '''
+        base_pms = self.media_bases.get('pm', set())
+        base_others = self.media_bases.get(role, set())
 
-            if misplaced_files:
-                raise ami_bagError("Files in the wrong directory: {}".format(misplaced_files))
-
-        return True
+        return base_pms ^ base_others
 
 
+    @profiling.timed("check_pmmz_match")
     def check_pmmz_match(self):
-        base_pms = set([os.path.basename(path).rsplit('_', 1)[0] for path in self.pm_filepaths])
-        base_mzs = set([os.path.basename(path).rsplit('_', 1)[0] for path in self.mz_filepaths])
+        mismatch = self.get_role_mismatch('mz')
 
-        if not base_mzs == base_pms:
-            raise ami_bagError("Mismatch of PM's and MZ's: {}".format(base_pms.symmetric_difference(base_mzs)))
+        if mismatch:
+            raise ami_bagError("Mismatch of PM's and MZ's: {}".format(mismatch))
 
         return True
 
 
+    @profiling.timed("check_pmem_match")
     def check_pmem_match(self):
-        base_pms = set([os.path.basename(path).rsplit('_', 1)[0] for path in self.pm_filepaths])
-        base_ems = set([os.path.basename(path).rsplit('_', 1)[0] for path in self.em_filepaths])
+        mismatch = self.get_role_mismatch('em')
 
-        if not base_ems == base_pms:
-            raise ami_bagError("Mismatch of PM's and EM's: {}".format(base_pms.symmetric_difference(base_ems)))
+        if mismatch:
+            raise ami_bagError("Mismatch of PM's and EM's: {}".format(mismatch))
 
         return True
 
 
+    @profiling.timed("check_pmsc_match")
     def check_pmsc_match(self):
-        base_pms = set([os.path.basename(path).rsplit('_', 1)[0] for path in self.pm_filepaths])
-        base_scs = set([os.path.basename(path).rsplit('_', 1)[0] for path in self.sc_filepaths])
+        mismatch = self.get_role_mismatch('sc')
 
-        if not base_scs == base_pms:
-            raise ami_bagError("Mismatch of PM's and SC's: {}".format(base_pms.symmetric_difference(base_scs)))
+        if mismatch:
+            raise ami_bagError("Mismatch of PM's and SC's: {}".format(mismatch))
 
         return True
 
@@ -424,6 +515,7 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_bagstructure_excel")
     def check_bagstructure_excel(self):
         expected_dirs = set()
         for type_props in ami_bag_constants.EXCEL_SUBTYPES.values():
@@ -464,6 +556,7 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_bagstructure_json")
     def check_bagstructure_json(self):
         expected_dirs = set()
         for type_props in ami_bag_constants.JSON_SUBTYPES.values():
@@ -492,6 +585,7 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_bagstructure_exceljson")
     def check_bagstructure_exceljson(self):
         expected_dirs = set()
         for type_props in ami_bag_constants.EXCELJSON_SUBTYPES.values():
@@ -507,7 +601,7 @@ class ami_bag(update_bag.Repairable_Bag):
 
 
     def set_metadata_excel(self):
-        self.metadata_files = [filename for filename in self.data_files if os.path.splitext(filename)[1] == ".xlsx"]
+        self.metadata_files = [entry.path for entry in self.payload_index if entry.ext == ".xlsx"]
 
         self.media_files_md = []
 
@@ -528,6 +622,7 @@ class ami_bag(update_bag.Repairable_Bag):
         return
 
 
+    @profiling.timed("check_metadata_excel")
     def check_metadata_excel(self):
         if not self.metadata_files:
             raise ami_bagError("Excel bag does not contain any files with xlsx extension")
@@ -545,6 +640,7 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_filenames_manifest_and_metadata_excel")
     def check_filenames_manifest_and_metadata_excel(self):
         media_files_basenames = set([os.path.splitext(os.path.basename(path))[0] for path in self.media_filepaths])
         if not self.media_files_md >= media_files_basenames:
@@ -554,7 +650,12 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    @profiling.timed("check_filenames_md_concordance_json")
     def check_filenames_md_concordance_json(self):
+        # reading the sidecars' technical filenames surfaces unparseable JSON
+        # even when the full metadata check is not requested
+        self.media_files_md
+
         md_files = set([os.path.splitext(os.path.basename(path))[0] for path in self.metadata_files])
         media_files = set([os.path.splitext(os.path.basename(path))[0] for path in self.media_filepaths])
         if not md_files == media_files:
@@ -565,36 +666,70 @@ class ami_bag(update_bag.Repairable_Bag):
 
 
     def set_metadata_json(self):
-        self.metadata_files = [filename for filename in self.data_files if os.path.splitext(filename)[1] == ".json"]
+        self.metadata_files = [entry.path for entry in self.payload_index if entry.ext == ".json"]
+        self.metadata_json = {}
 
-        self.media_files_md = []
+        return
 
-        for filename in self.metadata_files:
-            json = aj.ami_json(filepath = os.path.join(self.path, filename))
-            filename = json.dict["technical"]["filename"]
-            ext = json.dict["technical"]["extension"]
-            self.media_files_md.append(filename + '.' + ext)
 
-        self.media_files_md = set(self.media_files_md)
+    def get_metadata_json(self, filename):
+        '''
+        contents of a JSON sidecar, parsed at most once per bag
+        '''
+        if filename not in self.metadata_json:
+            self.metadata_json[filename] = aj.load_json_dict(os.path.join(self.path, filename))
+
+        return self.metadata_json[filename]
 
-        return
 
+    @property
+    def media_files_md(self):
+        '''
+        media filenames described by the bag's metadata
+        for JSON bags, the sidecars are only read the first time this is needed
+        '''
+        if self._media_files_md is None and self.type in ("json", "excel-json"):
+            media_files_md = set()
+            for filename in self.metadata_files:
+                try:
+                    md = self.get_metadata_json(filename)
+                except aj.AMIJSONError as e:
+                    raise ami_bagError(e.message)
+
+                media_filename = aj.get_dotKeyValue(md, "technical.filename")
+                ext = aj.get_dotKeyValue(md, "technical.extension")
+                if not media_filename or not ext:
+                    raise ami_bagError("{} does not have a technical filename and extension".format(filename))
+                media_files_md.add(media_filename + '.' + ext)
+            self._media_files_md = media_files_md
+
+        return self._media_files_md
+
+
+    @media_files_md.setter
+    def media_files_md(self, value):
+        self._media_files_md = value
 
-    def check_metadata_json(self):
+
+    @profiling.timed("check_metadata_json")
+    def check_metadata_json(self, workers = 1):
+        '''
+        validate every JSON sidecar, using a pool of threads if workers > 1
+        time spent on each sidecar is kept in metadata_json_timings
+        '''
         if not self.metadata_files:
             raise ami_bagError("JSON bag does not contain any files with json extension")
 
-        bad_json = []
+        self.metadata_json_timings = {}
 
-        for filename in self.metadata_files:
-            json_filepath = os.path.join(self.path, filename)
-            json = aj.ami_json(filepath = json_filepath)
-            ext = json.dict['technical']['extension']
-            json.set_mediafilepath(json_filepath.replace('json', ext))
-            try:
-                json.validate_json()
-            except:
-                bad_json.append(filename)
+        if workers > 1 and len(self.metadata_files) > 1:
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                results = list(pool.map(profiling.in_current_scope(self.validate_metadata_json),
+                    self.metadata_files))
+        else:
+            results = [self.validate_metadata_json(filename) for filename in self.metadata_files]
+
+        bad_json = [filename for filename, valid in zip(self.metadata_files, results) if not valid]
 
         if bad_json:
             raise ami_bagError(f"JSON files contain formatting errors: {bad_json}")
@@ -602,6 +737,33 @@ class ami_bag(update_bag.Repairable_Bag):
         return True
 
 
+    def validate_metadata_json(self, filename):
+        '''
+        validate a single JSON sidecar against its media file
+        return False if the sidecar could not be checked
+        '''
+        start_time = time.time()
+        valid = True
+
+        json_filepath = os.path.join(self.path, filename)
+        try:
+            json = aj.ami_json(filepath = json_filepath, load = False)
+            json.dict = self.get_metadata_json(filename)
+            json.set_mediaformattype()
+            ext = json.dict['technical']['extension']
+            json.set_mediafilepath(json_filepath.replace('json', ext))
+            json.validate_json()
+        except:
+            valid = False
+
+        elapsed = time.time() - start_time
+        self.metadata_json_timings[filename] = elapsed
+        LOGGER.debug("Checked {} in {:.2f}s".format(filename, elapsed))
+
+        return valid
+
+
+    @profiling.timed("check_filenames_md_manifest_concordance_json")
     def check_filenames_md_manifest_concordance_json(self):
         media_files_basenames = set([os.path.basename(path) for path in self.media_filepaths])
         if not self.media_files_md == media_files_basenames:
@@ -612,7 +774,7 @@ class ami_bag(update_bag.Repairable_Bag):
 
 
     def add_json_from_excel(self):
-        self.excel_metadata = [filename for filename in self.data_files if os.path.splitext(filename)[1] == ".xlsx"]
+        self.excel_metadata = [entry.path for entry in self.payload_index if entry.ext == ".xlsx"]
 
         for filename in self.excel_metadata:
             excel = ami_excel(os.path.join(self.path, filename))
@@ -5,6 +5,9 @@ FILENAME_REGEX = re.compile(
     re.IGNORECASE)
 SUBOBJECT_REGEX = re.compile("_v\d{2}(f\d{2})?([rspt]\d{2})+")
 SUBOBJECT_PART_REGEX = re.compile("_v\d{2}([frst\d]+)?(p|pt)\d{2}")
+# volume number and the face/region/stream/take/part codes that follow it
+VOLUME_REGEX = re.compile(r"_v(\d{2})((?:[a-z]+\d{2})*)", re.IGNORECASE)
+SUBOBJECT_CODE_REGEX = re.compile(r"([a-z]+)(\d{2})", re.IGNORECASE)
 
 MD_DIR = "Metadata"
 PM_DIR = "PreservationMasters"
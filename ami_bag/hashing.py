@@ -0,0 +1,94 @@
+import os
+import mmap
+import hashlib
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# largest read, smaller files are read with a buffer of their own size
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+# smaller files are always read, mapping them costs more than it saves
+MMAP_MIN_SIZE = 64 * 1024 * 1024
+
+
+def new_hashers(algorithms):
+  return dict((alg, hashlib.new(alg)) for alg in algorithms)
+
+
+def _advise_sequential(fd):
+  if hasattr(os, 'posix_fadvise'):
+    try:
+      os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except OSError:
+      pass
+
+
+def _update_from_reads(f, updates, block_size, size_hint = None):
+  """
+  read f into one reused buffer, passing each block to every digest
+  the buffer is no larger than size_hint, the expected bytes left to read
+  """
+  if size_hint is not None:
+    # a file that grows while it is read is still read to the end
+    block_size = max(1, min(block_size, size_hint))
+
+  total = 0
+  buffer = bytearray(block_size)
+  with memoryview(buffer) as view:
+    while True:
+      size = f.readinto(buffer)
+      if not size:
+        break
+      with view[:size] as block:
+        for update in updates:
+          update(block)
+      total += size
+
+  return total
+
+
+def _update_from_mmap(f, updates, block_size):
+  """
+  pass a mapped file to every digest a block at a time
+  """
+  with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+    with memoryview(mapped) as view:
+      for offset in range(0, len(mapped), block_size):
+        with view[offset:offset + block_size] as block:
+          for update in updates:
+            update(block)
+    return len(mapped)
+
+
+def hash_file(path, algorithms, block_size = DEFAULT_BLOCK_SIZE, use_mmap = False):
+  """
+  hash a file with every algorithm in a single pass over its contents
+  returns a dict of algorithm to hex digest and the number of bytes hashed
+  use_mmap maps files of at least MMAP_MIN_SIZE instead of reading them
+  """
+  hashers = new_hashers(algorithms)
+  updates = [hasher.update for hasher in hashers.values()]
+
+  with open(path, 'rb', buffering = 0) as f:
+    _advise_sequential(f.fileno())
+    file_size = os.fstat(f.fileno()).st_size
+    if use_mmap and file_size >= MMAP_MIN_SIZE:
+      total = _update_from_mmap(f, updates, block_size)
+    else:
+      total = _update_from_reads(f, updates, block_size, file_size)
+
+  return dict((alg, hasher.hexdigest()) for alg, hasher in hashers.items()), total
+
+
+def update_hashers(path, hashers, offset = 0, block_size = DEFAULT_BLOCK_SIZE):
+  """
+  pass a file from offset to its end to hashers that already hold the bytes
+  before offset, returns the number of bytes read
+  """
+  updates = [hasher.update for hasher in hashers.values()]
+
+  with open(path, 'rb', buffering = 0) as f:
+    f.seek(offset)
+    return _update_from_reads(f, updates, block_size,
+      os.fstat(f.fileno()).st_size - offset)
@@ -1,9 +1,13 @@
-import os, re, json, shutil, logging
+import os, re, json, time, shutil, hashlib, logging
 import datetime
 import sys
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 import bagit
 
+import ami_bag.hashing as hashing
+from ami_files.cache_dir import get_cache_dir
+
 
 SYSTEM_FILE_PATTERNS = {
     "Thumbs.db": {
@@ -24,17 +28,58 @@ SYSTEM_FILE_PATTERNS = {
     }
 }
 
+# cap on the combined size of files being hashed at once by the thread pool
+DEFAULT_MAX_INFLIGHT_BYTES = 2 * 1024 ** 3
+
+# seconds between progress reports during a fixity check
+FIXITY_PROGRESS_INTERVAL = 60
+
+FIXITY_CHECKPOINT_DIR = 'fixity-checkpoints'
+
 LOGGER = logging.getLogger(__name__)
 
+
+def fixity_checkpoint_path(bag_path):
+  """
+  default checkpoint file for a bag's fixity check, in the ami-tools cache
+  """
+  bag_path = os.path.abspath(bag_path)
+  name = hashlib.sha1(bag_path.encode('utf-8', 'surrogateescape')).hexdigest()
+  return os.path.join(get_cache_dir(), FIXITY_CHECKPOINT_DIR, name + '.jsonl')
+
+
+def stat_key(path):
+  """
+  size and mtime of a file, or None if it does not exist
+  """
+  try:
+    stat = os.stat(path)
+  except FileNotFoundError:
+    return None
+  return stat.st_size, stat.st_mtime_ns
+
+
+def format_duration(seconds):
+  return str(datetime.timedelta(seconds = int(seconds)))
+
 #NEED EXCEPTION CLASS
 
 class Repairable_Bag(bagit.Bag):
 
-  def __init__(self, repairer = None, dryrun = False, *args, **kwargs):
+  def __init__(self, repairer = None, dryrun = False, *args, hash_workers = 1,
+    max_inflight_bytes = DEFAULT_MAX_INFLIGHT_BYTES, use_mmap = False, **kwargs):
     super(Repairable_Bag, self).__init__(*args, **kwargs)
-    self.old_dir = os.path.abspath(os.path.curdir)
     self.manifests_updated = False
     self.dryrun = dryrun
+    self.hash_workers = max(1, hash_workers)
+    self.max_inflight_bytes = max_inflight_bytes
+    self.use_mmap = use_mmap
+    self._payload_snapshot = None
+    # hashes from the last tag manifest write, keyed on each file's size and mtime
+    self._tag_hashes = {}
+    # hashers holding the journal's contents, fed each append, and the
+    # journal's size and mtime they match
+    self._premis_journal_hashers = None
 
     if repairer:
       self.repairer = repairer
@@ -42,12 +87,22 @@ class Repairable_Bag(bagit.Bag):
       self.repairer = None
 
     self.premis_path = os.path.join(self.path, 'premis-events.json')
+    self.premis_journal_path = os.path.join(self.path, 'premis-events.jsonl')
     if os.path.isfile(self.premis_path):
       with open(self.premis_path, 'r') as f:
         self.premis_events = json.load(f)
     else:
       self.premis_events = []
 
+    journal_events = self.read_premisjournal()
+    # a compaction interrupted before the journal was removed, the journal
+    # is cleared before the next append
+    self.premis_journal_compacted = bool(journal_events and
+      self.premis_events[-len(journal_events):] == journal_events)
+    if not self.premis_journal_compacted:
+      self.premis_events.extend(journal_events)
+    self.premis_events_written = len(self.premis_events)
+
 
   def add_premisevent(self, process, msg, outcome, sw_agent, date = None,
     human_agent = None):
@@ -69,13 +124,176 @@ class Repairable_Bag(bagit.Bag):
     self.premis_events.append(premis_event)
 
 
+  def read_premisjournal(self):
+    """
+    read events appended to the journal, one JSON object per line
+    a line cut short by a crash is skipped
+    """
+    events = []
+    if not os.path.isfile(self.premis_journal_path):
+      return events
+
+    with open(self.premis_journal_path, 'r', encoding = 'utf-8') as f:
+      for line in f:
+        if not line.strip():
+          continue
+        try:
+          events.append(json.loads(line))
+        except ValueError:
+          LOGGER.warning("Skipping incomplete PREMIS event in {}".format(
+            self.premis_journal_path))
+
+    return events
+
+
   def write_premisjson(self):
-    with open(self.premis_path, 'w') as f:
+    """
+    append events added since the last write to the journal
+    each write is a single append, flushed to disk before returning
+    """
+    pending = self.premis_events[self.premis_events_written:]
+    if not pending:
+      return True
+
+    if self.premis_journal_compacted:
+      os.remove(self.premis_journal_path)
+      self.premis_journal_compacted = False
+      self._premis_journal_hashers = None
+
+    journal_hashers = self._premis_journal_hashers
+    self._premis_journal_hashers = None
+    if journal_hashers and journal_hashers[0] != stat_key(self.premis_journal_path):
+      journal_hashers = None
+
+    lines = "".join(json.dumps(event) + "\n" for event in pending).encode('utf-8')
+    with open(self.premis_journal_path, 'a+b') as f:
+      # start on a new line if the last append was cut short
+      if f.tell() > 0:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+          lines = b"\n" + lines
+      f.write(lines)
+      f.flush()
+      os.fsync(f.fileno())
+
+    if journal_hashers:
+      for hasher in journal_hashers[1].values():
+        hasher.update(lines)
+      self._premis_journal_hashers = (stat_key(self.premis_journal_path), journal_hashers[1])
+
+    self.premis_events_written = len(self.premis_events)
+    return True
+
+
+  def export_premisjson(self, path = None):
+    """
+    write every event as a single JSON array, the format of
+    premis-events.json, to path or premis-events.json by default
+    """
+    if not path:
+      path = self.premis_path
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
       json.dump(self.premis_events, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    self.forget_tag_hashes(path)
 
     return True
 
 
+  def compact_premisjson(self):
+    """
+    fold the journal into premis-events.json and remove it, then
+    rewrite the tag manifests to match
+    """
+    if self.dryrun or not os.path.isfile(self.premis_journal_path):
+      return False
+
+    self.export_premisjson()
+    os.remove(self.premis_journal_path)
+    self.premis_journal_compacted = False
+    self._premis_journal_hashers = None
+    self.premis_events_written = len(self.premis_events)
+    LOGGER.info("PREMIS events compacted into {}".format(self.premis_path))
+    self.write_tag_manifests()
+
+    return True
+
+
+  def payload_snapshot(self):
+    """
+    sizes of the files under data/, keyed by path relative to the bag
+    taken with a single walk and reused until invalidated, files deleted
+    through this bag are dropped from it as they go
+    """
+    if self._payload_snapshot is None:
+      snapshot = {}
+      for payload_file in super(Repairable_Bag, self).payload_files():
+        snapshot[payload_file] = os.stat(os.path.join(self.path, payload_file)).st_size
+      self._payload_snapshot = snapshot
+
+    return self._payload_snapshot
+
+
+  def invalidate_payload_snapshot(self):
+    """
+    forget the payload snapshot, e.g. after the payload changed on disk
+    """
+    self._payload_snapshot = None
+
+
+  def payload_files(self):
+    """
+    list payload files from the snapshot instead of walking data/ again
+    """
+    return iter(list(self.payload_snapshot()))
+
+
+  def validate(self, *args, **kwargs):
+    """
+    validate against a fresh look at the payload, shared by the
+    completeness and oxum checks
+    """
+    self.invalidate_payload_snapshot()
+    return super(Repairable_Bag, self).validate(*args, **kwargs)
+
+
+  def _validate_oxum(self):
+    """
+    bagit's oxum check, with sizes from the payload snapshot instead of
+    another stat of every payload file
+    """
+    oxum = self.info.get("Payload-Oxum")
+
+    if oxum is None:
+      return
+
+    if isinstance(oxum, list):
+      LOGGER.warning("bag-info.txt defines multiple Payload-Oxum values!")
+      oxum = oxum[0]
+
+    oxum_byte_count, oxum_file_count = oxum.split(".", 1)
+
+    if not oxum_byte_count.isdigit() or not oxum_file_count.isdigit():
+      raise bagit.BagError("Malformed Payload-Oxum value: {}".format(oxum))
+
+    oxum_byte_count = int(oxum_byte_count)
+    oxum_file_count = int(oxum_file_count)
+
+    snapshot = self.payload_snapshot()
+    total_bytes = sum(snapshot.values())
+    total_files = len(snapshot)
+
+    if oxum_file_count != total_files or oxum_byte_count != total_bytes:
+      raise bagit.BagValidationError(
+        "Payload-Oxum validation failed. Expected {} files and {} bytes"
+        " but found {} files and {} bytes".format(
+          oxum_file_count, oxum_byte_count, total_files, total_bytes))
+
+
   def check_oxum(self):
     try:
       self._validate_oxum()
@@ -88,13 +306,9 @@ class Repairable_Bag(bagit.Bag):
     if self.check_oxum():
       return False
 
-    total_bytes = 0
-    total_files = 0
-
-    for payload_file in self.payload_files():
-      payload_file = os.path.join(self.path, payload_file)
-      total_bytes += os.stat(payload_file).st_size
-      total_files += 1
+    snapshot = self.payload_snapshot()
+    total_bytes = sum(snapshot.values())
+    total_files = len(snapshot)
 
     generated_oxum = "{0}.{1}".format(total_bytes, total_files)
 
@@ -107,6 +321,7 @@ class Repairable_Bag(bagit.Bag):
       self.info["Payload-Oxum"] = generated_oxum
 
       try:
+        self.forget_tag_hashes("bag-info.txt")
         bagit._make_tag_file(os.path.join(self.path, "bag-info.txt"), self.info)
       except:
         LOGGER.error("Do not have permission to overwrite bag-info")
@@ -137,6 +352,7 @@ class Repairable_Bag(bagit.Bag):
           outcome = "Pass", sw_agent = sys._getframe().f_code.co_name)
 
       try:
+        self.forget_tag_hashes(manifest_path)
         with open(manifest_path, 'w') as manifest:
           for payload_file, hashes in self.entries.items():
             if payload_file.startswith("data" + os.sep):
@@ -153,12 +369,88 @@ class Repairable_Bag(bagit.Bag):
     return True
 
 
+  def tag_files(self):
+    """
+    list tag files relative to the bag root, excluding tag manifests
+    same selection as bagit._find_tag_files, which resolves paths against
+    the working directory instead of the bag
+    """
+    for name in os.listdir(self.path):
+      if name == "data":
+        continue
+      path = os.path.join(self.path, name)
+      if os.path.isfile(path):
+        if not name.startswith("tagmanifest-"):
+          yield name
+        continue
+      for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+          if filename.startswith("tagmanifest-"):
+            continue
+          yield os.path.relpath(os.path.join(dirpath, filename), self.path)
+
+
+  def forget_tag_hashes(self, path):
+    """
+    drop the recorded hashes of a tag file the bag is about to rewrite,
+    a rewrite can keep the size and land within the same mtime tick
+    """
+    self._tag_hashes.pop(os.path.relpath(os.path.join(self.path, path), self.path), None)
+
+
+  def hash_tag_file(self, tag_file, algorithms):
+    """
+    hash a tag file, reusing the hashes from the last tag manifest write
+    while its size and mtime are unchanged
+    the journal is hashed on from its last append instead of from the start
+    """
+    path = os.path.join(self.path, tag_file)
+    key = stat_key(path)
+    recorded = self._tag_hashes.get(tag_file)
+    if recorded and recorded[0] == key and set(recorded[1]) == algorithms:
+      return recorded[1]
+
+    if path == self.premis_journal_path:
+      hashes = self.hash_premisjournal(key, algorithms)
+    else:
+      hashes = self.hash_file(tag_file, algorithms)
+
+    self._tag_hashes[tag_file] = (key, hashes)
+    return hashes
+
+
+  def hash_premisjournal(self, key, algorithms):
+    """
+    digests of the journal from the hashers fed by write_premisjson,
+    reading the whole journal only when they do not match it
+    """
+    journal_hashers = self._premis_journal_hashers
+    if not journal_hashers or journal_hashers[0] != key or set(journal_hashers[1]) != algorithms:
+      LOGGER.debug("Hashing {}".format(self.premis_journal_path))
+      hashers = hashing.new_hashers(algorithms)
+      hashing.update_hashers(self.premis_journal_path, hashers)
+      journal_hashers = (key, hashers)
+      self._premis_journal_hashers = journal_hashers
+
+    return dict((alg, hasher.hexdigest()) for alg, hasher in journal_hashers[1].items())
+
+
   def write_tag_manifests(self):
-    for alg in set(self.algorithms):
+    algorithms = set(self.algorithms)
+    tag_hashes = []
+    for tag_file in self.tag_files():
+      tag_hashes.append((tag_file, self.hash_tag_file(tag_file, algorithms)))
+
+    for alg in algorithms:
+      tagmanifest_path = os.path.join(self.path, 'tagmanifest-{}.txt'.format(alg))
       try:
-        bagit._make_tagmanifest_file(alg, self.path)
+        with open(tagmanifest_path, 'w', encoding = 'utf-8') as tagmanifest:
+          for tag_file, hashes in tag_hashes:
+            tagmanifest.write("{} {}\n".format(hashes[alg], tag_file))
       except:
         LOGGER.error("Do not have permission to overwrite tag manifests")
+      else:
+        LOGGER.info("{} written".format(tagmanifest_path))
 
     return True
 
@@ -180,20 +472,35 @@ class Repairable_Bag(bagit.Bag):
     """
     find all dem new files
     """
-    if self.compare_manifests_with_fs()[1]:
-      for payload_file in self.compare_manifests_with_fs()[1]:
-        yield payload_file
+    for payload_file in self.compare_manifests_with_fs()[1]:
+      yield payload_file
 
 
-  def add_new_hashes_for_file(self, payload_file):
+  def hash_file(self, bag_file, algorithms):
     """
-    add new hashes for each new files
+    hash a file relative to the bag root with each algorithm, reading it once
     """
-    new_hashes = {}
-    results = bagit.generate_manifest_lines(payload_file, self.algorithms)
+    LOGGER.debug("Hashing {}".format(bag_file))
+    hashes, size = hashing.hash_file(os.path.join(self.path, bag_file),
+      algorithms, use_mmap = self.use_mmap)
+    return hashes
 
-    for line in results:
-        new_hashes[line[0]] = line[1]
+
+  def calculate_hashes(self, payload_file):
+    """
+    hash a payload file with every algorithm in the bag
+    """
+    return self.hash_file(payload_file, self.algorithms)
+
+
+  def update_entry(self, payload_file, new_hashes):
+    """
+    record hashes for a payload file, return True if the manifest changed
+    """
+    if self._payload_snapshot is not None and payload_file in self._payload_snapshot:
+      # a file being rehashed may have changed size since the snapshot
+      self._payload_snapshot[payload_file] = os.path.getsize(
+        os.path.join(self.path, payload_file))
 
     if payload_file not in self.entries.keys():
       self.entries[payload_file] = new_hashes
@@ -205,20 +512,247 @@ class Repairable_Bag(bagit.Bag):
       return False
 
 
+  def add_new_hashes_for_file(self, payload_file):
+    """
+    add new hashes for each new files
+    """
+    return self.update_entry(payload_file, self.calculate_hashes(payload_file))
+
+
+  def hash_payload_files(self, payload_files):
+    """
+    hash payload files on a pool of self.hash_workers threads
+    no new file is started while the files in progress add up to more
+    than self.max_inflight_bytes, unless nothing else is in progress
+    returns a dict of payload file to hashes
+    """
+    results = {}
+
+    if self.hash_workers == 1:
+      for payload_file in payload_files:
+        results[payload_file] = self.calculate_hashes(payload_file)
+      return results
+
+    pending = {}
+    inflight_bytes = 0
+
+    def collect(futures):
+      nonlocal inflight_bytes
+      for future in futures:
+        payload_file, size = pending.pop(future)
+        inflight_bytes -= size
+        results[payload_file] = future.result()
+
+    with ThreadPoolExecutor(max_workers = self.hash_workers) as pool:
+      for payload_file in payload_files:
+        size = os.path.getsize(os.path.join(self.path, payload_file))
+        while pending and inflight_bytes + size > self.max_inflight_bytes:
+          done, _ = wait(pending, return_when = FIRST_COMPLETED)
+          collect(done)
+
+        future = pool.submit(self.calculate_hashes, payload_file)
+        pending[future] = (payload_file, size)
+        inflight_bytes += size
+
+      done, _ = wait(pending)
+      collect(done)
+
+    return results
+
+
+  def add_new_hashes_for_files(self, payload_files):
+    """
+    hash payload files concurrently, then fill in self.entries
+    returns the files whose hashes changed
+    """
+    updated_files = []
+
+    new_hashes = self.hash_payload_files(payload_files)
+    for payload_file in sorted(new_hashes):
+      if self.update_entry(payload_file, new_hashes[payload_file]):
+        updated_files.append(payload_file)
+
+    return updated_files
+
+
+  def manifests_digest(self):
+    """
+    digest of the manifest and tag manifest files, a checkpoint only
+    applies while the hashes it was checked against are unchanged
+    """
+    digest = hashlib.sha256()
+    for manifest in sorted(list(self.manifest_files()) + list(self.tagmanifest_files())):
+      digest.update(os.path.basename(manifest).encode('utf-8') + b'\0')
+      with open(manifest, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+  def read_fixity_checkpoint(self, checkpoint_path, manifests_digest):
+    """
+    return files verified by an earlier run as a dict of path to
+    (size, mtime_ns), ignoring the checkpoint if the manifests changed
+    a line cut short by an interrupted run is skipped
+    """
+    verified = {}
+    if not os.path.isfile(checkpoint_path):
+      return verified
+
+    with open(checkpoint_path, 'r', encoding = 'utf-8') as f:
+      for i, line in enumerate(f):
+        try:
+          record = json.loads(line)
+        except ValueError:
+          continue
+        if i == 0:
+          if record.get('manifests') != manifests_digest:
+            LOGGER.info("Manifests changed since the last checkpoint, checking all files")
+            return {}
+          continue
+        verified[record['path']] = (record['size'], record['mtime_ns'])
+
+    return verified
+
+
+  def check_entry_fixity(self, payload_file):
+    """
+    hash a file with the algorithms recorded for it in the manifests
+    returns the file, its stat, and a list of bagit.ChecksumMismatch, or
+    no stat and a bagit.FileMissing if the file is not on disk
+    a file that cannot be read fails every checksum, as in bagit
+    """
+    hashes = self.entries[payload_file]
+    fs_path = self.normalized_filesystem_names.get(payload_file, payload_file)
+
+    stat = None
+    try:
+      stat = os.stat(os.path.join(self.path, fs_path))
+      computed_hashes = self.hash_file(fs_path, hashes)
+    except FileNotFoundError:
+      return payload_file, None, [bagit.FileMissing(payload_file)]
+    except OSError as e:
+      LOGGER.warning("Unable to read {}: {}".format(payload_file, e))
+      computed_hashes = dict.fromkeys(hashes, str(e))
+
+    errors = []
+    for alg, computed_hash in computed_hashes.items():
+      stored_hash = hashes[alg].lower()
+      if stored_hash != computed_hash:
+        errors.append(bagit.ChecksumMismatch(payload_file, alg, stored_hash, computed_hash))
+
+    return payload_file, stat, errors
+
+
+  def validate_fixity(self, checkpoint_path = None,
+    progress_interval = FIXITY_PROGRESS_INTERVAL):
+    """
+    rehash every manifest entry, recording each verified file in a
+    checkpoint so an interrupted run resumes where it stopped
+    files already verified are skipped while their size and mtime match
+    progress is logged in MB/s with an ETA every progress_interval seconds
+    the checkpoint is removed once every file has been checked
+    raises bagit.BagValidationError if any file does not match
+    """
+    if not checkpoint_path:
+      checkpoint_path = fixity_checkpoint_path(self.path)
+
+    digest = self.manifests_digest()
+    verified = self.read_fixity_checkpoint(checkpoint_path, digest)
+
+    to_check = []
+    total_bytes = 0
+    skipped = 0
+    for payload_file in sorted(self.entries):
+      fs_path = self.normalized_filesystem_names.get(payload_file, payload_file)
+      try:
+        stat = os.stat(os.path.join(self.path, fs_path))
+      except OSError:
+        # reported as missing or unreadable when the file is checked
+        to_check.append(payload_file)
+        continue
+      if verified.get(payload_file) == (stat.st_size, stat.st_mtime_ns):
+        skipped += 1
+        continue
+      to_check.append(payload_file)
+      total_bytes += stat.st_size
+
+    if skipped:
+      LOGGER.info("Resuming fixity check, {} of {} files already verified".format(
+        skipped, len(self.entries)))
+
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok = True)
+    mode = 'a' if verified else 'w'
+    errors = []
+    done_bytes = 0
+    start = last_report = time.monotonic()
+
+    with open(checkpoint_path, mode, encoding = 'utf-8') as checkpoint:
+      if mode == 'w':
+        checkpoint.write(json.dumps({'bag': os.path.abspath(self.path), 'manifests': digest}) + '\n')
+
+      futures = []
+      if self.hash_workers > 1:
+        pool = ThreadPoolExecutor(max_workers = self.hash_workers)
+        futures = [pool.submit(self.check_entry_fixity, payload_file)
+          for payload_file in to_check]
+        results = (future.result() for future in futures)
+      else:
+        pool = None
+        results = map(self.check_entry_fixity, to_check)
+
+      try:
+        for checked, (payload_file, stat, file_errors) in enumerate(results, 1):
+          if stat:
+            done_bytes += stat.st_size
+          if file_errors:
+            for e in file_errors:
+              LOGGER.warning(str(e))
+            errors.extend(file_errors)
+          else:
+            checkpoint.write(json.dumps({'path': payload_file,
+              'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}) + '\n')
+            checkpoint.flush()
+
+          now = time.monotonic()
+          if now - last_report >= progress_interval:
+            last_report = now
+            rate = done_bytes / (now - start)
+            eta = (total_bytes - done_bytes) / rate if rate else 0
+            LOGGER.info("Checked {} of {} files, {:.0f} of {:.0f} MB at {:.1f} MB/s, ETA {}".format(
+              checked, len(to_check), done_bytes / 1e6, total_bytes / 1e6,
+              rate / 1e6, format_duration(eta)))
+            os.fsync(checkpoint.fileno())
+      finally:
+        if pool:
+          # an interrupted check should not wait for files it never reached
+          for future in futures:
+            future.cancel()
+          pool.shutdown(wait = True)
+
+    elapsed = time.monotonic() - start
+    LOGGER.info("Checked {} files, {:.0f} MB in {} ({:.1f} MB/s)".format(
+      len(to_check), done_bytes / 1e6, format_duration(elapsed),
+      done_bytes / 1e6 / elapsed if elapsed else 0))
+
+    os.remove(checkpoint_path)
+
+    if errors:
+      raise bagit.BagValidationError("Bag validation failed", errors)
+
+    return True
+
+
   def add_payload_files_not_in_manifest(self):
     """
     iterate through all dem new files
     """
-    os.chdir(self.path)
-
     new_payload_files = list(self.payload_files_not_in_manifest())
 
     if new_payload_files:
       LOGGER.info("Adding the following files to manifests: {}".format(", ".join(new_payload_files)))
       self.manifests_updated = True
 
-      for payload_file in self.payload_files_not_in_manifest():
-        self.add_new_hashes_for_file(payload_file)
+      self.add_new_hashes_for_files(new_payload_files)
 
       self.add_premisevent(process = "Bag Payload Update",
         msg = "Added the following files to the bag payload: {}".format(
@@ -227,12 +761,8 @@ class Repairable_Bag(bagit.Bag):
 
       self.write_bag_updates()
 
-    os.chdir(self.old_dir)
-
 
   def update_hashes(self, filename_pattern = None):
-    os.chdir(self.path)
-
     payload_files = set(self.payload_entries().keys())
 
     if filename_pattern:
@@ -244,11 +774,9 @@ class Repairable_Bag(bagit.Bag):
     if files_to_update:
       LOGGER.info("Potentially updating hashes for the following files: {}".format(", ".join(files_to_update)))
 
-      for payload_file in files_to_update:
-        updated_files = []
-        if self.add_new_hashes_for_file(payload_file):
-          self.manifests_updated = True
-          updated_files.append(payload_file)
+      updated_files = self.add_new_hashes_for_files(files_to_update)
+      if updated_files:
+        self.manifests_updated = True
 
       if self.manifests_updated:
         self.add_premisevent(process = "Bag Payload Hash Update",
@@ -258,8 +786,6 @@ class Repairable_Bag(bagit.Bag):
 
       self.write_bag_updates()
 
-    os.chdir(self.old_dir)
-
 
   def delete_payload_files_not_in_manifest(self, rules = SYSTEM_FILE_PATTERNS):
     """
@@ -282,15 +808,16 @@ class Repairable_Bag(bagit.Bag):
     if files_not_to_delete:
       LOGGER.warning("Untracked files in payload directory do not match deletion rules: {}".format(", ".join(files_not_to_delete)))
 
-    os.chdir(self.path)
     if files_to_delete:
       LOGGER.warning("Will delete the following files: {}".format(", ".join(files_to_delete)))
       for payload_file in files_to_delete:
         try:
           LOGGER.warning("Deleting {}".format(payload_file))
-          os.remove(payload_file)
+          os.remove(os.path.join(self.path, payload_file))
         except OSError:
           LOGGER.error("Do not have permission to delete {}".format(payload_file))
+        else:
+          self.payload_snapshot().pop(payload_file, None)
 
       self.add_premisevent(process = "Update Bag Payload",
         msg = "Deleted untracked files from the payload directory: {}".format(
@@ -300,10 +827,7 @@ class Repairable_Bag(bagit.Bag):
       if not self.check_oxum():
         self.write_bag_updates()
 
-    os.chdir(self.old_dir)
-
   def delete_manifest_files_not_in_payload(self):
-    os.chdir(self.path)
     manifest_payload_files = set([x for x in self.entries.keys() if x[0:4] == 'data'])
     extra_manifest_entries = manifest_payload_files - set(self.payload_files())
 
@@ -319,5 +843,3 @@ class Repairable_Bag(bagit.Bag):
 
     if extra_manifest_entries:
       self.write_bag_updates()
-      
-    os.chdir(self.old_dir)
@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import functools
+import threading
+
+import bagit
+
+from ami_files.cache_dir import get_cache_dir
+
+LOGGER = logging.getLogger(__name__)
+
+LEDGER_FILENAME = 'validation-ledger.sqlite'
+
+# bumped whenever the verdicts table changes, older tables are dropped
+LEDGER_SCHEMA_VERSION = 2
+
+# packages whose code decides a verdict, see checks_version
+CHECK_PACKAGES = ('ami_bag', 'ami_md', 'ami_files')
+
+
+def bag_fingerprint(bag_path):
+    """
+    Digest of a bag's top-level tag files and its payload listing.
+    Tag files are hashed by content, payload files by path, size and mtime,
+    so any repair, added file, or touched file changes the fingerprint.
+    """
+    bag_path = os.path.abspath(bag_path)
+    digest = hashlib.sha256()
+
+    with os.scandir(bag_path) as it:
+        tag_files = sorted(entry.name for entry in it if entry.is_file())
+    for tag_file in tag_files:
+        digest.update(tag_file.encode('utf-8') + b'\0')
+        with open(os.path.join(bag_path, tag_file), 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+
+    data_path = os.path.join(bag_path, 'data')
+    for dirpath, dirnames, filenames in os.walk(data_path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(dirpath, filename)
+            stat = os.lstat(filepath)
+            digest.update('{}\0{}\0{}\n'.format(
+                os.path.relpath(filepath, bag_path), stat.st_size, stat.st_mtime_ns
+            ).encode('utf-8', 'surrogateescape'))
+
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def checks_version():
+    """
+    Digest of the code and constants behind check_amibag and the bagit
+    version, so verdicts recorded by another build of the tools are not reused
+    """
+    digest = hashlib.sha256(bagit.VERSION.encode('utf-8') + b'\0')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    for package in CHECK_PACKAGES:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, package)):
+            dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+            for filename in sorted(filenames):
+                if filename.endswith('.pyc'):
+                    continue
+                filepath = os.path.join(dirpath, filename)
+                digest.update(os.path.relpath(filepath, root).encode('utf-8') + b'\0')
+                with open(filepath, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+
+    return digest.hexdigest()
+
+
+class ValidationLedger:
+    """
+    SQLite record of check_amibag verdicts, one per bag, set of check
+    options and checks version. A verdict is only returned while the bag's
+    fingerprint matches.
+    """
+    def __init__(self, path=None, checks=None):
+        if not path:
+            path = os.path.join(get_cache_dir(), LEDGER_FILENAME)
+        self.path = path
+        self.checks = checks or checks_version()
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=30,
+                                          check_same_thread=False)
+        with self.connection:
+            schema_version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+            if schema_version < LEDGER_SCHEMA_VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS verdicts')
+                self.connection.execute('PRAGMA user_version = {}'.format(LEDGER_SCHEMA_VERSION))
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS verdicts ('
+                'path TEXT, fast INTEGER, metadata INTEGER, checks TEXT, '
+                'fingerprint TEXT, warning INTEGER, error INTEGER, checked REAL, '
+                'PRIMARY KEY (path, fast, metadata, checks))')
+
+    def get(self, bag_path, fingerprint, fast, metadata):
+        """
+        Return (warning, error, checked time) from the last check of an
+        unchanged bag, or None if the bag has not been checked or has changed
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT fingerprint, warning, error, checked FROM verdicts '
+                'WHERE path = ? AND fast = ? AND metadata = ? AND checks = ?',
+                (os.path.abspath(bag_path), bool(fast), bool(metadata),
+                 self.checks)).fetchone()
+
+        if not row or row[0] != fingerprint:
+            return None
+
+        return bool(row[1]), bool(row[2]), row[3]
+
+    def put(self, bag_path, fingerprint, fast, metadata, warning, error):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(bag_path), bool(fast), bool(metadata),
+                 self.checks, fingerprint, bool(warning), bool(error), time.time()))
+
+    def close(self):
+        self.connection.close()
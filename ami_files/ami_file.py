@@ -5,6 +5,8 @@ from datetime import datetime
 from dateutil import parser
 
 import ami_files.ami_file_constants as ami_file_constants
+import ami_files.mediainfo_cache as mediainfo_cache
+import ami_files.profiling as profiling
 
 LOGGER = logging.getLogger(__name__)
 
@@ -16,7 +18,8 @@ class AMIFileError(Exception):
 
 
 class ami_file:
-  def __init__(self, filepath, mi = True):
+  @profiling.timed("ami_file")
+  def __init__(self, filepath, mi = True, cache = True):
     if os.path.isfile(filepath):
       self.filepath = os.path.abspath(filepath)
       self.filename = os.path.basename(self.filepath)
@@ -24,7 +27,7 @@ class ami_file:
       self.raise_AMIFileError('{} is not a valid filepath'.format(filepath))
 
     if mi:
-      self.set_techmd_values()
+      self.set_techmd_values(cache)
     else:
       self.date_filesys_created = datetime.fromtimestamp(os.path.getctime(self.filepath)).strftime('%Y-%m-%d')
       self.extension =  os.path.splitext(self.filepath)[1][1:]
@@ -37,46 +40,64 @@ class ami_file:
       self.raise_AMIFileError('{} does not appear to be an accepted audio or video format.'.format(self.filename))
 
 
-  def set_techmd_values(self):
-    try:
-      techmd = MediaInfo.parse(self.filepath)
-    except:
-      self.raise_AMIFileError('pymediainfo failed to run so techmd has not been parsed')
-
+  def set_techmd_values(self, cache = True):
     md_track = None
-    for track in techmd.tracks:
-      if track.track_type == "General":
-        md_track = track
+    if cache:
+      md_track = mediainfo_cache.get_cached_fields(self.filepath)
 
     if not md_track:
-      self.raise_AMIFileError('Could not find General track')
+      md_track = self.parse_general_track()
+      if cache:
+        mediainfo_cache.cache_fields(self.filepath, md_track)
 
-    self.base_filename = md_track.file_name.rsplit('.')[0]
-    self.extension = md_track.file_extension
-    self.format = md_track.format
-    self.size = md_track.file_size
+    self.base_filename = md_track["file_name"].rsplit('.')[0]
+    self.extension = md_track["file_extension"]
+    self.format = md_track["format"]
+    self.size = md_track["file_size"]
 
     self.date_filesys_created = datetime.fromtimestamp(os.path.getctime(self.filepath)).strftime('%Y-%m-%d')
-    if md_track.encoded_date:
-      self.date_created = parse_date(md_track.encoded_date)
-    elif md_track.file_last_modification_date:
-      self.date_created = parse_date(md_track.file_last_modification_date)
+    if md_track["encoded_date"]:
+      self.date_created = parse_date(md_track["encoded_date"])
+    elif md_track["file_last_modification_date"]:
+      self.date_created = parse_date(md_track["file_last_modification_date"])
     else:
       self.date_created = self.date_filesys_created
 
-    if md_track.duration:
-      self.duration_milli = md_track.duration
+    if md_track["duration"]:
+      self.duration_milli = md_track["duration"]
       self.duration_human = parse_duration(self.duration_milli)
 
-    if not md_track.audio_codecs:
+    if not md_track["audio_codecs"]:
       pass
-    elif '/' in md_track.audio_codecs:
-      self.audio_codec = '|'.join(set(x.strip() for x in md_track.audio_codecs.split('/')))
+    elif '/' in md_track["audio_codecs"]:
+      self.audio_codec = '|'.join(set(x.strip() for x in md_track["audio_codecs"].split('/')))
     else:
-      self.audio_codec = md_track.audio_codecs
+      self.audio_codec = md_track["audio_codecs"]
+
+    if md_track["codecs_video"]:
+      self.video_codec = md_track["codecs_video"]
+
+
+  @profiling.timed("mediainfo", nbytes = lambda self: os.path.getsize(self.filepath))
+  def parse_general_track(self):
+    """
+    Run MediaInfo and return the General track fields as a dict
+    """
+    try:
+      techmd = MediaInfo.parse(self.filepath)
+    except:
+      self.raise_AMIFileError('pymediainfo failed to run so techmd has not been parsed')
+
+    md_track = None
+    for track in techmd.tracks:
+      if track.track_type == "General":
+        md_track = track
+
+    if not md_track:
+      self.raise_AMIFileError('Could not find General track')
 
-    if md_track.codecs_video:
-      self.video_codec = md_track.codecs_video
+    return dict((field, getattr(md_track, field))
+      for field in ami_file_constants.GENERAL_TRACK_FIELDS)
 
 
   def raise_AMIFileError(self, msg):
@@ -23,6 +23,11 @@ SC_ENDING = "sc"
 
 FILE_ROLES = [AO_ENDING, PM_ENDING, EM_ENDING, SC_ENDING, MZ_ENDING]
 
+# General track attributes used by ami_file, and stored in the MediaInfo cache
+GENERAL_TRACK_FIELDS = ["file_name", "file_extension", "format", "file_size",
+  "encoded_date", "file_last_modification_date", "duration", "audio_codecs",
+  "codecs_video"]
+
 FN_NOEXT_RE = r"^[a-z]{3}_[a-z\d\-\*_]+_([vfrspt]\d{2})+_(ao|pm|em|sc|mz)$"
 STUB_FN_NOEXT_RE = r"^[a-z]{3}_[a-z\d\-\*_]+_([vfrspt]\d{2})+_(ao|pm|em|sc|mz)"
 regex_roles = "|".join(FILE_ROLES)
@@ -0,0 +1,18 @@
+import os
+
+CACHE_DIR_ENV = 'AMI_TOOLS_CACHE_DIR'
+
+
+def get_cache_dir():
+  """
+  Directory for ami-tools caches. Uses $AMI_TOOLS_CACHE_DIR if set,
+  otherwise an ami-tools directory in the user cache directory.
+  """
+  cache_dir = os.environ.get(CACHE_DIR_ENV)
+  if not cache_dir:
+    user_cache = os.environ.get('XDG_CACHE_HOME')
+    if not user_cache:
+      user_cache = os.path.join(os.path.expanduser('~'), '.cache')
+    cache_dir = os.path.join(user_cache, 'ami-tools')
+
+  return cache_dir
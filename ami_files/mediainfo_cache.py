@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from ami_files.cache_dir import get_cache_dir
+
+LOGGER = logging.getLogger(__name__)
+
+NO_CACHE_ENV = 'AMI_TOOLS_NO_MEDIAINFO_CACHE'
+CACHE_FILENAME = 'mediainfo.sqlite'
+DEFAULT_MAX_ENTRIES = 100000
+# eviction frees this fraction of max_entries, so it runs once per that many inserts
+EVICT_FRACTION = 0.1
+
+
+def cache_enabled():
+  """
+  The cache is bypassed when $AMI_TOOLS_NO_MEDIAINFO_CACHE is set, which
+  also carries the setting into worker processes.
+  """
+  return not os.environ.get(NO_CACHE_ENV)
+
+
+def disable_cache():
+  os.environ[NO_CACHE_ENV] = '1'
+
+
+class MediaInfoCache:
+  """
+  SQLite store of parsed MediaInfo General track fields.
+
+  Entries are keyed by absolute path and only returned while the file's
+  size, mtime and inode are unchanged. Once there are more than
+  max_entries, the least recently used entries are dropped to make room
+  for the next EVICT_FRACTION of max_entries. Entries are counted when
+  the cache is opened and then tracked, other processes sharing the file
+  are only seen when evicting.
+  """
+  def __init__(self, path = None, max_entries = DEFAULT_MAX_ENTRIES):
+    if not path:
+      path = os.path.join(get_cache_dir(), CACHE_FILENAME)
+    self.path = path
+    self.max_entries = max_entries
+    self.lock = threading.Lock()
+
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+    self.connection = sqlite3.connect(self.path, timeout = 30,
+      check_same_thread = False)
+    with self.connection:
+      self.connection.execute(
+        'CREATE TABLE IF NOT EXISTS general_tracks ('
+        'path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, '
+        'fields TEXT, last_used REAL)')
+      self.connection.execute(
+        'CREATE INDEX IF NOT EXISTS general_tracks_last_used '
+        'ON general_tracks (last_used)')
+      self.entries = self.count_entries()
+      if self.entries > self.max_entries:
+        self.evict()
+
+
+  def count_entries(self):
+    return self.connection.execute(
+      'SELECT COUNT(*) FROM general_tracks').fetchone()[0]
+
+
+  def evict(self):
+    """
+    drop the least recently used entries, down to max_entries less
+    EVICT_FRACTION of it
+    """
+    self.entries = self.count_entries()
+    if self.entries <= self.max_entries:
+      return
+
+    keep = self.max_entries - int(self.max_entries * EVICT_FRACTION)
+    self.connection.execute(
+      'DELETE FROM general_tracks WHERE path IN ('
+      'SELECT path FROM general_tracks ORDER BY last_used LIMIT ?)',
+      (self.entries - keep,))
+    self.entries = keep
+
+
+  def get(self, filepath):
+    """
+    Return cached fields for filepath, or None if missing or out of date
+    """
+    path, size, mtime, inode = file_key(filepath)
+
+    with self.lock, self.connection:
+      row = self.connection.execute(
+        'SELECT size, mtime, inode, fields FROM general_tracks WHERE path = ?',
+        (path,)).fetchone()
+      if not row:
+        return None
+      if row[0:3] != (size, mtime, inode):
+        self.connection.execute(
+          'DELETE FROM general_tracks WHERE path = ?', (path,))
+        self.entries -= 1
+        return None
+      self.connection.execute(
+        'UPDATE general_tracks SET last_used = ? WHERE path = ?',
+        (time.time(), path))
+
+    return json.loads(row[3])
+
+
+  def put(self, filepath, fields):
+    path, size, mtime, inode = file_key(filepath)
+
+    with self.lock, self.connection:
+      row = (size, mtime, inode, json.dumps(fields), time.time(), path)
+      updated = self.connection.execute(
+        'UPDATE general_tracks SET size = ?, mtime = ?, inode = ?, '
+        'fields = ?, last_used = ? WHERE path = ?', row).rowcount
+      if not updated:
+        self.connection.execute(
+          'INSERT OR REPLACE INTO general_tracks (size, mtime, inode, fields, last_used, path) '
+          'VALUES (?, ?, ?, ?, ?, ?)', row)
+        self.entries += 1
+        if self.entries > self.max_entries:
+          self.evict()
+
+
+  def close(self):
+    self.connection.close()
+
+
+def file_key(filepath):
+  path = os.path.abspath(filepath)
+  stat = os.stat(path)
+  return path, stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+_DEFAULT_CACHE = None
+_DEFAULT_CACHE_PID = None
+_DEFAULT_CACHE_LOCK = threading.Lock()
+
+def get_default_cache():
+  """
+  Shared cache for the process, or None if the cache is disabled or
+  cannot be opened.
+  """
+  global _DEFAULT_CACHE, _DEFAULT_CACHE_PID
+
+  if not cache_enabled():
+    return None
+
+  with _DEFAULT_CACHE_LOCK:
+    # sqlite connections cannot be shared with forked worker processes
+    if _DEFAULT_CACHE is None or _DEFAULT_CACHE_PID != os.getpid():
+      try:
+        _DEFAULT_CACHE = MediaInfoCache()
+        _DEFAULT_CACHE_PID = os.getpid()
+      except (OSError, sqlite3.Error) as e:
+        LOGGER.warning('MediaInfo cache unavailable, parsing every file: {}'.format(e))
+        disable_cache()
+        return None
+
+  return _DEFAULT_CACHE
+
+
+def get_cached_fields(filepath):
+  """
+  Look up filepath in the default cache, treating any cache error as a miss
+  """
+  md_cache = get_default_cache()
+  if not md_cache:
+    return None
+
+  try:
+    return md_cache.get(filepath)
+  except (OSError, sqlite3.Error) as e:
+    LOGGER.debug('MediaInfo cache lookup failed for {}: {}'.format(filepath, e))
+    return None
+
+
+def cache_fields(filepath, fields):
+  md_cache = get_default_cache()
+  if not md_cache:
+    return
+
+  try:
+    md_cache.put(filepath, fields)
+  except (OSError, sqlite3.Error) as e:
+    LOGGER.debug('MediaInfo cache update failed for {}: {}'.format(filepath, e))
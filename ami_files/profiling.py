@@ -0,0 +1,199 @@
+import os
+import csv
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+FIELDS = ['bag', 'phase', 'calls', 'seconds', 'bytes']
+
+_ENABLED = False
+_RECORDS = {}
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def enable():
+  global _ENABLED
+  _ENABLED = True
+
+
+def disable():
+  global _ENABLED
+  _ENABLED = False
+
+
+def is_enabled():
+  return _ENABLED
+
+
+def reset():
+  with _LOCK:
+    _RECORDS.clear()
+
+
+def add_record(phase, seconds, nbytes = 0, calls = 1, bag = None):
+  if bag is None:
+    bag = getattr(_LOCAL, 'bag', '')
+
+  with _LOCK:
+    record = _RECORDS.setdefault((bag, phase), [0, 0.0, 0])
+    record[0] += calls
+    record[1] += seconds
+    record[2] += nbytes
+
+
+def _open_phases():
+  """
+  This thread's stack of running phases, each a [nested bytes] list
+  """
+  if not hasattr(_LOCAL, 'phases'):
+    _LOCAL.phases = []
+  return _LOCAL.phases
+
+
+@contextmanager
+def bag_scope(bag_path):
+  """
+  Attribute phases run by this thread to bag_path until the block ends
+  """
+  previous = getattr(_LOCAL, 'bag', '')
+  _LOCAL.bag = bag_path
+  try:
+    yield
+  finally:
+    _LOCAL.bag = previous
+
+
+def in_current_scope(func):
+  """
+  Wrap func so phases it records in another thread, e.g. in a thread
+  pool, are attributed to the calling thread's bag and their bytes to
+  the calling thread's running phase
+  """
+  bag = getattr(_LOCAL, 'bag', '')
+  parents = _open_phases()[-1:]
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    previous = _open_phases()
+    _LOCAL.phases = list(parents)
+    try:
+      with bag_scope(bag):
+        return func(*args, **kwargs)
+    finally:
+      _LOCAL.phases = previous
+  return wrapper
+
+
+@contextmanager
+def _measure(name):
+  """
+  Time the enclosed block as one call of the named phase. The block may
+  set its own byte count in the yielded list, otherwise the phase counts
+  the bytes of the phases run inside it. Either way its bytes are added
+  to the enclosing phase.
+  """
+  nested = [0]
+  own = [0]
+  phases = _open_phases()
+  phases.append(nested)
+  start = time.perf_counter()
+  try:
+    yield own
+  finally:
+    phases.pop()
+    nbytes = own[0] or nested[0]
+    add_record(name, time.perf_counter() - start, nbytes)
+    if phases:
+      with _LOCK:
+        phases[-1][0] += nbytes
+
+
+@contextmanager
+def phase(name, nbytes = 0):
+  """
+  Time the enclosed block as one call of the named phase. Does nothing
+  unless profiling has been enabled. Without nbytes, the phase reports
+  the bytes of the phases run inside it.
+  """
+  if not _ENABLED:
+    yield
+    return
+
+  with _measure(name) as own:
+    own[0] = nbytes
+    yield
+
+
+def timed(name, nbytes = None):
+  """
+  Decorator to time each call of a function as a phase.
+
+  Keyword arguments:
+  name -- phase name to record
+  nbytes -- optional function taking the same arguments as the timed
+  function and returning the number of bytes the call reads, without it
+  the call reports the bytes of the phases run inside it
+  """
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if not _ENABLED:
+        return func(*args, **kwargs)
+
+      with _measure(name) as own:
+        try:
+          return func(*args, **kwargs)
+        finally:
+          if nbytes:
+            try:
+              own[0] = nbytes(*args, **kwargs)
+            except (OSError, AttributeError):
+              own[0] = 0
+    return wrapper
+  return decorator
+
+
+def file_size(obj, path = None, *args, **kwargs):
+  """
+  nbytes helper for methods whose first argument, or own path, is a file
+  """
+  return os.path.getsize(path if path is not None else obj.path)
+
+
+def get_records():
+  """
+  Return recorded phases as a list of dicts sorted by bag and phase
+  """
+  with _LOCK:
+    return [
+      dict(zip(FIELDS, (bag, phase_name, calls, seconds, nbytes)))
+      for (bag, phase_name), (calls, seconds, nbytes) in sorted(_RECORDS.items())
+    ]
+
+
+def merge_records(records):
+  """
+  Add records collected elsewhere, e.g. in a worker process
+  """
+  for record in records:
+    add_record(record['phase'], record['seconds'], record['bytes'],
+      record['calls'], record['bag'])
+
+
+def dump(path):
+  """
+  Write recorded phases to path, as CSV if it ends in .csv, otherwise JSON
+  """
+  records = get_records()
+
+  if path.lower().endswith('.csv'):
+    with open(path, 'w', newline = '') as f:
+      writer = csv.DictWriter(f, fieldnames = FIELDS)
+      writer.writeheader()
+      writer.writerows(records)
+  else:
+    with open(path, 'w') as f:
+      json.dump(records, f, indent = 2)
@@ -1,8 +1,7 @@
-import os, re, csv, json, datetime, logging
+import os, re, csv, json, time, datetime, logging, threading
+from collections import OrderedDict
 
 # handling excel
-import xlrd
-from xlrd import xldate
 from openpyxl import load_workbook
 
 # data manipulation and output
@@ -12,6 +11,7 @@ import numpy as np
 # ami modules
 import ami_md.ami_md_constants as ami_md_constants
 import ami_md.ami_json as ami_json
+import ami_files.profiling as profiling
 
 
 LOGGER = logging.getLogger(__name__)
@@ -23,7 +23,229 @@ class AMIExcelError(Exception):
     return repr(self.value)
 
 
+WORKBOOK_CACHE_SIZE = 8
+
+_WORKBOOK_CACHE = OrderedDict()
+_WORKBOOK_CACHE_LOCK = threading.Lock()
+
+
+def open_workbook(path):
+  """
+  Return the shared ami_workbook for path. Workbooks are remembered by
+  path and reloaded only if the file's mtime or size has changed.
+  """
+  path = os.path.abspath(path)
+  stat = os.stat(path)
+  key = (stat.st_mtime_ns, stat.st_size)
+
+  with _WORKBOOK_CACHE_LOCK:
+    workbook = _WORKBOOK_CACHE.pop(path, None)
+    if workbook and workbook.key != key:
+      workbook.close()
+      workbook = None
+
+    if not workbook:
+      workbook = ami_workbook(path, key)
+
+    _WORKBOOK_CACHE[path] = workbook
+    while len(_WORKBOOK_CACHE) > WORKBOOK_CACHE_SIZE:
+      _WORKBOOK_CACHE.popitem(last = False)[1].close()
+
+  return workbook
+
+
+def clear_workbook_cache():
+  with _WORKBOOK_CACHE_LOCK:
+    while _WORKBOOK_CACHE:
+      _WORKBOOK_CACHE.popitem()[1].close()
+
+
+INLINE_FLAGS_REGEX = re.compile(r"\(\?([aiLmsux]+)\)")
+
+
+def compile_pattern(pattern):
+  """
+  Compile a replacement pattern. Inline flags written after the start,
+  e.g. '^(?i)full$', applied to the whole pattern before Python 3.11 and
+  are an error since, so they are moved to the front.
+  """
+  try:
+    return re.compile(pattern)
+  except re.error:
+    flags = "".join(INLINE_FLAGS_REGEX.findall(pattern))
+    if not flags:
+      raise
+    return re.compile("(?{}){}".format(flags, INLINE_FLAGS_REGEX.sub("", pattern)))
+
+
+def compile_replacements(regex_dict, string_dict):
+  """
+  Compile per-column replacement dictionaries once.
+  Returns a dict of column name to a tuple of (list of compiled regex and
+  replacement pairs, dict of whole value replacements).
+
+  Keyword arguments:
+  regex_dict -- column to {pattern: replacement}, as for df.replace(regex=True)
+  string_dict -- column to {value: replacement}, as for df.replace
+  """
+  rules = {}
+  for column in set(regex_dict) | set(string_dict):
+    regexes = [(compile_pattern(pattern), replacement)
+      for pattern, replacement in regex_dict.get(column, {}).items()]
+    rules[column] = (regexes, dict(string_dict.get(column, {})))
+
+  return rules
+
+
+REPLACEMENT_RULES = compile_replacements(
+  ami_md_constants.REGEX_REPLACE_DICT, ami_md_constants.STRING_REPLACE_DICT)
+
+
+def replace_value(value, regexes, strings):
+  """
+  Normalize one cell the way pandas does for df.replace with regexes then
+  df.replace with strings. Each pattern is tested against the original
+  cell and applied to the result of the patterns before it.
+  """
+  if regexes and isinstance(value, str):
+    original = value
+    for regex, replacement in regexes:
+      if not isinstance(value, str) or not regex.search(original):
+        continue
+      if isinstance(replacement, str):
+        value = regex.sub(replacement, value)
+      elif regex.search(value):
+        value = replacement
+
+  if strings:
+    try:
+      if value in strings:
+        value = strings[value]
+    except TypeError:
+      pass
+
+  return value
+
+
+def replace_values(df, rules = REPLACEMENT_RULES):
+  """
+  Apply compiled replacements to the columns they name, leaving the rest
+  of the frame alone. Each distinct value in a column is only normalized
+  once. Returns a new dataframe.
+  """
+  df = df.copy()
+  for column in df.columns:
+    if column not in rules:
+      continue
+
+    regexes, strings = rules[column]
+    normalized = {}
+    values = []
+    for value in df[column]:
+      try:
+        key = (type(value), value)
+        if key not in normalized:
+          normalized[key] = replace_value(value, regexes, strings)
+        values.append(normalized[key])
+      except TypeError:
+        values.append(replace_value(value, regexes, strings))
+
+    df[column] = pd.Series(values, index = df.index, dtype = object)
+
+  return df
+
+
+class ami_workbook:
+  """
+  Excel file opened once, with each sheet's values and header rows
+  parsed on first use and kept for later readers
+  """
+  def __init__(self, path, key = None):
+    self.path = path
+    self.key = key
+    self.lock = threading.RLock()
+
+    self._excel_file = None
+    self._formula_book = None
+    self.sheet_frames = {}
+    self.sheet_headers = {}
+
+    self.sheet_names = list(self.excel_file.sheet_names)
+
+
+  @property
+  def excel_file(self):
+    with self.lock:
+      if self._excel_file is None:
+        self._excel_file = pd.ExcelFile(self.path, engine = "openpyxl")
+      return self._excel_file
+
+
+  def load_sheet(self, sheet_name):
+    """
+    Parse the values and first three rows of a sheet. Header rows are
+    padded to the width of the values so the two always line up.
+    """
+    with self.lock:
+      if sheet_name in self.sheet_frames:
+        return
+
+      frame = self.excel_file.parse(sheet_name,
+        skiprows = 2, na_values = ami_md_constants.NAS)
+      ncols = len(frame.columns)
+
+      sheet = self.excel_file.book[sheet_name]
+      if hasattr(sheet, "reset_dimensions"):
+        sheet.reset_dimensions()
+
+      header_rows = []
+      for row in sheet.iter_rows(min_row = 1, max_row = 3, values_only = True):
+        row = ["" if value is None else value for value in row[:ncols]]
+        header_rows.append(row + [""] * (ncols - len(row)))
+      while len(header_rows) < 3:
+        header_rows.append([""] * ncols)
+
+      self.sheet_frames[sheet_name] = frame
+      self.sheet_headers[sheet_name] = header_rows
+
+
+  def get_sheet_values(self, sheet_name):
+    """
+    Return a copy of the sheet's values, since callers normalize in place
+    """
+    self.load_sheet(sheet_name)
+    return self.sheet_frames[sheet_name].copy()
+
+
+  def get_header_rows(self, sheet_name):
+    self.load_sheet(sheet_name)
+    return self.sheet_headers[sheet_name]
+
+
+  def get_formula_sheet(self, sheet_name):
+    """
+    Return a sheet with formulas intact. The values read by pandas come
+    from cached results, so equations are only visible in a second,
+    lazily loaded copy of the workbook.
+    """
+    with self.lock:
+      if self._formula_book is None:
+        self._formula_book = load_workbook(self.path, read_only = True)
+      return self._formula_book[sheet_name]
+
+
+  def close(self):
+    with self.lock:
+      if self._excel_file is not None:
+        self._excel_file.close()
+        self._excel_file = None
+      if self._formula_book is not None:
+        self._formula_book.close()
+        self._formula_book = None
+
+
 class ami_excel:
+  @profiling.timed("ami_excel", nbytes = profiling.file_size)
   def __init__(self, filename):
     """
     Initialize object as excel workbook
@@ -34,35 +256,37 @@ class ami_excel:
       LOGGER.exception("File does not exist at specified path")
 
     try:
-      wb = xlrd.open_workbook(self.path)
-    except:
+      wb = open_workbook(self.path)
+    except Exception:
       LOGGER.exception("File is not an excel file")
+      raise AMIExcelError("File is not an excel file: {}".format(self.path))
 
+    self.workbook = wb
     self.filename = os.path.splitext(os.path.abspath(filename))[0]
     self.pres_sheet = None
     self.edit_sheet = None
     self.notransfer_sheet = None
 
-    for sheet in wb.sheet_names():
+    for sheet in wb.sheet_names:
       sheet_lower = sheet.lower()
       #Check if two sheets get identfied by regex below?
       if re.match("(original|preservation|file|full|archive)",
         sheet_lower):
         if not self.pres_sheet:
-          self.pres_sheet = ami_pressheet(wb.sheet_by_name(sheet),
+          self.pres_sheet = ami_pressheet(wb, sheet,
             self.name, self.path)
         else:
           raise AMIExcelError("Too many preservation master sheets")
       elif re.match("edit", sheet_lower):
         if not self.edit_sheet:
-          self.edit_sheet = ami_editsheet(wb.sheet_by_name(sheet),
+          self.edit_sheet = ami_editsheet(wb, sheet,
             self.name, self.path)
         else:
           raise AMIExcelError("Too many edit master sheets")
       """
       elif re.match("not transferred", sheet_lower):
-        self.notransfer_sheet = ami_excelsheet(wb.sheet_by_name(sheet),
-          self.path)
+        self.notransfer_sheet = ami_excelsheet(wb, sheet,
+          self.name, self.path)
       """
 
 
@@ -86,39 +310,38 @@ class ami_excel:
 
 
 class ami_excelsheet:
-  def __init__(self, sheet, wb_name, path):
+  def __init__(self, workbook, sheet_name, wb_name, path):
     """
     Initialize object as excel sheet
     """
     self.path = path
     self.wb = wb_name
-    self.name = sheet.name
-    self.header_top = self.get_headerRow(sheet, 0)
-    self.header_middle = self.get_headerRow(sheet, 1)
-    self.header_bottom = self.get_headerRow(sheet, 2)
-    self.header_entries = self.get_headerEntries(sheet)
+    self.workbook = workbook
+    self.name = sheet_name
+    header_rows = workbook.get_header_rows(sheet_name)
+    self.header_top = self.get_headerRow(header_rows, 0)
+    self.header_middle = self.get_headerRow(header_rows, 1)
+    self.header_bottom = self.get_headerRow(header_rows, 2)
+    self.header_entries = self.get_headerEntries(header_rows)
     self.normalized_header_entries = self.get_normalizedHeaderEntries()
 
-    self.sheet_values = pd.read_excel(self.path,
-      sheet_name = self.name, skiprows = 2,
-      na_values = ami_md_constants.NAS)
+    self.sheet_values = workbook.get_sheet_values(sheet_name)
     self.sheet_values.columns = self.normalized_header_entries
 
 
-  def get_headerRow(self, sheet, row):
+  def get_headerRow(self, header_rows, row):
     """
     Return normalized values from a single row of headers on a
     specified sheet. Newline characters are retained.
 
     Keyword arguments:
-    sheetname -- name of the sheet to extract from (self.pres_sheetname
-    or self.edit_sheetname)
+    header_rows -- first three rows of the sheet
     row -- index of the row to extract from (0-2)
     """
     headers = []
 
-    for i in range(0, sheet.ncols):
-      value = str(sheet.cell(row, i).value)
+    for cell_value in header_rows[row]:
+      value = str(cell_value)
 
       if value:
         headers.append(value)
@@ -126,50 +349,48 @@ class ami_excelsheet:
     return headers
 
 
-  def get_headerEntries(self, sheet):
+  def get_headerEntries(self, header_rows):
     """
     Convenience method to return all header tuples.
 
     Keyword arguments:
-    sheetname -- name of the sheet to extract from (self.pres_sheetname
-    or self.edit_sheetname)
+    header_rows -- first three rows of the sheet
     """
     header_entries = []
 
-    for i in range(0, sheet.ncols):
-      header_entries.append(self.get_headerEntryAsTuple(sheet, i))
+    for i in range(0, len(header_rows[2])):
+      header_entries.append(self.get_headerEntryAsTuple(header_rows, i))
 
     return header_entries
 
 
-  def get_headerEntryAsTuple(self, sheet, column):
+  def get_headerEntryAsTuple(self, header_rows, column):
     """
     Returns tuple of header archiving by stepping backwards from a
     3rd-level header.
 
     Keyword arguments:
-    sheetname -- name of the sheet to extract from (self.pres_sheetname
-    or self.edit_sheetname)
+    header_rows -- first three rows of the sheet
     column -- index of the column of the 3rd-level header
     """
     key1, key2, key3 = None, None, None
 
-    key3 = sheet.cell(2, column).value
+    key3 = header_rows[2][column]
 
     j = column
-    key2 = sheet.cell(1, j).value
+    key2 = header_rows[1][j]
     while not key2:
       j -= 1
       if j == -1:
         key2 = ""
         j = column
         break
-      key2 = sheet.cell(1, j).value
+      key2 = header_rows[1][j]
     k = column
-    key1 = sheet.cell(0, k).value
+    key1 = header_rows[0][k]
     while not key1:
       k -= 1
-      key1 = sheet.cell(0, k).value
+      key1 = header_rows[0][k]
 
     entry = (str(key1), str(key2), str(key3))
 
@@ -228,8 +449,7 @@ class ami_excelsheet:
     """
     df = self.sheet_values.dropna(axis = 1, how = "all").astype(object)
 
-    df = df.replace(ami_md_constants.REGEX_REPLACE_DICT, regex=True).astype(object)
-    df = df.replace(ami_md_constants.STRING_REPLACE_DICT)
+    df = replace_values(df)
 
     # add potentially missing, but required information
     if 'source.object.volume' not in df.columns.tolist():
@@ -343,30 +563,63 @@ class ami_excelsheet:
 
     json_directory = os.path.abspath(json_directory)
     df = self.sheet_values
+    start_time = time.time()
 
+    json_trees = []
     if filepaths:
+      rows = self.get_rowsByFilename()
+
       for filepath in filepaths:
         media_filename = os.path.basename(filepath)
 
-        try:
-          row = df[df["technical.filename"] == os.path.splitext(media_filename)[0]]
-        except:
+        row_dict = rows.get(os.path.splitext(media_filename)[0])
+        if row_dict is None:
           self.raise_excelerror("Excel sheet does not have a record for {}".format(media_filename))
+          continue
 
-        row_dict = row.squeeze().to_dict()
+        row_dict = dict(row_dict)
         row_dict["asset.referenceFilename"] = media_filename
 
         json_tree = ami_json.ami_json(flat_dict = row_dict,
           filepath = filepath, load = False,
           schema_version = schema_version, media_filepath = filepath)
         json_tree.repair_techmd()
-        json_tree.write_json(json_directory)
+        json_trees.append(json_tree)
 
     else:
-      for (index, row) in self.sheet_values.iterrows():
-        json_tree = ami_json.ami_json(flat_dict = row.to_dict(),
+      for row_dict in df.to_dict('records'):
+        json_tree = ami_json.ami_json(flat_dict = row_dict,
           schema_version = schema_version)
-        json_tree.write_json(json_directory)
+        json_trees.append(json_tree)
+
+    for json_tree in json_trees:
+      json_tree.write_json(json_directory)
+
+    elapsed = time.time() - start_time
+    LOGGER.info("Converted {} records from {} to JSON in {:.2f}s ({:.1f} records/s)".format(
+      len(json_trees), self.name, elapsed,
+      len(json_trees) / elapsed if elapsed else float(len(json_trees))))
+
+    return len(json_trees)
+
+
+  def get_rowsByFilename(self):
+    """
+    Index the rows of the sheet by technical.filename in one pass.
+    Returns a dict of filename to a flat dict of the row's values.
+    """
+    df = self.sheet_values
+    if "technical.filename" not in df.columns:
+      self.raise_excelerror("Excel sheet does not have a technical.filename column")
+      return {}
+
+    duplicated = df["technical.filename"].duplicated()
+    if duplicated.any():
+      LOGGER.warning("Excel sheet has more than one record for: {}".format(
+        ", ".join(str(x) for x in df.loc[duplicated, "technical.filename"].unique())))
+
+    return df[~duplicated].set_index(
+      "technical.filename", drop = False).to_dict('index')
 
 
   def raise_excelerror(self, msg):
@@ -502,12 +755,15 @@ class ami_pressheet(ami_excelsheet):
     Keyword arguments:
     sheet -- sheet object from workbook
     """
-    wb_open = load_workbook(self.path, read_only = True)
-    sheet = wb_open[self.name]
+    sheet = self.workbook.get_formula_sheet(self.name)
+
+    last_column = len(self.header_entries) - 1
+    if last_column < 1:
+      return True
 
-    for i in range(1, len(self.header_entries)):
-      for j in range(1,5):
-        value = sheet.cell(row = j, column = i).value
+    for row in sheet.iter_rows(min_row = 1, max_row = 4,
+      max_col = last_column, values_only = True):
+      for i, value in enumerate(row, 1):
         # equation check logic, TODO might be better code out there
         if (value and isinstance(value, str) and value[0] == "="):
           raise AMIExcelError("Cell R4C{0} contain equations."
@@ -544,7 +800,7 @@ class ami_editsheet(ami_excelsheet):
 
     self.sheet_values = em_df
 
-def remove_annoying(self, val1, val2, expected, found):
+def remove_annoying(val1, val2, expected, found):
   """
   Convenience function to remove items with XOR requirements
 
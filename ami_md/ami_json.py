@@ -1,4 +1,5 @@
 import os, json, re, logging
+from functools import lru_cache
 
 # data manipulation
 import numpy as np
@@ -24,7 +25,7 @@ class AMIJSONError(Exception):
 
 class ami_json:
   def __init__(self, filepath = None, load = True, flat_dict = None,
-    schema_version = "x.0.0", media_filepath = None):
+    schema_version = "x.0.0", media_filepath = None, nested_dict = None):
     """
     Initialize object as nested json
     """
@@ -43,26 +44,22 @@ class ami_json:
 
     if flat_dict:
       self.filename = os.path.splitext(flat_dict["asset.referenceFilename"])[0] + ".json"
-      nested_dict = {}
       if "asset.schemaVersion" not in flat_dict.items():
           flat_dict["asset.schemaVersion"] = schema_version
+      values = []
       for key, value in flat_dict.items():
-        if value:
-          if pd.isnull(value):
-            continue
-          if type(value) == pd.Timestamp:
-            value = value.strftime('%Y-%m-%d')
-          if isinstance(value, np.generic):
-            value = np.asscalar(value)
-          nested_dict = convert_dotKeyToNestedDict(
-            nested_dict, key, value)
-
-        # 0-value fields get skipped, but some should be allowed
-        if key in ZERO_VALUE_FIELDS and value == 0:
-          nested_dict = convert_dotKeyToNestedDict(
-            nested_dict, key, value)
+        if value and pd.isnull(value):
+          values.append(None)
+        else:
+          values.append(convert_flatValue(value, key in ZERO_VALUE_FIELDS))
+
+      self.dict = get_pathPlan(tuple(flat_dict.keys())).nest(values)
+      self.set_mediaformattype()
+      self.coerce_strings()
 
+    if nested_dict:
       self.dict = nested_dict
+      self.filename = os.path.splitext(nested_dict["asset"]["referenceFilename"])[0] + ".json"
       self.set_mediaformattype()
       self.coerce_strings()
 
@@ -477,9 +474,64 @@ def fuzzy_check_md_value(first_value, second_value, fuzziness):
   difference = abs(first_value - second_value)
   return difference <= fuzziness
 
+PATH_PLAN_CACHE_SIZE = 256
+
+DOT_KEY_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize = DOT_KEY_CACHE_SIZE)
+def split_dotKey(key, separator = "."):
+  """
+  Split a dot-delimited key into a tuple of parent keys and the leaf key.
+  """
+  parts = key.split(separator)
+  return tuple(parts[:-1]), parts[-1]
+
+
+class PathPlan:
+  """
+  Nesting template for a fixed sequence of dot-delimited keys. Keys are
+  split once when the plan is compiled, so building many nested
+  dictionaries from the same columns does no string handling.
+  """
+  def __init__(self, keys, separator = "."):
+    self.keys = tuple(keys)
+    self.paths = [split_dotKey(key, separator) for key in self.keys]
+
+  def nest(self, values, tree = None):
+    """
+    Fill a nested dictionary from values given in the plan's key order,
+    leaving out values that are None.
+
+    Keyword arguments:
+    values -- sequence of values, one per key
+    tree -- dictionary to add to, a new one by default
+    """
+    if tree is None:
+      tree = {}
+
+    for (parents, leaf), value in zip(self.paths, values):
+      if value is None:
+        continue
+      t = tree
+      for parent in parents:
+        t = t.setdefault(parent, {})
+      t[leaf] = value
+
+    return tree
+
+
+@lru_cache(maxsize = PATH_PLAN_CACHE_SIZE)
+def get_pathPlan(keys, separator = "."):
+  """
+  Return the shared PathPlan for a tuple of dot-delimited keys.
+  """
+  return PathPlan(keys, separator)
+
+
 def convert_dotKeyToNestedDict(tree, key, value):
   """
-  Recursive method that takes a dot-delimited header and returns a
+  Method that takes a dot-delimited header and returns a
   nested dictionary.
 
   Keyword arguments:
@@ -487,35 +539,129 @@ def convert_dotKeyToNestedDict(tree, key, value):
   value -- value associated with header
   """
 
+  parents, leaf = split_dotKey(key)
   t = tree
-  if "." in key:
-    key, rest = key.split(".", 1)
-    if key not in tree:
-      t[key] = {}
-    convert_dotKeyToNestedDict(t[key], rest, value)
-  else:
-    t[key] = value
+  for parent in parents:
+    t = t.setdefault(parent, {})
+  t[leaf] = value
 
-  return t
+  return tree
 
 
 def convert_nestedDictToDotKey(tree, separator = ".", prefix = ""):
   """
-  Recursive method that takes a dot-delimited header and returns a
-  nested dictionary.
+  Method that takes a nested dictionary and returns a dictionary
+  of dot-delimited keys. Walks the tree with a stack instead of
+  merging a dictionary per level.
 
   Keyword arguments:
-  key -- dot-delimited header string
-  value -- value associated with header
+  tree -- nested dictionary
+  separator -- string joining the levels of a key
+  prefix -- string to start every key with
   """
 
   new_tree = {}
-
-  for key, value in tree.items():
-    key = prefix + key
-    if isinstance(value, dict):
-      new_tree.update(convert_nestedDictToDotKey(value, separator, key + separator))
-    else:
+  stack = [(prefix, iter(tree.items()))]
+
+  while stack:
+    key_prefix, items = stack[-1]
+    for key, value in items:
+      key = key_prefix + key
+      if isinstance(value, dict):
+        stack.append((key + separator, iter(value.items())))
+        break
       new_tree[key] = value
+    else:
+      stack.pop()
 
   return new_tree
+
+
+def load_json_dict(filepath):
+  """
+  Read a JSON file into a plain dict, without building an ami_json object.
+  Raises AMIJSONError if the file cannot be read as JSON.
+  """
+  try:
+    with open(filepath, 'r', encoding = 'utf-8-sig') as f:
+      return json.load(f)
+  except (OSError, ValueError) as e:
+    raise AMIJSONError('Could not load {}. Check that it is valid JSON.'.format(
+      os.path.basename(filepath)))
+
+
+def get_dotKeyValue(tree, key, default = None):
+  """
+  Look up a dot-delimited key like technical.filename in a nested
+  dictionary, returning default if any level is missing.
+  """
+  for part in key.split("."):
+    if not isinstance(tree, dict) or part not in tree:
+      return default
+    tree = tree[part]
+
+  return tree
+
+
+def convert_flatValue(value, keep_zero = False):
+  """
+  Return a non-null flat_dict value as it is stored in the nested
+  dictionary, or None if it is left out. Falsy values are left out
+  unless keep_zero is set and the value is 0.
+
+  Keyword arguments:
+  value -- cell value
+  keep_zero -- whether the field is one of ZERO_VALUE_FIELDS
+  """
+  if value:
+    if isinstance(value, pd.Timestamp):
+      return value.strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+      return value.item()
+    return value
+
+  # 0-value fields get skipped, but some should be allowed
+  if keep_zero and value == 0:
+    return value.item() if isinstance(value, np.generic) else value
+
+  return None
+
+
+def convert_columnToJSONValues(key, series):
+  """
+  Convert a whole column to the values ami_json(flat_dict = row) keeps
+  for each row, with None where the cell would be skipped.
+
+  Keyword arguments:
+  key -- dot-delimited header string
+  series -- the column's values
+  """
+  keep_zero = key in ZERO_VALUE_FIELDS
+
+  return [None if null else convert_flatValue(value, keep_zero)
+    for value, null in zip(series.tolist(), series.isna().tolist())]
+
+
+def convert_frameToNestedDicts(df, schema_version = "x.0.0"):
+  """
+  Columnar counterpart of ami_json(flat_dict = row.to_dict()) for every
+  row of a dataframe. Headers are split once, each column is converted in
+  a single pass, and nested dictionaries are yielded one row at a time.
+
+  Keyword arguments:
+  df -- dataframe with dot-delimited headers
+  schema_version -- set as asset.schemaVersion in every dictionary
+  """
+  keys = list(df.columns)
+  columns = [convert_columnToJSONValues(key, df[key]) for key in keys]
+
+  schema_column = [schema_version if schema_version else None] * len(df)
+  if "asset.schemaVersion" in keys:
+    columns[keys.index("asset.schemaVersion")] = schema_column
+  else:
+    keys.append("asset.schemaVersion")
+    columns.append(schema_column)
+
+  plan = get_pathPlan(tuple(keys))
+  for row in zip(*columns):
+    yield plan.nest(row)
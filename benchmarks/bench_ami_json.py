@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Time nesting and flattening of dot-delimited keys in ami_md.ami_json.
+
+Rows use the media ingest headers from ami_md_constants. The recursive
+functions ami_json used before path plans are kept here for comparison.
+"""
+
+import json
+import time
+import random
+import argparse
+import statistics
+
+import ami_md.ami_json as ami_json
+import ami_md.ami_md_constants as ami_md_constants
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description="Benchmark ami_json dot-key nesting and flattening")
+    parser.add_argument("--rows", type=int, default=5000,
+                        help="Number of rows to nest and flatten")
+    parser.add_argument("--columns", type=int, default=100,
+                        help="Number of dot-delimited columns per row")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times to time each phase")
+    parser.add_argument("-o", "--output", help="Path to write JSON results")
+    return parser
+
+
+def recursive_nest(tree, key, value):
+    t = tree
+    if "." in key:
+        key, rest = key.split(".", 1)
+        if key not in tree:
+            t[key] = {}
+        recursive_nest(t[key], rest, value)
+    else:
+        t[key] = value
+
+    return t
+
+
+def recursive_flatten(tree, separator=".", prefix=""):
+    new_tree = {}
+
+    for key, value in tree.items():
+        key = prefix + key
+        if isinstance(value, dict):
+            new_tree.update(recursive_flatten(value, separator, key + separator))
+        else:
+            new_tree[key] = value
+
+    return new_tree
+
+
+def make_rows(rows, columns):
+    """
+    Return a sample of unique, non-conflicting headers and rows of values
+    """
+    headers = sorted(set(ami_md_constants.HEADER_CONVERSION.values()))
+    # a header that is also the parent of another cannot be nested
+    headers = [header for header in headers
+               if not any(other.startswith(header + ".") for other in headers)]
+    random.seed(0)
+    keys = random.sample(headers, min(columns, len(headers)))
+    return keys, [["value {} {}".format(i, j) for j in range(len(keys))] for i in range(rows)]
+
+
+def time_phase(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    args = _make_parser().parse_args()
+    keys, rows = make_rows(args.rows, args.columns)
+    nested = [ami_json.get_pathPlan(tuple(keys)).nest(row) for row in rows]
+
+    def nest_recursive():
+        for row in rows:
+            tree = {}
+            for key, value in zip(keys, row):
+                recursive_nest(tree, key, value)
+
+    def nest_per_key():
+        for row in rows:
+            tree = {}
+            for key, value in zip(keys, row):
+                ami_json.convert_dotKeyToNestedDict(tree, key, value)
+
+    def nest_plan():
+        plan = ami_json.get_pathPlan(tuple(keys))
+        for row in rows:
+            plan.nest(row)
+
+    phases = [
+        ("nest_recursive", nest_recursive),
+        ("nest_per_key", nest_per_key),
+        ("nest_plan", nest_plan),
+        ("flatten_recursive", lambda: [recursive_flatten(tree) for tree in nested]),
+        ("flatten_iterative", lambda: [ami_json.convert_nestedDictToDotKey(tree) for tree in nested])
+    ]
+
+    results = []
+    for phase, func in phases:
+        times = time_phase(func, args.repeat)
+        results.append({"phase": phase, "times": times, "min": min(times),
+                        "median": statistics.median(times)})
+        print("{:<20} min {:>9.4f}s  median {:>9.4f}s".format(
+            phase, results[-1]["min"], results[-1]["median"]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"parameters": {"rows": args.rows, "columns": len(keys), "repeat": args.repeat},
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+"""
+Time the hot paths of ami-tools against synthetic bags.
+
+Bags are modeled on tests/test-data/json-video-bag, with small generated
+WAV files standing in for every media file so the benchmark runs offline.
+Results are written as JSON so runs can be compared across upgrades.
+"""
+
+import os
+import json
+import time
+import wave
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+import datetime
+
+import bagit
+import pandas as pd
+
+from ami_bag.ami_bag import ami_bag
+from ami_bag.update_bag import Repairable_Bag
+import ami_md.ami_excel as ami_excel
+import ami_files.cache_dir as cache_dir
+import workbooks
+
+
+LOGGER = logging.getLogger(__name__)
+
+BAG_TYPES = ["json", "excel", "film"]
+
+# role directories and extensions for each synthetic bag, the first is the pm
+BAG_LAYOUTS = {
+    "json": [("PreservationMasters", "pm", ".wav"), ("EditMasters", "em", ".wav")],
+    "excel": [("PreservationMasters", "pm", ".wav"), ("EditMasters", "em", ".wav")],
+    "film": [("PreservationMasters", "pm", ".mkv"), ("Mezzanines", "mz", ".mov"),
+             ("ServiceCopies", "sc", ".mp4")]
+}
+
+SAMPLE_RATE = 48000
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description="Benchmark bag loading, validation and repair")
+    parser.add_argument("--items", type=int, default=20,
+                        help="Number of items (volumes) per bag")
+    parser.add_argument("--file-size", type=int, default=64 * 1024,
+                        help="Size in bytes of each generated media file")
+    parser.add_argument("--bag-types", nargs='+', choices=BAG_TYPES, default=BAG_TYPES,
+                        help="Kinds of bag to benchmark")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times to time each phase")
+    parser.add_argument("--metadata", action='store_true',
+                        help="Also time metadata validation, which runs MediaInfo on every file")
+    parser.add_argument("--hash-workers", type=int, default=1,
+                        help="Threads used by Repairable_Bag when rehashing")
+    parser.add_argument("--workdir", help="Directory to build bags in, a temporary directory by default")
+    parser.add_argument("--keep", action='store_true', help="Do not delete the generated bags")
+    parser.add_argument("-o", "--output", help="Path to write JSON results")
+    parser.add_argument("--compare", help="Path to earlier JSON results to compare against")
+    return parser
+
+
+def write_wav(path, size):
+    """
+    Write a silent mono 16-bit WAV file with roughly size bytes of audio
+    """
+    frames = max(size // 2, 1)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(b'\0' * (frames * 2))
+
+    return frames * 1000 // SAMPLE_RATE
+
+
+def make_sidecar(path, media_filename, role, size, duration_milli):
+    base_filename, ext = os.path.splitext(media_filename)
+    duration = datetime.timedelta(milliseconds=duration_milli)
+    sidecar = {
+        "asset": {
+            "referenceFilename": media_filename,
+            "fileRole": role,
+            "schemaVersion": "1.0.0"
+        },
+        "bibliographic": {
+            "primaryID": "100001",
+            "cmsCollectionID": "23180",
+            "divisionCode": "myd",
+            "title": "Synthetic benchmark item"
+        },
+        "technical": {
+            "filename": base_filename,
+            "extension": ext[1:],
+            "dateCreated": datetime.date.today().isoformat(),
+            "fileFormat": "Wave",
+            "audioCodec": "PCM",
+            "fileSize": {"measure": size, "unit": "B"},
+            "durationMilli": {"measure": duration_milli, "unit": "ms"},
+            "durationHuman": "0{}.{:03d}".format(str(duration).split('.')[0], duration_milli % 1000)
+        },
+        "source": {
+            "object": {
+                "type": "audio cassette analog",
+                "format": "Compact cassette",
+                "volumeNumber": 1
+            },
+            "audioRecording": {"numberOfAudioTracks": 1}
+        }
+    }
+    with open(path, 'w') as f:
+        json.dump(sidecar, f, indent=4)
+
+
+def make_workbook(path, sheets):
+    """
+    Write a media ingest workbook, sheets maps each sheet title to the
+    media files it describes
+    """
+    workbooks.make_workbook(path, dict(
+        (title, [[os.path.splitext(media_filename)[0],
+                  "Synthetic benchmark item", "100001", "myd"]
+                 for media_filename in media_filenames])
+        for title, media_filenames in sheets.items()))
+
+
+def make_bag(bag_type, bag_path, items, file_size):
+    """
+    Build a synthetic bag of the given type and return its path
+    """
+    os.makedirs(bag_path)
+    bag_id = os.path.basename(bag_path)
+
+    media_filenames = {}
+    for volume in range(1, items + 1):
+        for role_dir, role, ext in BAG_LAYOUTS[bag_type]:
+            os.makedirs(os.path.join(bag_path, role_dir), exist_ok=True)
+            media_filename = "myd_{}_v{:02d}_{}{}".format(bag_id, volume, role, ext)
+            media_path = os.path.join(bag_path, role_dir, media_filename)
+            duration_milli = write_wav(media_path, file_size)
+            media_filenames.setdefault(role, []).append(media_filename)
+
+            if bag_type != "excel":
+                make_sidecar(os.path.splitext(media_path)[0] + ".json", media_filename,
+                             role, os.path.getsize(media_path), duration_milli)
+
+    if bag_type == "excel":
+        os.makedirs(os.path.join(bag_path, "Metadata"))
+        make_workbook(os.path.join(bag_path, "Metadata", "2024_001_myd_benchmark.xlsx"),
+                      {"Preservation masters": media_filenames["pm"],
+                       "Edit masters": media_filenames["em"]})
+
+    bagit.make_bag(bag_path, checksums=["md5", "sha256"])
+    return bag_path
+
+
+def time_phase(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(bag_type, phase, times, bag_path):
+    return {
+        "bag_type": bag_type,
+        "phase": phase,
+        "times": times,
+        "min": min(times),
+        "median": statistics.median(times),
+        "payload_bytes": sum(os.path.getsize(os.path.join(dirpath, filename))
+                             for dirpath, dirnames, filenames in os.walk(os.path.join(bag_path, "data"))
+                             for filename in filenames)
+    }
+
+
+def benchmark_bag(bag_type, bag_path, args):
+    """
+    Time each phase against one bag, returning a result per phase
+    """
+    phases = [
+        ("load", lambda: ami_bag(path=bag_path)),
+        ("check_amibag", lambda: ami_bag(path=bag_path).check_amibag(fast=True, metadata=False)),
+        ("validate_fixity", lambda: ami_bag(path=bag_path).validate(fast=False)),
+        ("update_hashes", lambda: Repairable_Bag(
+            path=bag_path, hash_workers=args.hash_workers).update_hashes())
+    ]
+    if args.metadata:
+        phases.insert(2, ("check_amibag_metadata",
+            lambda: ami_bag(path=bag_path).check_amibag(fast=True, metadata=True)))
+    if bag_type == "excel":
+        excel_path = os.path.join(bag_path, "data", "Metadata", "2024_001_myd_benchmark.xlsx")
+
+        def parse_excel():
+            ami_excel.clear_workbook_cache()
+            ami_excel.ami_excel(excel_path)
+
+        phases.insert(1, ("ami_excel", parse_excel))
+
+    results = []
+    for phase, func in phases:
+        times = time_phase(func, args.repeat)
+        results.append(summarize(bag_type, phase, times, bag_path))
+        print("{:<8} {:<24} min {:>9.4f}s  median {:>9.4f}s".format(
+            bag_type, phase, results[-1]["min"], results[-1]["median"]))
+
+    return results
+
+
+def compare_results(results, baseline_path):
+    """
+    Print the change in median time for each phase found in both runs
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    baseline_medians = {(result["bag_type"], result["phase"]): result["median"]
+                        for result in baseline["results"]}
+
+    print("\nCompared to {}".format(baseline_path))
+    for result in results:
+        key = (result["bag_type"], result["phase"])
+        if key not in baseline_medians:
+            continue
+        before = baseline_medians[key]
+        ratio = result["median"] / before if before else float('inf')
+        print("{:<8} {:<24} {:>9.4f}s -> {:>9.4f}s  ({:.2f}x)".format(
+            key[0], key[1], before, result["median"], ratio))
+
+
+def main():
+    args = _make_parser().parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ami-tools-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # keep cached results from earlier runs out of the timings
+    os.environ[cache_dir.CACHE_DIR_ENV] = os.path.join(workdir, "cache")
+
+    results = []
+    try:
+        for i, bag_type in enumerate(args.bag_types):
+            bag_path = os.path.join(workdir, "{:06d}".format(100001 + i))
+            if os.path.exists(bag_path):
+                shutil.rmtree(bag_path)
+            start = time.perf_counter()
+            make_bag(bag_type, bag_path, args.items, args.file_size)
+            print("{:<8} {:<24} {:>14.4f}s".format(bag_type, "(build bag)", time.perf_counter() - start))
+            results.extend(benchmark_bag(bag_type, bag_path, args))
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "created": datetime.datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "bagit": getattr(bagit, "VERSION", None),
+            "pandas": pd.__version__
+        },
+        "parameters": {
+            "items": args.items,
+            "file_size": args.file_size,
+            "repeat": args.repeat,
+            "hash_workers": args.hash_workers,
+            "metadata": args.metadata
+        },
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
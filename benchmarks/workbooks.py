@@ -0,0 +1,32 @@
+from openpyxl import Workbook
+
+import ami_md.ami_md_constants as ami_md_constants
+
+
+def write_header_rows(ws):
+	"""
+	Write the three media ingest header rows, leaving a merged-looking
+	blank where a top or middle header repeats the one before it
+	"""
+	previous = (None, None)
+	for col, (top, middle, bottom) in enumerate(ami_md_constants.MEDIAINGEST_EXPECTED_HEADERS, 1):
+		ws.cell(1, col, top if top != previous[0] else None)
+		ws.cell(2, col, middle if middle != previous[1] else None)
+		ws.cell(3, col, bottom)
+		previous = (top, middle)
+
+
+def make_workbook(path, sheets):
+	"""
+	Write a media ingest workbook, sheets maps each sheet title to its rows
+	"""
+	wb = Workbook()
+	wb.remove(wb.active)
+
+	for title, rows in sheets.items():
+		ws = wb.create_sheet(title)
+		write_header_rows(ws)
+		for row in rows:
+			ws.append(row)
+
+	wb.save(path)
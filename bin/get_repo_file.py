@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import csv
+import functools
+import json
+import os
 import pathlib
 import re
+import sqlite3
 import subprocess
+import time
 
 
 FORMAT_TO_EXT = {
@@ -27,6 +33,11 @@ TYPE_TO_AV = {
 CAPTURE_BUCKET = 'repo-transcoded-web-media'
 
 
+# seconds to wait before the first retry of a failed transfer, doubled
+# for each retry after that
+RETRY_DELAY = 5
+
+
 def _make_parser():
 
     def validate_object(id):
@@ -70,6 +81,11 @@ def _make_parser():
         help='csv of assets in repo',
         type=validate_file,
         default='~/assets.csv')
+    parser.add_argument(
+        '--index',
+        help='path to the lookup index built from the assets csv, '
+             'defaults to the csv path with .sqlite added, the csv is '
+             'indexed in memory if the index cannot be written')
     parser.add_argument(
         '--uuid',
         action='append',
@@ -88,6 +104,17 @@ def _make_parser():
         help='path to destination',
         type=validate_dir,
         default='/Volumes/video_repository/Working_Storage/')
+    parser.add_argument(
+        '-t', '--transfers',
+        help='number of files to transfer at the same time, '
+             'rsync progress is only shown for one at a time',
+        type=int,
+        default=4)
+    parser.add_argument(
+        '--retries',
+        help='number of times to retry a failed transfer',
+        type=int,
+        default=2)
 
     return parser
 
@@ -131,9 +158,154 @@ def parse_assets(path):
     return assets_dict
 
 
+def remove_file(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class AssetCatalog:
+    """
+    SQLite index of an assets csv, queried like the dict from parse_assets.
+    The index is built on first use and rebuilt whenever the csv's size or
+    mtime no longer match the ones it was built from. If the index cannot
+    be written, e.g. next to a csv on a read-only volume, the csv is
+    indexed in memory for this run instead.
+    """
+    def __init__(self, csv_path, index_path=None):
+        self.csv_path = pathlib.Path(csv_path).expanduser()
+        if index_path:
+            self.index_path = pathlib.Path(index_path).expanduser()
+        else:
+            self.index_path = self.csv_path.with_name(
+                self.csv_path.name + '.sqlite'
+            )
+
+        if not self.is_current():
+            try:
+                self.build()
+            except (OSError, sqlite3.OperationalError) as e:
+                print(f'Could not write index {self.index_path} ({e}), '
+                      f'indexing {self.csv_path} in memory')
+                self.connection = sqlite3.connect(':memory:')
+                with self.connection:
+                    self.index_csv(self.connection)
+                return
+
+        self.connection = sqlite3.connect(str(self.index_path))
+
+    def csv_signature(self):
+        stat = self.csv_path.stat()
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def is_current(self):
+        if not self.index_path.is_file():
+            return False
+
+        connection = sqlite3.connect(str(self.index_path))
+        try:
+            row = connection.execute(
+                'SELECT value FROM meta WHERE key = ?', ('csv',)
+            ).fetchone()
+        except sqlite3.DatabaseError:
+            return False
+        finally:
+            connection.close()
+
+        return row is not None and row[0] == self.csv_signature()
+
+    def index_csv(self, connection):
+        """
+        Create the tables and indexes and load the csv rows into them
+        """
+        signature = self.csv_signature()
+        connection.execute(
+            'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)'
+        )
+        connection.execute(
+            'CREATE TABLE assets (object_id TEXT, uuid TEXT, row TEXT)'
+        )
+        with open(self.csv_path, mode='r') as file:
+            reader = csv.DictReader(file)
+
+            if not all(
+                x in reader.fieldnames for x in ['name', 'uuid']
+            ):
+                raise ValueError(
+                    'Assets file is missing one or more required '
+                    'header values: name and uuid'
+                )
+
+            connection.executemany(
+                'INSERT INTO assets VALUES (?, ?, ?)',
+                (
+                    (extract_id(row['name']), row['uuid'],
+                     json.dumps(row))
+                    for row in reader
+                )
+            )
+        connection.execute(
+            'CREATE INDEX assets_object_id ON assets (object_id)'
+        )
+        connection.execute(
+            'CREATE INDEX assets_uuid ON assets (uuid)'
+        )
+        connection.execute(
+            'INSERT INTO meta VALUES (?, ?)', ('csv', signature)
+        )
+
+    def build(self):
+        """
+        Index the csv into a temporary file, then move it into place so
+        other readers never see a half built index
+        """
+        tmp_path = self.index_path.with_name(
+            f'{self.index_path.name}.{os.getpid()}.tmp'
+        )
+        remove_file(tmp_path)
+
+        connection = sqlite3.connect(str(tmp_path))
+        try:
+            with connection:
+                self.index_csv(connection)
+            connection.close()
+            os.replace(tmp_path, self.index_path)
+        except BaseException:
+            connection.close()
+            remove_file(tmp_path)
+            raise
+
+    def _rows(self, column, value):
+        return [
+            json.loads(row[0]) for row in self.connection.execute(
+                f'SELECT row FROM assets WHERE {column} = ? ORDER BY rowid',
+                (value,)
+            )
+        ]
+
+    def __contains__(self, object_id):
+        return self.connection.execute(
+            'SELECT 1 FROM assets WHERE object_id = ? LIMIT 1', (object_id,)
+        ).fetchone() is not None
+
+    def __getitem__(self, object_id):
+        rows = self._rows('object_id', object_id)
+        if not rows:
+            raise KeyError(object_id)
+
+        return rows
+
+    def get_by_uuid(self, uuid):
+        return self._rows('uuid', uuid)
+
+    def close(self):
+        self.connection.close()
+
+
 def get_object_entries(object_id, assets_dict):
     entries = []
-    if object_id in assets_dict.keys():
+    if object_id in assets_dict:
         for file in assets_dict[object_id]:
             entries.append(
                 {
@@ -181,25 +353,133 @@ def get_extension(path):
     return ext
 
 
-def run_rsync(source, dest):
-    subprocess.call([
-        'rsync', '-tv', '--progress',
-        source, dest
-    ])
+def run_rsync(source, dest, progress=True):
+    command = ['rsync', '-tv']
+    if progress:
+        command.append('--progress')
+    return subprocess.call(command + [source, dest])
 
 
 def run_s3cp(source, dest):
-    subprocess.call([
+    return subprocess.call([
         'aws', 's3', 'cp',
         f's3://{CAPTURE_BUCKET}/{source}', dest
     ])
 
 
+async def transfer(run, source, dest, transfers, retries):
+    """
+    Run a transfer command in a thread once a transfer slot is free,
+    retrying with a growing delay while it fails.
+    A missing command is not retried.
+    Returns True if the transfer succeeded.
+    """
+    loop = asyncio.get_event_loop()
+    for attempt in range(retries + 1):
+        async with transfers:
+            try:
+                code = await loop.run_in_executor(
+                    None, functools.partial(run, source, dest)
+                )
+            except FileNotFoundError as e:
+                print(f'Could not transfer {source}: {e}')
+                return False
+            except OSError as e:
+                code = e
+
+        if not code:
+            return True
+
+        if attempt < retries:
+            delay = RETRY_DELAY * 2 ** attempt
+            print(f'Transfer of {source} failed ({code}), '
+                  f'retrying in {delay}s')
+            await asyncio.sleep(delay)
+
+    print(f'Could not transfer {source} after {retries + 1} attempts')
+    return False
+
+
+async def retrieve_file(file, args, probes, transfers):
+    """
+    Work out the source and destination of one file and transfer it.
+    The mediainfo probe for a repo file runs while other files transfer.
+    Returns the destination and whether the transfer succeeded, a file
+    that raises is reported as failed without stopping the others.
+    """
+    dest = pathlib.Path(args.destination).joinpath(file['filename'])
+
+    try:
+        return await _retrieve_file(file, args, probes, transfers, dest)
+    except Exception as e:
+        print(f'Could not retrieve {file["filename"]}: {e}')
+        return dest, False
+
+
+async def _retrieve_file(file, args, probes, transfers, dest):
+    if args.servicecopies:
+        source = (
+            f'{file["capture_uuid"]}/'
+            f'{file["capture_uuid"]}-high{file["access_fmt"]}'
+        )
+        dest = dest.with_suffix(file["access_fmt"])
+        run = run_s3cp
+    else:
+        source = pathlib.Path(args.repo).joinpath(
+            get_uuid_path(file['uuid'])
+        )
+        async with probes:
+            ext = await asyncio.get_event_loop().run_in_executor(
+                None, get_extension, source
+            )
+        dest = dest.with_suffix(ext)
+        run = run_rsync
+        if args.transfers > 1:
+            # progress lines from concurrent rsyncs overwrite each other
+            run = functools.partial(run_rsync, progress=False)
+
+    print(f'Downloading {source} to {dest}')
+    success = await transfer(run, source, dest, transfers, args.retries)
+    if success and args.transfers > 1:
+        print(f'Downloaded {dest}')
+    return dest, success
+
+
+async def retrieve_files(files, args):
+    """
+    Retrieve files with up to args.transfers transfers at a time,
+    then report the combined throughput and any failed transfers.
+    Returns the destinations of the files that could not be retrieved.
+    """
+    transfers = asyncio.Semaphore(max(1, args.transfers))
+    probes = asyncio.Semaphore(max(1, args.transfers))
+
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *[retrieve_file(file, args, probes, transfers) for file in files]
+    )
+    elapsed = time.monotonic() - start
+
+    retrieved = [dest for dest, success in results if success]
+    failed = [dest for dest, success in results if not success]
+    total_bytes = sum(
+        dest.stat().st_size for dest in retrieved if dest.is_file()
+    )
+    rate = total_bytes / elapsed if elapsed else 0
+    print(f'Retrieved {len(retrieved)} of {len(results)} files, '
+          f'{total_bytes / 1e6:.1f} MB in {elapsed:.1f}s '
+          f'({rate / 1e6:.1f} MB/s)')
+    for dest in failed:
+        print(f'Failed to retrieve: {dest}')
+
+    return failed
+
+
 def main():
     parser = _make_parser()
     args = parser.parse_args()
 
-    assets_dict = parse_assets(args.assets)
+    assets_dict = AssetCatalog(args.assets, args.index)
 
     in_repo = []
     for object_id in args.object:
@@ -208,25 +488,13 @@ def main():
             in_repo.extend(entries)
         else:
             print(f'Could not find files listed in CSV for: {object_id}')
+    assets_dict.close()
 
-    for file in in_repo:
-        dest = pathlib.Path(args.destination).joinpath(file['filename'])
-
-        if args.servicecopies:
-            capture_name = (
-                f'{file["capture_uuid"]}/'
-                f'{file["capture_uuid"]}-high{file["access_fmt"]}'
-            )
-            dest = dest.with_suffix(file["access_fmt"])
-            print(f'Downloading {capture_name} to {dest}')
-            run_s3cp(capture_name, dest)
-        else:
-            repo_path = pathlib.Path(args.repo).joinpath(
-                get_uuid_path(file['uuid'])
-            )
-            dest = dest.with_suffix(get_extension(repo_path))
-            print(f'Downloading {repo_path} to {dest}')
-            run_rsync(repo_path, dest)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(retrieve_files(in_repo, args))
+    finally:
+        loop.close()
 
 
 if __name__ == '__main__':
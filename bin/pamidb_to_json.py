@@ -1,4 +1,5 @@
 import os, argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import pandas as pd
 import ami_md.ami_json as aj
 
@@ -26,9 +27,48 @@ def _make_parser():
 	parser.add_argument("-s", "--schema",
 		help = "current schema version, preferred format x.y.z",
 		default = "2.0.0")
+	parser.add_argument("-w", "--writers",
+		help = "number of json files to write at the same time",
+		type = int,
+		default = 1)
 	return parser
 
 
+def json_documents(md, schema_version):
+	for nested_dict in aj.convert_frameToNestedDicts(md, schema_version):
+		yield aj.ami_json(nested_dict = nested_dict)
+
+
+def write_documents(documents, json_directory, writers = 1):
+	"""
+	Write each document as soon as it is built, on a pool of writer threads.
+	No more than a few documents per writer wait to be written at once.
+	Returns the number of documents written.
+	"""
+	count = 0
+
+	if writers <= 1:
+		for json_tree in documents:
+			json_tree.write_json(json_directory, indent = 4)
+			count += 1
+		return count
+
+	pending = set()
+	with ThreadPoolExecutor(max_workers = writers) as pool:
+		for json_tree in documents:
+			if len(pending) >= writers * 4:
+				done, pending = wait(pending, return_when = FIRST_COMPLETED)
+				for future in done:
+					future.result()
+			pending.add(pool.submit(json_tree.write_json, json_directory, 4))
+			count += 1
+
+		for future in pending:
+			future.result()
+
+	return count
+
+
 def main():
 	parser = _make_parser()
 	args = parser.parse_args()
@@ -39,10 +79,8 @@ def main():
 
 	json_directory = os.path.abspath(args.output)
 
-	for (index, row) in md.iterrows():
-		json_tree = aj.ami_json(flat_dict = row.to_dict(),
-			schema_version = args.schema)
-		json_tree.write_json(json_directory, indent = 4)
+	write_documents(json_documents(md, args.schema), json_directory,
+		writers = args.writers)
 
 
 if __name__ == "__main__":
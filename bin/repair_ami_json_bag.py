@@ -7,6 +7,7 @@ import logging
 from ami_bag.ami_bag import ami_bag
 from ami_md.ami_json import ami_json
 from ami_bag.update_bag import Repairable_Bag
+import ami_files.mediainfo_cache as mediainfo_cache
 import re
 import sys
 
@@ -44,6 +45,8 @@ def _make_parser():
                         help = "Fix common errors in technical md field by rerunning mediainfo")
     parser.add_argument("--badjson", action='store_true',
                         help = "Update hashes for json if repaired manually")
+    parser.add_argument("--no-mediainfo-cache", action='store_true',
+                        help = "Rerun MediaInfo instead of using cached results")
     parser.add_argument("--dryrun", action='store_true',
                         default = False,
                         help = "Do not perform any of the flagged repairs")
@@ -148,6 +151,9 @@ def main():
 
     _configure_logging(args)
 
+    if args.no_mediainfo_cache:
+        mediainfo_cache.disable_cache()
+
     checks = "Performing these repairs: "
     check_list = []
     if args.filenames:
@@ -39,6 +39,12 @@ def _make_parser():
                         action='store_true')
     parser.add_argument('--deletemanifestentries', help='Delete entries from the manifest without payload files',
                         action='store_true')
+    parser.add_argument('--compactpremis', help='Fold the appended PREMIS event journal back into premis-events.json',
+                        action='store_true')
+    parser.add_argument('--hash-workers', help='Number of threads used to hash new payload files within a bag',
+                        type=int, default=1)
+    parser.add_argument('--mmap', help='Memory map large payload files when hashing, can be faster on local disks',
+                        action='store_true')
     parser.add_argument('--log', help='The name of the log file')
     parser.add_argument('--quiet', action='store_true')
     return parser
@@ -76,7 +82,8 @@ def main():
     for bagpath in tqdm(sorted(bags)):
         LOGGER.info("Checking: {}".format(bagpath))
         try:
-            bag = Repairable_Bag(path = bagpath, repairer = args.agent)
+            bag = Repairable_Bag(path = bagpath, repairer = args.agent,
+                                 hash_workers = args.hash_workers, use_mmap = args.mmap)
         except:
             LOGGER.error("{}: Not a bag".format(bagpath))
         else:
@@ -107,6 +114,11 @@ def main():
                     bag.delete_manifest_files_not_in_payload()
                 except:
                     LOGGER.error("Deletion process incomplete. Run full validation to check status")
+            if args.compactpremis:
+                try:
+                    bag.compact_premisjson()
+                except OSError:
+                    LOGGER.error("PREMIS compaction incomplete. Run full validation to check status")
             
 
 
@@ -1,17 +1,23 @@
 #!/usr/bin/env python3
 
 import os
-import glob
 import argparse
-import bagit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from ami_bag.ami_bag import ami_bag
-import shutil
+import hashlib
+import tempfile
 import csv
 import logging
 
 
 LOGGER = logging.getLogger(__name__)
 
+BAGS_HEADER = ["bag_path", "bag_type", "bag_subtype", "bag_size", "bag_files", "bag_mediaingest_valid"]
+
+METADATA_INDEX_HEADER = ["source_path", "blob_path", "sha256", "size"]
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
 def _make_parser():
     parser = argparse.ArgumentParser()
     parser.description = "pull file information, metadata manifest, and bag manifests from a drive"
@@ -27,54 +33,247 @@ def _make_parser():
         help = "whether to overwrite existing files",
         action = 'store_true'
     )
+    parser.add_argument("--workers",
+        help = "number of bags to survey at the same time, keep low for spinning disks",
+        type = int,
+        default = 1
+    )
+    parser.add_argument("--resume",
+        help = "skip bags already listed in an existing bag manifest and add the rest",
+        action = 'store_true'
+    )
+    parser.add_argument("--copy-workers",
+        help = "number of metadata files to copy at the same time",
+        type = int,
+        default = 4
+    )
     return parser
 
-def survey_files(path):
-    all_files = glob.iglob(os.path.join(path,'**/*.*'), recursive=True)
-    files = []
-    bags = []
-    metadata = []
-
-    for filepath in all_files:
-        filename = os.path.basename(filepath)
-        filesize = os.stat(filepath).st_size
-        data = [filepath, filename, filesize]
-        files.append(data)
-        if filename == 'manifest-md5.txt':
-            bags.append(os.path.split(filepath)[0])
-        if filename.endswith(('.xlsx', '.json')):
-            metadata.append(filepath)
-
-    return(files, bags, metadata)
-
-def survey_bag(bag_path):
+class BagTally:
+    """
+    Payload size and file count of a bag, tallied during the drive walk
+    """
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.files = 0
+
+
+class DriveSurvey:
+    """
+    Single walk of a drive. Files are yielded as they are found, while
+    bags and metadata files are collected for the later steps.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.bags = []
+        self.metadata = []
+        self.file_count = 0
+        self.total_size = 0
+
+    def files(self):
+        """
+        Yield a [file_path, file_name, file_size] row for every file
+        matching '**/*.*', skipping hidden files and directories like glob.
+        A directory holding manifest-md5.txt starts a bag, and every file
+        under its data directory is added to the bag's tally.
+        """
+        stack = [(self.path, ())]
+        while stack:
+            dirpath, open_bags = stack.pop()
+            try:
+                with os.scandir(dirpath) as it:
+                    entries = [entry for entry in it if not entry.name.startswith('.')]
+            except OSError as e:
+                LOGGER.warning("Cannot list {}: {}".format(dirpath, e))
+                continue
+
+            data_bags = open_bags
+            if any(entry.name == 'manifest-md5.txt' for entry in entries):
+                bag = BagTally(dirpath)
+                self.bags.append(bag)
+                data_bags = open_bags + (bag,)
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks = False):
+                    stack.append((entry.path,
+                        data_bags if entry.name == 'data' else open_bags))
+                    continue
+
+                if '.' not in entry.name:
+                    continue
+
+                try:
+                    filesize = entry.stat().st_size
+                except OSError as e:
+                    LOGGER.warning("Cannot read {}: {}".format(entry.path, e))
+                    continue
+
+                self.file_count += 1
+                self.total_size += filesize
+                for bag in open_bags:
+                    bag.files += 1
+                    bag.size += filesize
+                if entry.name.endswith(('.xlsx', '.json')):
+                    self.metadata.append(entry.path)
+
+                yield [entry.path, entry.name, filesize]
+
+    def run(self):
+        for row in self.files():
+            pass
+
+def survey_bag(bag_path, bag_size, bag_files):
     try:
-        bag = ami_bag(bag_path)
+        bag = ami_bag(path = bag_path)
         bag_valid = bag.validate_amibag(metadata = True)
         bag_type = bag.type
         bag_subtype = bag.subtype
     except:
-        bag = bagit.Bag(bag_path)
         bag_valid = False
         bag_type = None
         bag_subtype = None
 
-    all_files = glob.iglob(os.path.join(bag_path,'data/**/*.*'), recursive=True)
+    return [bag_path, bag_type, bag_subtype, bag_size, bag_files,  bag_valid]
 
-    bag_files = 0
-    bag_size = 0
-    for filepath in all_files:
-        bag_files += 1
-        filesize = os.stat(filepath).st_size
-        bag_size += filesize
+def read_surveyed_bags(bags_path):
+    """
+    Return the paths of bags already in a bag manifest, first trimming
+    a row left incomplete by an interrupted run
+    """
+    with open(bags_path, 'rb+') as f:
+        content = f.read()
+        if not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
 
-    bag_metadata = [filename for filename in all_files if filename.endswith(('.xlsx', '.json'))]
-    if len(bag_metadata) > 0:
-        bag_metadata = ','.join(bag_metadata)
-    else:
-        bag_metadata = 'no metadata'
+    surveyed = set()
+    with open(bags_path, newline = '') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if row:
+                surveyed.add(row[0])
 
-    return [bag_path, bag_type, bag_subtype, bag_size, bag_files,  bag_valid]
+    return surveyed
+
+def survey_bags(bags, bags_path, workers = 1, resume = False):
+    """
+    Survey bags and write each row to the bag manifest as soon as it is done,
+    so an interrupted run can be picked up again with resume.
+    Returns the number of bags surveyed.
+    """
+    surveyed = set()
+    mode = 'w'
+    if resume and os.path.exists(bags_path):
+        surveyed = read_surveyed_bags(bags_path)
+        if os.path.getsize(bags_path):
+            mode = 'a'
+
+    bags = [bag for bag in bags if bag.path not in surveyed]
+    if surveyed:
+        print("Skipping {} bags already in {}".format(len(surveyed), bags_path))
+
+    with open(bags_path, mode, newline = '') as f:
+        csvwriter = csv.writer(f, quoting=csv.QUOTE_ALL)
+        if mode == 'w':
+            csvwriter.writerow(BAGS_HEADER)
+
+        if workers > 1 and len(bags) > 1:
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                futures = {
+                    pool.submit(survey_bag, bag.path, bag.size, bag.files): bag
+                    for bag in bags
+                }
+                for future in as_completed(futures):
+                    bag = futures[future]
+                    try:
+                        bag_info = future.result()
+                    except Exception as e:
+                        LOGGER.error("Could not survey {}: {}".format(bag.path, e))
+                        bag_info = [bag.path, None, None, bag.size, bag.files, False]
+                    csvwriter.writerow(bag_info)
+                    f.flush()
+        else:
+            for bag in bags:
+                csvwriter.writerow(survey_bag(bag.path, bag.size, bag.files))
+                f.flush()
+
+    return len(bags)
+
+def harvest_file(source_path, metadata_dir):
+    """
+    Copy a metadata file into metadata_dir, named for the sha256 of its
+    content and sharded by the first two hex digits. The file is hashed
+    while it is copied to a temporary file, which is moved into place or
+    dropped if the same content was already harvested.
+    Returns an index row for the file.
+    """
+    ext = os.path.splitext(source_path)[1].lower()
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(prefix = '.', suffix = '.tmp', dir = metadata_dir)
+    try:
+        with open(source_path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            while True:
+                block = src.read(COPY_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                dst.write(block)
+                size += len(block)
+
+        sha256 = digest.hexdigest()
+        blob_path = os.path.join(sha256[:2], sha256 + ext)
+        dest_path = os.path.join(metadata_dir, blob_path)
+        if os.path.exists(dest_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(dest_path), exist_ok = True)
+            os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return [source_path, blob_path, sha256, size]
+
+def harvest_metadata(metadata, metadata_dir, index_path, workers = 1):
+    """
+    Copy metadata files into a content addressed store, each distinct
+    file once, and index source paths to blobs. Index rows are written
+    as each file is copied, so an interrupted harvest keeps an index of
+    the files already in the store.
+    Returns the number of files harvested and of distinct blobs.
+    """
+    os.makedirs(metadata_dir, exist_ok = True)
+
+    def harvest(source_path):
+        try:
+            return harvest_file(source_path, metadata_dir)
+        except OSError as e:
+            LOGGER.warning("Cannot copy {}: {}".format(source_path, e))
+            return None
+
+    harvested = 0
+    blobs = set()
+    with open(index_path, 'w', newline = '') as f:
+        csvwriter = csv.writer(f, quoting=csv.QUOTE_ALL)
+        csvwriter.writerow(METADATA_INDEX_HEADER)
+        f.flush()
+
+        with ThreadPoolExecutor(max_workers = max(1, workers)) as pool:
+            futures = [pool.submit(harvest, source_path) for source_path in metadata]
+            for future in as_completed(futures):
+                row = future.result()
+                if not row:
+                    continue
+                csvwriter.writerow(row)
+                f.flush()
+                harvested += 1
+                blobs.add(row[2])
+
+    return harvested, len(blobs)
 
 def main():
     args = _make_parser().parse_args()
@@ -92,7 +291,7 @@ def main():
     drive_name = os.path.split(src)[1]
 
 
-    files, bags, metadata = survey_files(src)
+    survey = DriveSurvey(src)
 
     files_name = drive_name + '_files.csv'
     files_path = os.path.join(dest, files_name)
@@ -100,39 +299,36 @@ def main():
         with open(os.path.join(dest, files_path), 'w') as f:
               csvwriter = csv.writer(f, quoting=csv.QUOTE_ALL)
               csvwriter.writerow(["file_path", "file_name", "file_size"])
-              csvwriter.writerows(files)
+              csvwriter.writerows(survey.files())
     else:
         print("File manifest already exists at {}. If you want to replace it, use the --overwrite flag.".format(files_path))
+        survey.run()
+
+    bags = survey.bags
+    metadata = survey.metadata
 
     if len(bags) > 0:
-        bag_data = []
-        for bag_path in bags:
-            bag_info = survey_bag(bag_path)
-            bag_data.append(bag_info)
         bags_file = drive_name + '_bags.csv'
         bags_path = os.path.join(dest, bags_file)
-        if not os.path.exists(bags_path) or args.overwrite:
-            with open(os.path.join(dest, bags_path), 'w') as f:
-                  csvwriter = csv.writer(f, quoting=csv.QUOTE_ALL)
-                  csvwriter.writerow(["bag_path", "bag_type", "bag_subtype", "bag_size", "bag_files", "bag_mediaingest_valid"])
-                  csvwriter.writerows(bag_data)
+        if not os.path.exists(bags_path) or args.overwrite or args.resume:
+            survey_bags(bags, bags_path, workers = args.workers,
+                resume = args.resume and not args.overwrite)
         else:
             print("Bag manifest already exists at {}. If you want to replace it, use the --overwrite flag.".format(bags_path))
 
     if len(metadata) > 0:
         metadata_dir = drive_name + '_metadata'
         metadata_dir = os.path.join(dest, metadata_dir)
+        index_path = os.path.join(dest, drive_name + '_metadata_index.csv')
         if not os.path.exists(metadata_dir) or args.overwrite:
-            os.makedirs(metadata_dir)
+            harvested, blobs = harvest_metadata(metadata, metadata_dir, index_path,
+                workers = args.copy_workers)
+            print("Harvested {} metadata files as {} distinct files".format(harvested, blobs))
         else:
             print("Metadata directory already exists at {}. If you want to replace it, use the --overwrite flag.".format(metadata_dir))
-        for metadata_path in metadata:
-            metadata_filename = os.path.split(metadata_path)[1]
-            metadata_copypath = os.path.join(metadata_dir, metadata_filename)
-            shutil.copyfile(metadata_path, metadata_copypath)
 
-    print('Drive contains {} files'.format(len(files)))
-    print('Drive contains {} bytes of data'.format(sum([i[2] for i in files])))
+    print('Drive contains {} files'.format(survey.file_count))
+    print('Drive contains {} bytes of data'.format(survey.total_size))
     print('Drive contains {} bags'.format(len(bags)))
     print('Drive contains {} metadata files'.format(len(metadata)))
 
@@ -2,6 +2,7 @@ import unittest
 from unittest import mock
 from unittest.mock import patch
 import argparse
+import asyncio
 import shutil
 import os
 import tempfile
@@ -10,6 +11,14 @@ import pathlib
 import get_repo_file
 
 
+def run_coroutine(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
 class ProcessTests(unittest.TestCase):
     def setUp(self):
         self.tmpdir = pathlib.Path(tempfile.mkdtemp())
@@ -93,6 +102,42 @@ class ProcessTests(unittest.TestCase):
             self.assertTrue(pair[0] in entries[0].keys())
             self.assertEqual(entries[0][pair[0]], pair[1])
 
+    def test_asset_catalog(self):
+        catalog = get_repo_file.AssetCatalog(self.assets_path)
+        self.assertTrue(self.objectid in catalog)
+        self.assertEqual(
+            catalog[self.objectid],
+            get_repo_file.parse_assets(self.assets_path)[self.objectid]
+        )
+        self.assertEqual(catalog.get_by_uuid(self.uuid)[0]['name'], self.filename)
+
+        entries = get_repo_file.get_object_entries(self.objectid, catalog)
+        self.assertEqual(entries[0]['uuid'], self.uuid)
+        catalog.close()
+
+    def test_asset_catalog_refresh(self):
+        get_repo_file.AssetCatalog(self.assets_path).close()
+        with open(self.assets_path, 'a') as f:
+            f.write(f'"myt_ncov421_pm","{self.uuid}","{self.capture_uuid}",""\n')
+        os.utime(self.assets_path, ns=(0, 0))
+
+        catalog = get_repo_file.AssetCatalog(self.assets_path)
+        self.assertTrue('ncov421' in catalog)
+        catalog.close()
+
+    def test_asset_catalog_unwritable(self):
+        with patch('get_repo_file.os.replace',
+                   side_effect=PermissionError('read-only')):
+            catalog = get_repo_file.AssetCatalog(self.assets_path)
+
+        self.assertTrue(self.objectid in catalog)
+        self.assertEqual(catalog.get_by_uuid(self.uuid)[0]['name'], self.filename)
+        catalog.close()
+        self.assertEqual(
+            [path.name for path in self.tmpdir.iterdir() if path.is_file()],
+            ['assets.csv']
+        )
+
     def test_objectid_notfound(self):
         entries = get_repo_file.get_object_entries(
             self.objectid.replace('ncow', 'ncov'),
@@ -367,3 +412,135 @@ class ScriptTest(unittest.TestCase):
                 self.tmpdir.joinpath(self.filename)
                 .with_suffix('.m4a').is_file()
             )
+
+
+class TransferQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = pathlib.Path(tempfile.mkdtemp())
+
+        self.repo_path = self.tmpdir.joinpath('repo')
+        self.dest_path = self.tmpdir.joinpath('dest')
+        self.dest_path.mkdir()
+
+        self.files = []
+        for i in range(1, 4):
+            uuid = f'12345678-3124-2314-1234-12345697810{i}'
+            source = self.repo_path.joinpath(get_repo_file.get_uuid_path(uuid))
+            source.parent.mkdir(parents=True, exist_ok=True)
+            source.write_bytes(b'\x00' * 1000 * i)
+            self.files.append({
+                'object_id': f'ncow42{i}',
+                'filename': f'myt_ncow42{i}_pm',
+                'uuid': uuid,
+                'capture_uuid': '',
+                'access_fmt': '.m4a'
+            })
+
+        self.args = get_repo_file._make_parser().parse_args([
+            '-i', 'ncow421',
+            '-a', __file__,
+            '-r', str(self.repo_path),
+            '-d', str(self.dest_path),
+            '--transfers', '2'
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_retrieve_files(self):
+        attempts = []
+
+        def fake_rsync(source, dest, progress=True):
+            attempts.append(source)
+            if attempts.count(source) == 1 and source.name.endswith('1'):
+                return 23
+            shutil.copyfile(source, dest)
+            return 0
+
+        with mock.patch('get_repo_file.run_rsync', fake_rsync), \
+                mock.patch('get_repo_file.get_extension', return_value='.wav'), \
+                mock.patch('get_repo_file.RETRY_DELAY', 0):
+            failed = run_coroutine(
+                get_repo_file.retrieve_files(self.files, self.args)
+            )
+
+        self.assertEqual(failed, [])
+        self.assertEqual(len(attempts), 4)
+        for file in self.files:
+            self.assertTrue(
+                self.dest_path.joinpath(file['filename'])
+                .with_suffix('.wav').is_file()
+            )
+
+    def test_no_progress_for_concurrent_transfers(self):
+        fake_rsync = mock.Mock(return_value=0)
+
+        with mock.patch('get_repo_file.run_rsync', fake_rsync), \
+                mock.patch('get_repo_file.get_extension', return_value='.wav'):
+            run_coroutine(get_repo_file.retrieve_files(self.files, self.args))
+            for call in fake_rsync.call_args_list:
+                self.assertEqual(call[1], {'progress': False})
+
+            fake_rsync.reset_mock()
+            self.args.transfers = 1
+            run_coroutine(get_repo_file.retrieve_files(self.files, self.args))
+            for call in fake_rsync.call_args_list:
+                self.assertEqual(call[1], {})
+
+    @patch('subprocess.call')
+    def test_rsync_progress(self, mock_call):
+        get_repo_file.run_rsync('source', 'dest')
+        mock_call.assert_called_with(
+            ['rsync', '-tv', '--progress', 'source', 'dest'])
+        get_repo_file.run_rsync('source', 'dest', progress=False)
+        mock_call.assert_called_with(['rsync', '-tv', 'source', 'dest'])
+
+    def test_give_up_after_retries(self):
+        self.args.retries = 1
+        fake_rsync = mock.Mock(return_value=23)
+
+        with mock.patch('get_repo_file.run_rsync', fake_rsync), \
+                mock.patch('get_repo_file.get_extension', return_value='.wav'), \
+                mock.patch('get_repo_file.RETRY_DELAY', 0):
+            failed = run_coroutine(
+                get_repo_file.retrieve_files(self.files, self.args)
+            )
+
+        self.assertEqual(len(failed), 3)
+        self.assertEqual(fake_rsync.call_count, 6)
+
+    def test_missing_command_not_retried(self):
+        fake_rsync = mock.Mock(side_effect=FileNotFoundError('rsync'))
+
+        with mock.patch('get_repo_file.run_rsync', fake_rsync), \
+                mock.patch('get_repo_file.get_extension', return_value='.wav'), \
+                mock.patch('get_repo_file.asyncio.sleep') as sleep:
+            failed = run_coroutine(
+                get_repo_file.retrieve_files(self.files, self.args)
+            )
+
+        self.assertEqual(len(failed), 3)
+        self.assertEqual(fake_rsync.call_count, 3)
+        sleep.assert_not_called()
+
+    def test_failed_file_does_not_stop_others(self):
+        self.files[0]['uuid'] = 'not-a-uuid'
+
+        def fake_rsync(source, dest, progress=True):
+            shutil.copyfile(source, dest)
+            return 0
+
+        with mock.patch('get_repo_file.run_rsync', fake_rsync), \
+                mock.patch('get_repo_file.get_extension', return_value='.wav'):
+            failed = run_coroutine(
+                get_repo_file.retrieve_files(self.files, self.args)
+            )
+
+        self.assertEqual(
+            failed, [self.dest_path.joinpath(self.files[0]['filename'])]
+        )
+        for file in self.files[1:]:
+            self.assertTrue(
+                self.dest_path.joinpath(file['filename'])
+                .with_suffix('.wav').is_file()
+            )
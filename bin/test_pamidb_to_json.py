@@ -0,0 +1,58 @@
+import unittest
+import shutil
+import json
+import os
+import tempfile
+import pandas as pd
+
+import pamidb_to_json
+import ami_md.ami_json as aj
+
+
+class WriteDocumentsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.md = pd.DataFrame({
+            'asset.referenceFilename': ['myd_{}_v01_pm.mov'.format(i) for i in range(20)],
+            'technical.filename': ['myd_{}_v01_pm'.format(i) for i in range(20)],
+            'technical.extension': ['mov'] * 20,
+            'source.object.type': ['video cassette analog'] * 20,
+            'bibliographic.title': ['Title {}'.format(i) for i in range(20)]
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, writers):
+        json_directory = os.path.join(self.tmpdir, name)
+        os.mkdir(json_directory)
+        count = pamidb_to_json.write_documents(
+            pamidb_to_json.json_documents(self.md, '2.0.0'),
+            json_directory, writers = writers)
+        self.assertEqual(count, len(self.md))
+
+        documents = {}
+        for filename in os.listdir(json_directory):
+            with open(os.path.join(json_directory, filename)) as f:
+                documents[filename] = json.load(f)
+        return documents
+
+    def test_writers_write_same_files(self):
+        serial = self.write('serial', writers = 1)
+        pooled = self.write('pooled', writers = 4)
+        self.assertEqual(len(serial), 20)
+        self.assertEqual(pooled, serial)
+
+    def test_writer_error_reaches_caller(self):
+        documents = list(pamidb_to_json.json_documents(self.md, '2.0.0'))
+        # without a filename the document cannot be saved
+        del documents[7].dict['technical']['filename']
+        del documents[7].dict['asset']['referenceFilename']
+        json_directory = os.path.join(self.tmpdir, 'json')
+        os.mkdir(json_directory)
+        with self.assertRaises(aj.AMIJSONError):
+            pamidb_to_json.write_documents(iter(documents), json_directory, writers = 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+from unittest import mock
+import shutil
+import glob
+import csv
+import os
+import tempfile
+import bagit
+
+import survey_drive
+import ami_files.mediainfo_cache as mediainfo_cache
+
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'test-data')
+
+
+def read_csv(path):
+    with open(path, newline = '') as f:
+        return list(csv.reader(f))
+
+
+class SurveyTestCase(unittest.TestCase):
+    def setUp(self):
+        # keep the bag surveys off the user's MediaInfo cache
+        patcher = mock.patch.dict(os.environ, {mediainfo_cache.NO_CACHE_ENV: '1'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.drive = os.path.join(self.tmpdir, 'drive01')
+        self.output = os.path.join(self.tmpdir, 'output')
+        os.makedirs(os.path.join(self.drive, 'batch', 'sheets'))
+        os.makedirs(self.output)
+
+        self.bags = []
+        for name in ['263524', '263525']:
+            bag_path = os.path.join(self.drive, 'batch', name)
+            shutil.copytree(os.path.join(TEST_DATA, 'json-video-bag'), bag_path)
+            bagit.make_bag(bag_path, checksums = ['md5'])
+            self.bags.append(bag_path)
+
+        for filename, content in [
+            ('batch/sheets/myd_mss1.xlsx', 'not really a workbook'),
+            ('batch/notes.txt', 'notes'),
+            ('README', 'no extension'),
+            ('.hidden.txt', 'hidden')]:
+            with open(os.path.join(self.drive, filename), 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_survey(self, *args):
+        argv = ['survey_drive.py', '-d', self.drive, '-o', self.output] + list(args)
+        with mock.patch('sys.argv', argv), mock.patch('builtins.print'):
+            survey_drive.main()
+
+
+class SurveyFilesTests(SurveyTestCase):
+    def old_survey(self):
+        # the glob based walk the single pass survey replaced
+        files = []
+        bags = []
+        for filepath in glob.iglob(os.path.join(self.drive, '**/*.*'), recursive = True):
+            files.append([filepath, os.path.basename(filepath), str(os.stat(filepath).st_size)])
+            if os.path.basename(filepath) == 'manifest-md5.txt':
+                bags.append(os.path.split(filepath)[0])
+
+        bag_tallies = []
+        for bag_path in bags:
+            bag_files = 0
+            bag_size = 0
+            for filepath in glob.iglob(os.path.join(bag_path, 'data/**/*.*'), recursive = True):
+                bag_files += 1
+                bag_size += os.stat(filepath).st_size
+            bag_tallies.append([bag_path, str(bag_size), str(bag_files)])
+
+        return files, bag_tallies
+
+    def test_same_as_old_walk(self):
+        self.run_survey()
+        expected_files, expected_bags = self.old_survey()
+
+        files = read_csv(os.path.join(self.output, 'drive01_files.csv'))
+        self.assertEqual(files[0], ['file_path', 'file_name', 'file_size'])
+        self.assertEqual(sorted(files[1:]), sorted(expected_files))
+
+        bags = read_csv(os.path.join(self.output, 'drive01_bags.csv'))
+        self.assertEqual(bags[0], survey_drive.BAGS_HEADER)
+        self.assertEqual(sorted([row[0], row[3], row[4]] for row in bags[1:]),
+            sorted(expected_bags))
+        self.assertEqual(set(row[1] for row in bags[1:]), set(['json']))
+
+
+class ResumeTests(SurveyTestCase):
+    def test_resume_after_truncated_row(self):
+        survey = survey_drive.DriveSurvey(self.drive)
+        survey.run()
+        bags_path = os.path.join(self.output, 'drive01_bags.csv')
+        survey_drive.survey_bags(survey.bags[:1], bags_path)
+        finished = read_csv(bags_path)
+
+        # a run killed while writing the second row
+        with open(bags_path, 'a') as f:
+            f.write('"{}","js'.format(survey.bags[1].path))
+
+        with mock.patch.object(survey_drive, 'survey_bag',
+            wraps = survey_drive.survey_bag) as survey_bag:
+            surveyed = survey_drive.survey_bags(survey.bags, bags_path, resume = True)
+
+        self.assertEqual(surveyed, 1)
+        survey_bag.assert_called_once_with(survey.bags[1].path,
+            survey.bags[1].size, survey.bags[1].files)
+
+        rows = read_csv(bags_path)
+        self.assertEqual(rows[:2], finished)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2][0], survey.bags[1].path)
+        self.assertEqual(rows[2][1], 'json')
+
+
+class HarvestTests(SurveyTestCase):
+    def setUp(self):
+        super(HarvestTests, self).setUp()
+        self.metadata_dir = os.path.join(self.output, 'drive01_metadata')
+        self.index_path = os.path.join(self.output, 'drive01_metadata_index.csv')
+        # the same sidecar in both bags, and one that differs
+        self.metadata = [
+            os.path.join(bag_path, 'data', 'PreservationMasters', 'myd_263524_v01_pm.json')
+            for bag_path in self.bags
+        ] + [os.path.join(self.bags[0], 'data', 'ServiceCopies', 'myd_263524_v01_sc.json')]
+
+    def test_identical_files_stored_once(self):
+        harvested, blobs = survey_drive.harvest_metadata(self.metadata,
+            self.metadata_dir, self.index_path, workers = 2)
+        self.assertEqual((harvested, blobs), (3, 2))
+
+        stored = glob.glob(os.path.join(self.metadata_dir, '*', '*.json'))
+        self.assertEqual(len(stored), 2)
+
+        index = read_csv(self.index_path)
+        self.assertEqual(index[0], survey_drive.METADATA_INDEX_HEADER)
+        blob_paths = dict((row[0], row[1]) for row in index[1:])
+        self.assertEqual(set(blob_paths.keys()), set(self.metadata))
+        self.assertEqual(blob_paths[self.metadata[0]], blob_paths[self.metadata[1]])
+        self.assertNotEqual(blob_paths[self.metadata[0]], blob_paths[self.metadata[2]])
+        for source_path, blob_path in blob_paths.items():
+            with open(source_path, 'rb') as f, open(os.path.join(self.metadata_dir, blob_path), 'rb') as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_interrupted_harvest_keeps_index(self):
+        harvest_file = survey_drive.harvest_file
+
+        def interrupt_last(source_path, metadata_dir):
+            if source_path == self.metadata[2]:
+                raise KeyboardInterrupt()
+            return harvest_file(source_path, metadata_dir)
+
+        with mock.patch.object(survey_drive, 'harvest_file', side_effect = interrupt_last):
+            with self.assertRaises(KeyboardInterrupt):
+                survey_drive.harvest_metadata(self.metadata,
+                    self.metadata_dir, self.index_path, workers = 1)
+
+        index = read_csv(self.index_path)
+        self.assertEqual(sorted(row[0] for row in index[1:]), sorted(self.metadata[:2]))
+        for row in index[1:]:
+            self.assertTrue(os.path.exists(os.path.join(self.metadata_dir, row[1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+import shutil
+import os
+import pickle
+import logging
+import tempfile
+import bagit
+
+import validate_ami_bags
+
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'test-data')
+
+
+class BagTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bagpath = self.make_bag('263524')
+        self.ledger_path = os.path.join(self.tmpdir, 'ledger.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_bag(self, name, corrupt_json = False):
+        bagpath = os.path.join(self.tmpdir, name)
+        shutil.copytree(os.path.join(TEST_DATA, 'json-video-bag'), bagpath)
+        if corrupt_json:
+            with open(os.path.join(bagpath, 'PreservationMasters',
+                'myd_263524_v01_pm.json'), 'w') as f:
+                f.write('{"broken": ')
+        bagit.make_bag(bagpath)
+        return bagpath
+
+    def parse_args(self, *args):
+        return validate_ami_bags._make_parser().parse_args(list(args))
+
+
+class PoolTests(BagTestCase):
+    def setUp(self):
+        super(PoolTests, self).setUp()
+        # loads, but check_amibag cannot parse one of its sidecars
+        self.invalid_bagpath = self.make_bag('263525', corrupt_json = True)
+        # not a bag at all, so loading raises
+        self.unloadable_bagpath = os.path.join(self.tmpdir, '263526')
+        os.mkdir(self.unloadable_bagpath)
+        self.bags = [self.bagpath, self.invalid_bagpath, self.unloadable_bagpath]
+
+    def test_pool_matches_serial(self):
+        with self.assertLogs(level='INFO'):
+            serial = validate_ami_bags.process_bags(self.bags,
+                self.parse_args(), self.tmpdir)
+        with self.assertLogs(level='INFO') as cm:
+            pooled = validate_ami_bags.process_bags(self.bags,
+                self.parse_args('--workers', '2'), self.tmpdir)
+
+        self.assertEqual(pooled, serial)
+        self.assertEqual(pooled['valid_bags'], ['263524'])
+        self.assertEqual(pooled['error_bags'], ['263525', '263526'])
+
+        # worker records are replayed in the parent under their own loggers
+        replayed = [(record.name, record.levelname, record.getMessage())
+            for record in cm.records]
+        self.assertIn(('root', 'INFO', 'Checking: {}'.format(self.bagpath)), replayed)
+        self.assertIn(('root', 'ERROR', 'Invalid bag: {}'.format(self.invalid_bagpath)), replayed)
+        self.assertTrue(any(name == 'ami_bag.ami_bag' and 'Metadata balance out of spec' in msg
+            for name, level, msg in replayed))
+        self.assertTrue(any('Following error encountered while loading {}'.format(
+            self.unloadable_bagpath) in msg for name, level, msg in replayed))
+
+    def test_collector_flattens_exceptions(self):
+        collector = validate_ami_bags._RecordCollector()
+        collector.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger('test_validate_ami_bags')
+        logger.addHandler(collector)
+        logger.propagate = False
+        try:
+            try:
+                raise ValueError('unreadable file')
+            except ValueError:
+                logger.exception('Check failed for %s', 'a bag')
+        finally:
+            logger.removeHandler(collector)
+            logger.propagate = True
+
+        record = pickle.loads(pickle.dumps(collector.records[0]))
+        self.assertIsNone(record.exc_info)
+        self.assertTrue(record.getMessage().startswith('Check failed for a bag'))
+        self.assertIn('ValueError: unreadable file', record.getMessage())
+
+        with self.assertLogs('test_validate_ami_bags', 'ERROR') as cm:
+            validate_ami_bags._replay_records([record])
+        self.assertIn('ValueError: unreadable file', cm.output[0])
+
+
+class IncrementalTests(BagTestCase):
+    def flip_payload_byte(self):
+        # same size and mtime, so only a hash can tell
+        mov_path = os.path.join(self.bagpath, 'data', 'PreservationMasters',
+            'myd_263524_v01_pm.mov')
+        stat = os.stat(mov_path)
+        with open(mov_path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([byte[0] ^ 0xff]))
+        os.utime(mov_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def test_incremental_reuses_fast_verdict(self):
+        args = self.parse_args('--incremental', '--ledger', self.ledger_path)
+        result = validate_ami_bags.process_bags([self.bagpath], args, self.tmpdir)
+        self.assertEqual(result['valid_bags'], ['263524'])
+
+        self.flip_payload_byte()
+        result = validate_ami_bags.process_bags([self.bagpath], args, self.tmpdir)
+        self.assertEqual(result['valid_bags'], ['263524'])
+
+    def test_slow_rerun_catches_bitrot(self):
+        args = self.parse_args('--incremental', '--slow', '--ledger', self.ledger_path)
+        result = validate_ami_bags.process_bags([self.bagpath], args, self.tmpdir)
+        self.assertEqual(result['valid_bags'], ['263524'])
+
+        self.flip_payload_byte()
+        result = validate_ami_bags.process_bags([self.bagpath], args, self.tmpdir)
+        self.assertEqual(result['error_bags'], ['263524'])
+        self.assertEqual(result['valid_bags'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,14 @@
 import os
 import argparse
+import copy
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 import logging
 from ami_bag.ami_bag import ami_bag
+from ami_bag.validation_ledger import ValidationLedger, bag_fingerprint
+import ami_files.mediainfo_cache as mediainfo_cache
+import ami_files.profiling as profiling
 import re
 
 LOGGER = logging.getLogger()
@@ -19,7 +25,14 @@ def _make_parser():
     parser.add_argument("-d", "--directory", nargs='+', help="Path to a directory full of bags")
     parser.add_argument("-b", "--bagpath", nargs='+', default=None, help="Path to the base directory of the bag")
     parser.add_argument("--slow", action='store_false', help="Recalculate hashes (very slow)")
+    parser.add_argument("--checkpoint", action='store_true', help="With --slow, record each verified file so an interrupted check resumes where it stopped")
     parser.add_argument("--metadata", action='store_true', help="Validate Excel metadata files")
+    parser.add_argument("--workers", type=int, default=1, help="Number of bags to validate at the same time")
+    parser.add_argument("--metadata-workers", type=int, default=1, help="Number of JSON metadata files to validate at the same time within a bag")
+    parser.add_argument("--incremental", action='store_true', help="Skip bags unchanged since their last check and report the recorded result, ignored with --slow")
+    parser.add_argument("--ledger", default=None, help="Path to the file recording results for --incremental")
+    parser.add_argument("--no-mediainfo-cache", action='store_true', help="Rerun MediaInfo instead of using cached results")
+    parser.add_argument("--profile", default=None, help="Save time spent in each check per bag to this path (.json or .csv)")
     parser.add_argument('--log', help='The name of the log file')
     parser.add_argument('-q', '--quiet', action='store_true')
     return parser
@@ -65,6 +78,138 @@ def process_single_bag(bagpath, args):
     bagpath = os.path.abspath(bagpath)
     return process_bags([bagpath], args, bagpath)
 
+def check_bag(bagpath, fast, metadata, metadata_workers=1, checkpoint=False):
+    """
+    Validate a single bag and log its verdict.
+    Returns a (warning, error, checked) tuple, a bag that cannot be loaded
+    is an error. checked is False when loading or checking raised, and the
+    verdict may not hold once the cause, e.g. an unreadable file, is fixed.
+    """
+    LOGGER.info("Checking: {}".format(bagpath))
+    try:
+        with profiling.bag_scope(bagpath), profiling.phase("total"):
+            bag = ami_bag(path=bagpath)
+            warning, error = bag.check_amibag(fast=fast, metadata=metadata,
+                                              metadata_workers=metadata_workers,
+                                              checkpoint=checkpoint)
+    except Exception as e:
+        LOGGER.error("Following error encountered while loading {}: {}".format(bagpath, e))
+        return False, True, False
+
+    if warning:
+        LOGGER.warning("Bag may have issues (see warnings above): {}".format(bagpath))
+    if error:
+        LOGGER.error("Invalid bag: {}".format(bagpath))
+
+    return warning, error, True
+
+
+class _RecordCollector(logging.Handler):
+    """
+    Hold log records emitted in a worker process so they can be replayed
+    by the parent process once the bag is done.
+    """
+    def __init__(self):
+        super(_RecordCollector, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        # tracebacks and message args do not always pickle, so flatten
+        # them into the message the same way logging.handlers.QueueHandler does
+        msg = self.format(record)
+        record = copy.copy(record)
+        record.message = msg
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        self.records.append(record)
+
+
+_COLLECTOR = None
+
+def _init_worker(level, profile):
+    global _COLLECTOR
+    if profile:
+        profiling.enable()
+    _COLLECTOR = _RecordCollector()
+    _COLLECTOR.setFormatter(logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.handlers = [_COLLECTOR]
+    root.setLevel(level)
+
+def _check_bag_in_worker(bagpath, fast, metadata, metadata_workers, checkpoint):
+    _COLLECTOR.records = []
+    profiling.reset()
+    warning, error, checked = check_bag(bagpath, fast, metadata, metadata_workers, checkpoint)
+    return warning, error, checked, _COLLECTOR.records, profiling.get_records()
+
+def _replay_records(records):
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+def check_bags_in_pool(bags, args):
+    """
+    Validate bags in a pool of worker processes.
+    Each bag's log records are replayed as one block when the bag finishes.
+    Returns a dict of bag path to check_bag's (warning, error, checked).
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             initializer=_init_worker,
+                             initargs=(LOGGER.getEffectiveLevel(), profiling.is_enabled())) as pool:
+        futures = {
+            pool.submit(_check_bag_in_worker, bagpath, args.slow, args.metadata,
+                        args.metadata_workers, args.checkpoint): bagpath
+            for bagpath in bags
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            bagpath = futures[future]
+            try:
+                warning, error, checked, records, profile_records = future.result()
+            except Exception as e:
+                LOGGER.error("Following error encountered while checking {}: {}".format(bagpath, e))
+                warning, error, checked = False, True, False
+            else:
+                _replay_records(records)
+                profiling.merge_records(profile_records)
+            results[bagpath] = (warning, error, checked)
+
+    return results
+
+def check_ledger(ledger, bags, args):
+    """
+    Look up each bag's last recorded result.
+    Returns the bags' current fingerprints and the results of unchanged bags.
+    """
+    fingerprints = {}
+    results = {}
+    for bagpath in bags:
+        try:
+            fingerprints[bagpath] = bag_fingerprint(bagpath)
+        except OSError as e:
+            LOGGER.warning("Cannot fingerprint {}, checking it in full: {}".format(bagpath, e))
+            continue
+
+        recorded = ledger.get(bagpath, fingerprints[bagpath], args.slow, args.metadata)
+        if not recorded:
+            continue
+
+        warning, error, checked = recorded
+        checked = datetime.datetime.fromtimestamp(checked).isoformat(sep=' ', timespec='seconds')
+        LOGGER.info("Unchanged since {}: {}".format(checked, bagpath))
+        if warning:
+            LOGGER.warning("Bag may have issues (recorded {}): {}".format(checked, bagpath))
+        if error:
+            LOGGER.error("Invalid bag (recorded {}): {}".format(checked, bagpath))
+        results[bagpath] = (warning, error, True)
+
+    if results:
+        LOGGER.info("Skipping {} of {} bag(s) unchanged since their last check".format(len(results), len(bags)))
+
+    return fingerprints, results
+
 def process_bags(bags, args, directory_path):
 
     # Log the number of bags or folders being processed
@@ -77,24 +222,42 @@ def process_bags(bags, args, directory_path):
     error_bags = []
     valid_bags = []
 
-    for bagpath in tqdm(sorted(bags)):
-        LOGGER.info("Checking: {}".format(bagpath))
-        try:
-            bag = ami_bag(path=bagpath)
-            warning, error = bag.check_amibag(fast=args.slow, metadata=args.metadata)
+    bags = sorted(bags)
+    results = {}
+    fingerprints = {}
+    # the fingerprint only sees payload sizes and mtimes, so a recorded
+    # verdict cannot stand in for a full fixity check
+    use_ledger = args.incremental and args.slow
+    if args.incremental and not use_ledger:
+        LOGGER.info("Recalculating hashes, --incremental does not skip any bags")
+    if use_ledger:
+        ledger = ValidationLedger(args.ledger)
+        fingerprints, results = check_ledger(ledger, bags, args)
 
-            if warning:
-                LOGGER.warning("Bag may have issues (see warnings above): {}".format(bagpath))
-                warning_bags.append(os.path.basename(bagpath))
+    unchecked_bags = [bagpath for bagpath in bags if bagpath not in results]
+    if args.workers > 1 and len(unchecked_bags) > 1:
+        results.update(check_bags_in_pool(unchecked_bags, args))
+    else:
+        for bagpath in tqdm(unchecked_bags):
+            results[bagpath] = check_bag(bagpath, args.slow, args.metadata,
+                                         args.metadata_workers, args.checkpoint)
 
-            if error:
-                LOGGER.error("Invalid bag: {}".format(bagpath))
-                error_bags.append(os.path.basename(bagpath))
-            else:
-                valid_bags.append(os.path.basename(bagpath))
-        except Exception as e:
-            LOGGER.error("Following error encountered while loading {}: {}".format(bagpath, e))
+    if use_ledger:
+        # only verdicts check_amibag returned are kept, a bag that raised is rechecked next time
+        for bagpath in unchecked_bags:
+            warning, error, checked = results[bagpath]
+            if checked and fingerprints.get(bagpath):
+                ledger.put(bagpath, fingerprints[bagpath], args.slow, args.metadata, warning, error)
+        ledger.close()
+
+    for bagpath in bags:
+        warning, error, checked = results[bagpath]
+        if warning:
+            warning_bags.append(os.path.basename(bagpath))
+        if error:
             error_bags.append(os.path.basename(bagpath))
+        else:
+            valid_bags.append(os.path.basename(bagpath))
 
     return {
         'directory': directory_path,
@@ -133,9 +296,17 @@ def log_summary(results):
 def main():
     parser = _make_parser()
     args = parser.parse_args()
+    if args.checkpoint and args.slow:
+        parser.error("--checkpoint only applies to full fixity checks, use it with --slow")
     _configure_logging(args)
     log_checks(args)
 
+    if args.no_mediainfo_cache:
+        mediainfo_cache.disable_cache()
+
+    if args.profile:
+        profiling.enable()
+
     results = []
 
     if args.directory:
@@ -152,5 +323,9 @@ def main():
 
     log_summary(results)
 
+    if args.profile:
+        profiling.dump(args.profile)
+        LOGGER.info("Profile written to {}".format(args.profile))
+
 if __name__ == "__main__":
     main()
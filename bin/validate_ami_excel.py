@@ -3,11 +3,11 @@
 import argparse
 import os
 import re
-import xlrd
 import sys
 import logging
 from openpyxl import load_workbook
 from ami_md.ami_excel import ami_excel
+import ami_files.profiling as profiling
 
 LOGGER = logging.getLogger(__name__)
 
@@ -35,6 +35,7 @@ def _make_parser():
                         help = "path to an AMI Excel file")
     parser.add_argument("-o", "--output",
                         help = "filename to save Excel file if rewritten")
+    parser.add_argument('--profile', help='Save time spent parsing and validating to this path (.json or .csv)')
     parser.add_argument('--log', help='The name of the log file')
     parser.add_argument('--quiet', action='store_true')
     return parser
@@ -46,10 +47,16 @@ def main():
 
     _configure_logging(args)
 
+    if args.profile:
+        profiling.enable()
+
     if args.excel:
         excel = ami_excel(args.excel)
 
-    if excel and excel.validate_workbook():
+    with profiling.phase("validate_workbook"):
+        excel_valid = excel and excel.validate_workbook()
+
+    if excel_valid:
         LOGGER.info("{}: valid".format(args.excel))
     else:
         if args.output:
@@ -61,6 +68,9 @@ def main():
             else:
                 LOGGER.error("{}: invalid".format(args.output))
 
+    if args.profile:
+        profiling.dump(args.profile)
+
 
 
 if __name__ == "__main__":
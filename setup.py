@@ -16,7 +16,6 @@ requirements = [
     "bagit>=1.6.0b8",
     "pandas",
     "tqdm",
-    "xlrd",
     "openpyxl",
     "pymediainfo",
     "python-dateutil"
@@ -30,7 +29,7 @@ setup(
     url = 'https://github.com/nypl/ami-tools/',
     author = 'Nick Krabbenhoeft',
     author_email = 'nickkrabennhoeft@nypl.org',
-    packages = find_packages(exclude = ['bin']),
+    packages = find_packages(exclude = ['bin', 'benchmarks']),
     scripts = ['bin/create_json_from_excel.py',
                'bin/fix_baginfo.py',
                'bin/repair_bags.py',
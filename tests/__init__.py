@@ -0,0 +1,12 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+from ami_files.cache_dir import CACHE_DIR_ENV
+
+# keep the suite off the user's cache, results cached by an earlier run
+# would otherwise stand in for MediaInfo
+_CACHE_DIR = tempfile.mkdtemp(prefix = 'ami-tools-test-cache-')
+os.environ[CACHE_DIR_ENV] = _CACHE_DIR
+atexit.register(shutil.rmtree, _CACHE_DIR, ignore_errors = True)
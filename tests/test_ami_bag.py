@@ -5,9 +5,11 @@ import shutil
 import glob
 import bagit
 import json
+from unittest import mock
 
 import ami_bag.ami_bag as ami_bag
 import ami_bag.ami_bag_constants as ami_bag_constants
+import ami_files.profiling as profiling
 
 
 class SelfCleaningTestCase(unittest.TestCase):
@@ -91,6 +93,111 @@ class TestJSONVideoAMIBag(SelfCleaningTestCase):
 		for attr in attrs:
 			self.assertTrue(hasattr(bag, attr))
 
+	def test_payload_index(self):
+		# The payload index should agree with the manifest and the filesystem
+		bagit.make_bag(self.tmpdir)
+		bag = ami_bag.ami_bag(path = self.tmpdir)
+		self.assertEqual(bag.data_files, set(bag.payload_entries().keys()))
+		for entry in bag.payload_index:
+			full_path = os.path.join(self.tmpdir, entry.path)
+			self.assertEqual(entry.size, os.stat(full_path).st_size)
+		self.assertEqual(bag.data_size, int(bag.info['Payload-Oxum'].split('.')[0]))
+		self.assertEqual(bag.pm_filepaths, set(
+			[path for path in bag.media_filepaths if '_pm.' in path]))
+
+	def test_payload_walked_once(self):
+		# Loading walks data/ for the completeness check and reuses that walk
+		bagit.make_bag(self.tmpdir)
+		data_dir = os.path.join(self.tmpdir, 'data')
+		payload_dirs = len(list(os.walk(data_dir)))
+		with mock.patch('os.scandir', wraps = os.scandir) as scandir:
+			ami_bag.ami_bag(path = self.tmpdir)
+		data_scans = [call for call in scandir.call_args_list
+			if str(call.args[0]).startswith(data_dir)]
+		self.assertEqual(len(data_scans), payload_dirs)
+
+	def test_profile_bag_bytes(self):
+		# The bag total includes the bytes read by the checks inside it
+		bagit.make_bag(self.tmpdir)
+		profiling.reset()
+		profiling.enable()
+		try:
+			with profiling.bag_scope(self.tmpdir), profiling.phase("total"):
+				bag = ami_bag.ami_bag(path = self.tmpdir)
+				bag.check_amibag(fast = False)
+			records = {r['phase']: r for r in profiling.get_records()}
+		finally:
+			profiling.disable()
+			profiling.reset()
+		self.assertGreater(bag.data_size, 0)
+		self.assertEqual(records['validate']['bytes'], bag.data_size)
+		self.assertGreaterEqual(records['total']['bytes'], bag.data_size)
+
+	def test_filename_index(self):
+		# Filenames are parsed once into their components
+		bagit.make_bag(self.tmpdir)
+		bag = ami_bag.ami_bag(path = self.tmpdir)
+		self.assertEqual(len(bag.filename_index), len(bag.payload_index))
+		self.assertEqual(bag.media_bases, {'pm': {'myd_263524_v01'}, 'sc': {'myd_263524_v01'}})
+
+		record = ami_bag.parse_filename(ami_bag.PayloadFile(
+			path = 'data/PreservationMasters/myd_263524_v02f01r03p04_pm.wav',
+			name = 'myd_263524_v02f01r03p04_pm.wav', dir = 'PreservationMasters',
+			ext = '.wav', role = 'pm', size = 0))
+		self.assertEqual(record.base, 'myd_263524_v02f01r03p04')
+		self.assertEqual((record.volume, record.face, record.region, record.part),
+			('02', '01', '03', '04'))
+		self.assertTrue(record.standard)
+		self.assertTrue(record.subobject)
+		self.assertTrue(record.part_file)
+
+	def test_lazy_json_metadata(self):
+		# JSON sidecars are read on first use, and only once
+		bagit.make_bag(self.tmpdir)
+		bag = ami_bag.ami_bag(path = self.tmpdir)
+		self.assertEqual(bag.metadata_json, {})
+		self.assertEqual(bag.media_files_md, set(
+			[os.path.basename(path) for path in bag.media_filepaths]))
+		self.assertEqual(set(bag.metadata_json.keys()), set(bag.metadata_files))
+		pm_json = bag.metadata_json['data/PreservationMasters/myd_263524_v01_pm.json']
+		bag.check_metadata_json()
+		self.assertIs(bag.get_metadata_json('data/PreservationMasters/myd_263524_v01_pm.json'), pm_json)
+
+	def test_corrupt_json_metadata_without_metadata_check(self):
+		# Invalid if a sidecar can't be parsed, even without the metadata check
+		# Method: Truncate a sidecar after bagging
+		json_path = os.path.join(self.tmpdir,
+			'PreservationMasters/myd_263524_v01_pm.json')
+		with open(json_path, 'w') as f:
+			f.write('{"broken": ')
+		bagit.make_bag(self.tmpdir)
+		bag = ami_bag.ami_bag(path = self.tmpdir)
+		with self.assertLogs('ami_bag.ami_bag', 'ERROR') as cm:
+			warning, error = bag.check_amibag(metadata = False)
+		self.assertTrue(error)
+		self.assertTrue('Metadata balance out of spec' in cm.output[0])
+
+	def test_json_metadata_without_technical_filename(self):
+		# Invalid if a sidecar lacks its technical filename
+		# Method: Rewrite json without technical.filename
+		json_path = os.path.join(self.tmpdir,
+			'PreservationMasters/myd_263524_v01_pm.json')
+		with open(json_path, 'r') as f:
+			json_data = json.load(f)
+		json_data['technical'].pop('filename', None)
+		with open(json_path, 'w') as f:
+			json.dump(json_data, f, ensure_ascii=False)
+		bagit.make_bag(self.tmpdir)
+		bag = ami_bag.ami_bag(path = self.tmpdir)
+		self.assertFalse(bag.validate_amibag(metadata = False))
+
+	def test_metadata_json_in_threads(self):
+		# Threaded validation of sidecars agrees with serial validation
+		bagit.make_bag(self.tmpdir)
+		bag = ami_bag.ami_bag(path = self.tmpdir)
+		self.assertTrue(bag.validate_amibag(metadata = True, metadata_workers = 2))
+		self.assertEqual(set(bag.metadata_json_timings.keys()), set(bag.metadata_files))
+
 	def test_notype_bag(self):
 		# Invalid if the bag doesn't map to Excel, JSON, or Excel-JSON
 		# Method: Remove all metadata from bag to obscure type classification
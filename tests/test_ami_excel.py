@@ -1,9 +1,196 @@
+import os
+import json
+import shutil
+import tempfile
 import unittest
+from unittest import mock
+
+import pandas as pd
+
+import ami_md.ami_md_constants as ami_md_constants
+import ami_md.ami_excel as ami_excel
+import ami_md.ami_json as ami_json
+from benchmarks import workbooks
+
+
+def make_workbook(path, rows):
+	workbooks.make_workbook(path, {"Preservation masters": rows})
+
+
+def media_row(filename, title):
+	# values for every column up to technical.extension, leaving out
+	# the columns that share a key with another header
+	return [filename + ".mov", title, "*LT 1", "MYD", "1990", None,
+		"Betacam", "Original", None, "NTSC", "Color", None, None, None, None,
+		filename, "mov"]
+
+
+def read_json(directory):
+	trees = {}
+	for filename in os.listdir(directory):
+		with open(os.path.join(directory, filename)) as f:
+			trees[filename] = json.load(f)
+	return trees
+
 
 class TestAMIExcel(unittest.TestCase):
 
 	def setUp(self):
 		self.tmpdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmpdir, "myd_mss1.xlsx")
+		make_workbook(self.path, [["myd_1_v01_pm", "A title"]])
+
+	def tearDown(self):
+		ami_excel.clear_workbook_cache()
+		shutil.rmtree(self.tmpdir)
+
+	def test_load_excel(self):
+		excel = ami_excel.ami_excel(self.path)
+		self.assertEqual(excel.pres_sheet.header_entries,
+			ami_md_constants.MEDIAINGEST_EXPECTED_HEADERS)
+		self.assertEqual(excel.pres_sheet.sheet_values["bibliographic.title"].tolist(),
+			["A title"])
+
+	def test_workbook_opened_once(self):
+		excel = ami_excel.ami_excel(self.path)
+		excel.pres_sheet.sheet_values["bibliographic.title"] = "Changed"
+		reopened = ami_excel.ami_excel(self.path)
+		self.assertIs(excel.workbook, reopened.workbook)
+		self.assertEqual(reopened.pres_sheet.sheet_values["bibliographic.title"].tolist(),
+			["A title"])
+
+	def test_workbook_reloaded_when_changed(self):
+		excel = ami_excel.ami_excel(self.path)
+		make_workbook(self.path, [["myd_1_v01_pm", "A new title"], ["myd_2_v01_pm", "Another"]])
+		os.utime(self.path, ns = (0, 0))
+		reopened = ami_excel.ami_excel(self.path)
+		self.assertIsNot(excel.workbook, reopened.workbook)
+		self.assertEqual(len(reopened.pres_sheet.sheet_values), 2)
+
+	def test_check_noequations(self):
+		make_workbook(self.path, [["myd_1_v01_pm", "=A4"]])
+		excel = ami_excel.ami_excel(self.path)
+		self.assertRaises(ami_excel.AMIExcelError, excel.pres_sheet.check_noequations)
+
+
+class TestConvertToJSON(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmpdir, "myd_mss1.xlsx")
+		make_workbook(self.path, [
+			media_row("myd_1_v01_pm", "One"),
+			media_row("myd_2_v01_pm", "Two"),
+			media_row("myd_3_v01_pm", "Three")])
+
+		self.filepaths = []
+		for filename in ["myd_3_v01_pm.mov", "myd_1_v01_pm.mov"]:
+			filepath = os.path.join(self.tmpdir, filename)
+			open(filepath, 'w').close()
+			self.filepaths.append(filepath)
+
+		self.json_dir = os.path.join(self.tmpdir, "json")
+		os.mkdir(self.json_dir)
+		self.expected_dir = os.path.join(self.tmpdir, "expected")
+		os.mkdir(self.expected_dir)
+
+		# media files are empty, so leave MediaInfo out of the comparison
+		patcher = mock.patch.object(ami_json.ami_json, "repair_techmd")
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		ami_excel.clear_workbook_cache()
+		shutil.rmtree(self.tmpdir)
+
+	def load_sheet(self):
+		ami_excel.clear_workbook_cache()
+		return ami_excel.ami_excel(self.path).pres_sheet
+
+	def test_rows_by_filename(self):
+		sheet = self.load_sheet()
+		sheet.normalize_sheet_values()
+		rows = sheet.get_rowsByFilename()
+		self.assertEqual(set(rows.keys()),
+			set(["myd_1_v01_pm", "myd_2_v01_pm", "myd_3_v01_pm"]))
+		self.assertEqual(rows["myd_2_v01_pm"]["bibliographic.title"], "Two")
+		self.assertEqual(rows["myd_2_v01_pm"]["technical.filename"], "myd_2_v01_pm")
+		self.assertIsNone(rows.get("myd_4_v01_pm"))
+
+	def test_rows_by_filename_duplicates(self):
+		make_workbook(self.path, [
+			media_row("myd_1_v01_pm", "One"),
+			media_row("myd_1_v01_pm", "Another one")])
+		os.utime(self.path, ns = (0, 0))
+		sheet = self.load_sheet()
+		sheet.normalize_sheet_values()
+		with self.assertLogs('ami_md.ami_excel', 'WARNING') as cm:
+			rows = sheet.get_rowsByFilename()
+		self.assertTrue("myd_1_v01_pm" in cm.output[0])
+		self.assertEqual(list(rows.keys()), ["myd_1_v01_pm"])
+		self.assertEqual(rows["myd_1_v01_pm"]["bibliographic.title"], "One")
+
+	def test_convert_filename_not_in_sheet(self):
+		missing = os.path.join(self.tmpdir, "myd_4_v01_pm.mov")
+		open(missing, 'w').close()
+		sheet = self.load_sheet()
+		with self.assertLogs('ami_md.ami_excel', 'ERROR') as cm:
+			converted = sheet.convert_amiExcelToJSON(self.json_dir,
+				filepaths = self.filepaths + [missing])
+		self.assertTrue("myd_4_v01_pm.mov" in cm.output[0])
+		self.assertEqual(converted, 2)
+		self.assertEqual(set(os.listdir(self.json_dir)),
+			set(["myd_1_v01_pm.json", "myd_3_v01_pm.json"]))
+
+	def test_convert_filepaths_same_as_per_row(self):
+		sheet = self.load_sheet()
+		sheet.convert_amiExcelToJSON(self.json_dir, filepaths = self.filepaths)
+
+		# previous conversion, filtering the sheet once per file
+		sheet = self.load_sheet()
+		sheet.normalize_sheet_values()
+		df = sheet.sheet_values
+		for filepath in self.filepaths:
+			media_filename = os.path.basename(filepath)
+			row = df[df["technical.filename"] == os.path.splitext(media_filename)[0]]
+			row_dict = row.squeeze().to_dict()
+			row_dict["asset.referenceFilename"] = media_filename
+			json_tree = ami_json.ami_json(flat_dict = row_dict,
+				filepath = filepath, load = False, media_filepath = filepath)
+			json_tree.write_json(self.expected_dir)
+
+		self.assertEqual(read_json(self.json_dir), read_json(self.expected_dir))
+
+	def test_convert_sheet_same_as_per_row(self):
+		sheet = self.load_sheet()
+		self.assertEqual(sheet.convert_amiExcelToJSON(self.json_dir), 3)
+
+		sheet = self.load_sheet()
+		sheet.normalize_sheet_values()
+		for (index, row) in sheet.sheet_values.iterrows():
+			json_tree = ami_json.ami_json(flat_dict = row.to_dict())
+			json_tree.write_json(self.expected_dir)
+
+		self.assertEqual(len(os.listdir(self.json_dir)), 3)
+		self.assertEqual(read_json(self.json_dir), read_json(self.expected_dir))
+
+
+class TestReplaceValues(unittest.TestCase):
+
+	def test_same_as_pandas_replace(self):
+		regex_dict = {"a": {"^x": "y", "^y": "z", "(\\d+)cm": "\\1", "^n": None}}
+		string_dict = {"a": {"z": "zed", 0: None}, "b": {"x": "ex"}}
+		df = pd.DataFrame({
+			"a": ["x", "y", "12cm", "no", 0, 0.0, None, "z"],
+			"b": ["x", "y", "x", 1, "x", "x", "x", "x"],
+			"c": ["x"] * 8}).astype(object)
+
+		expected = df.replace(regex_dict, regex = True).astype(object).replace(string_dict)
+		rules = ami_excel.compile_replacements(regex_dict, string_dict)
+		pd.testing.assert_frame_equal(ami_excel.replace_values(df, rules), expected)
+
+	def test_late_inline_flags(self):
+		self.assertTrue(ami_excel.compile_pattern("^(?i)full$").match("FULL"))
 
 
 if __name__ == '__main__':
@@ -1,7 +1,11 @@
 import unittest
+from unittest import mock
 import os
+import shutil
+import tempfile
 
 import ami_files.ami_file as af
+import ami_files.mediainfo_cache as mediainfo_cache
 
 pm_json_dir = 'tests/test-data/json-video-bag/PreservationMasters'
 pm_mov_filename = 'myd_263524_v01_pm.mov'
@@ -34,6 +38,79 @@ class TestAMIFile(unittest.TestCase):
 		self.assertTrue(expected_msg in str(context.exception))
 
 
+class TestMediaInfoCache(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.media_path = os.path.join(self.tmpdir, 'myd_263524_v01_pm.mov')
+		with open(self.media_path, 'wb') as f:
+			f.write(b'\x00' * 16)
+		self.fields = {'file_name': 'myd_263524_v01_pm', 'file_size': 16}
+		self.cache = mediainfo_cache.MediaInfoCache(
+			path = os.path.join(self.tmpdir, 'cache.sqlite'))
+
+	def tearDown(self):
+		self.cache.close()
+		shutil.rmtree(self.tmpdir)
+
+	def test_cache_hit(self):
+		self.assertIsNone(self.cache.get(self.media_path))
+		self.cache.put(self.media_path, self.fields)
+		self.assertEqual(self.cache.get(self.media_path), self.fields)
+
+	def test_cache_miss_after_file_changes(self):
+		self.cache.put(self.media_path, self.fields)
+		with open(self.media_path, 'ab') as f:
+			f.write(b'\x00')
+		self.assertIsNone(self.cache.get(self.media_path))
+
+	def test_cache_evicts_least_recently_used(self):
+		self.cache.max_entries = 2
+		paths = []
+		for i in range(3):
+			path = os.path.join(self.tmpdir, '{}.mov'.format(i))
+			with open(path, 'wb') as f:
+				f.write(b'\x00')
+			paths.append(path)
+		self.cache.put(paths[0], self.fields)
+		self.cache.put(paths[1], self.fields)
+		self.cache.get(paths[0])
+		self.cache.put(paths[2], self.fields)
+		self.assertIsNotNone(self.cache.get(paths[0]))
+		self.assertIsNone(self.cache.get(paths[1]))
+		self.assertIsNotNone(self.cache.get(paths[2]))
+
+	def test_cache_counted_on_eviction_only(self):
+		self.cache.max_entries = 10
+		paths = []
+		for i in range(11):
+			path = os.path.join(self.tmpdir, '{}.mov'.format(i))
+			with open(path, 'wb') as f:
+				f.write(b'\x00')
+			paths.append(path)
+
+		with mock.patch.object(self.cache, 'count_entries',
+			wraps = self.cache.count_entries) as count_entries:
+			for path in paths[:10]:
+				self.cache.put(path, self.fields)
+			self.cache.put(paths[0], self.fields)
+			count_entries.assert_not_called()
+			self.cache.put(paths[10], self.fields)
+			count_entries.assert_called_once_with()
+
+		# room is made for the next tenth of max_entries
+		self.assertEqual(self.cache.count_entries(), 9)
+		self.assertEqual(self.cache.entries, 9)
+		self.assertIsNotNone(self.cache.get(paths[0]))
+		self.assertIsNone(self.cache.get(paths[1]))
+
+	def test_cache_bypass(self):
+		os.environ[mediainfo_cache.NO_CACHE_ENV] = '1'
+		try:
+			self.assertIsNone(mediainfo_cache.get_default_cache())
+		finally:
+			os.environ.pop(mediainfo_cache.NO_CACHE_ENV)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -2,6 +2,7 @@ import unittest
 import os
 import tempfile
 import shutil
+import pandas as pd
 import ami_files.ami_file as af
 
 import ami_md.ami_json as aj
@@ -225,6 +226,27 @@ class TestAMIJSON(unittest.TestCase):
 
 
 
+class TestFrameToJSON(unittest.TestCase):
+
+	def test_columnar_matches_flat_dict(self):
+		md = pd.DataFrame({
+			'asset.referenceFilename': ['myd_1_v01_pm.wav', 'myd_2_v01_pm.wav'],
+			'source.object.type': ['audio cassette analog', 'audio cassette analog'],
+			'bibliographic.primaryID': [100001, 100002],
+			'bibliographic.title': ['A title', None],
+			'source.audioRecording.numberOfAudioTracks': [0, 2],
+			'technical.durationMilli.measure': [0.0, 1234.5],
+			'technical.dateCreated': pd.to_datetime(['2020-01-02', None])})
+
+		for (index, row), nested_dict in zip(md.iterrows(),
+			aj.convert_frameToNestedDicts(md, '2.0.0')):
+			flat_json = aj.ami_json(flat_dict = row.to_dict(), schema_version = '2.0.0')
+			nested_json = aj.ami_json(nested_dict = nested_dict)
+			self.assertEqual(nested_json.dict, flat_json.dict)
+			self.assertEqual(nested_json.filename, flat_json.filename)
+
+
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,61 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+
+import ami_bag.hashing as hashing
+
+
+class TestHashFile(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmpdir, 'payload.bin')
+		self.content = os.urandom(100000)
+		with open(self.path, 'wb') as f:
+			f.write(self.content)
+		self.expected = {alg: hashlib.new(alg, self.content).hexdigest()
+			for alg in ['md5', 'sha256']}
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_read(self):
+		hashes, size = hashing.hash_file(self.path, ['md5', 'sha256'], block_size = 4096)
+		self.assertEqual(hashes, self.expected)
+		self.assertEqual(size, len(self.content))
+
+	def test_small_file_buffer(self):
+		# a small file is read into a buffer of its own size
+		with open(self.path, 'wb') as f:
+			f.write(b'tag')
+		with mock.patch('ami_bag.hashing.bytearray', create = True,
+			wraps = bytearray) as buffer:
+			hashes, size = hashing.hash_file(self.path, ['md5'])
+		buffer.assert_called_once_with(3)
+		self.assertEqual(hashes, {'md5': hashlib.md5(b'tag').hexdigest()})
+		self.assertEqual(size, 3)
+
+	def test_empty_file(self):
+		with open(self.path, 'wb') as f:
+			pass
+		hashes, size = hashing.hash_file(self.path, ['md5'])
+		self.assertEqual(hashes, {'md5': hashlib.md5(b'').hexdigest()})
+		self.assertEqual(size, 0)
+
+	def test_mmap(self):
+		min_size = hashing.MMAP_MIN_SIZE
+		hashing.MMAP_MIN_SIZE = 1
+		try:
+			hashes, size = hashing.hash_file(self.path, ['md5', 'sha256'],
+				block_size = 4096, use_mmap = True)
+		finally:
+			hashing.MMAP_MIN_SIZE = min_size
+		self.assertEqual(hashes, self.expected)
+		self.assertEqual(size, len(self.content))
+
+
+if __name__ == '__main__':
+	unittest.main()
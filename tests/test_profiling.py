@@ -0,0 +1,72 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import ami_files.profiling as profiling
+
+
+@profiling.timed("double", nbytes = lambda x: x)
+def double(x):
+	return x * 2
+
+
+class TestProfiling(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		profiling.reset()
+		profiling.enable()
+
+	def tearDown(self):
+		profiling.disable()
+		profiling.reset()
+		shutil.rmtree(self.tmpdir)
+
+	def test_disabled_records_nothing(self):
+		profiling.disable()
+		self.assertEqual(double(2), 4)
+		self.assertEqual(profiling.get_records(), [])
+
+	def test_records_per_bag(self):
+		with profiling.bag_scope("bag1"):
+			double(2)
+			double(3)
+		with profiling.bag_scope("bag2"), profiling.phase("checks"):
+			double(4)
+		records = {(r['bag'], r['phase']): r for r in profiling.get_records()}
+		self.assertEqual(records[("bag1", "double")]['calls'], 2)
+		self.assertEqual(records[("bag1", "double")]['bytes'], 5)
+		self.assertEqual(records[("bag2", "double")]['calls'], 1)
+		self.assertIn(("bag2", "checks"), records)
+
+	def test_nested_bytes_roll_up(self):
+		with profiling.bag_scope("bag1"), profiling.phase("total"):
+			with profiling.phase("checks"):
+				double(2)
+				with ThreadPoolExecutor(max_workers = 2) as pool:
+					list(pool.map(profiling.in_current_scope(double), [3, 4]))
+			with profiling.phase("validate", nbytes = 100):
+				double(5)
+		records = {r['phase']: r for r in profiling.get_records()}
+		self.assertEqual(records["double"]['bytes'], 14)
+		self.assertEqual(records["checks"]['bytes'], 9)
+		self.assertEqual(records["validate"]['bytes'], 100)
+		self.assertEqual(records["total"]['bytes'], 109)
+
+	def test_merge_and_dump(self):
+		profiling.merge_records([{'bag': 'bag1', 'phase': 'load', 'calls': 1, 'seconds': 0.5, 'bytes': 0}])
+		profiling.merge_records([{'bag': 'bag1', 'phase': 'load', 'calls': 1, 'seconds': 0.25, 'bytes': 0}])
+		path = os.path.join(self.tmpdir, 'profile.csv')
+		profiling.dump(path)
+		with open(path) as f:
+			rows = list(csv.DictReader(f))
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(rows[0]['calls'], '2')
+		self.assertEqual(float(rows[0]['seconds']), 0.75)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -3,6 +3,7 @@
 import codecs
 import datetime
 import hashlib
+import json
 import logging
 import os
 import shutil
@@ -10,6 +11,8 @@ import stat
 import sys
 import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from os.path import join as j
 import bagit
 
@@ -113,6 +116,90 @@ class TestSingleProcessValidation(unittest.TestCase):
 		self.assertEqual(bag.entries["data/hello.txt"], updated_bag.entries["data/hello.txt"])
 		self.assertTrue(self.validate(updated_bag))
 
+	def test_add_payload_files_not_in_manifest_threaded(self):
+		bagit.make_bag(self.tmpdir, checksums=['md5', 'sha256'])
+		bag = update_bag.Repairable_Bag(path = self.tmpdir, hash_workers = 4,
+			max_inflight_bytes = 1)
+		for i in range(10):
+			with open(j(self.tmpdir, "data/new_{}.txt".format(i)), 'w') as r:
+				r.write('♡' * i)
+		bag.add_payload_files_not_in_manifest()
+		updated_bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		self.assertEqual(len(updated_bag.payload_entries()), 11)
+		self.assertTrue(self.validate(updated_bag))
+
+	def test_update_hashes_threaded(self):
+		bagit.make_bag(self.tmpdir, checksums=['sha1', 'sha256'])
+		bag = update_bag.Repairable_Bag(path = self.tmpdir, hash_workers = 2)
+		f = j(self.tmpdir, "data/hello.txt")
+		with open(f, 'w') as r:
+			r.write('♡')
+		bag.update_hashes()
+		updated_bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		self.assertTrue(self.validate(updated_bag))
+
+	def test_repair_does_not_change_working_directory(self):
+		bagit.make_bag(self.tmpdir)
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		f = j(self.tmpdir, "data/new.txt")
+		with open(f, 'w') as r:
+			r.write('♡')
+		cwd = os.getcwd()
+		bag.add_payload_files_not_in_manifest()
+		self.assertEqual(os.getcwd(), cwd)
+		updated_bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		self.assertTrue(self.validate(updated_bag))
+
+	def test_repair_bags_in_threads(self):
+		bagit.make_bag(self.tmpdir, checksums=['md5', 'sha256'])
+		bag_paths = []
+		for i in range(4):
+			bag_path = self.tmpdir + "_{}".format(i)
+			shutil.copytree(self.tmpdir, bag_path)
+			with open(j(bag_path, "data/new.txt"), 'w') as r:
+				r.write('♡' * i)
+			bag_paths.append(bag_path)
+
+		def repair(bag_path):
+			update_bag.Repairable_Bag(path = bag_path).add_payload_files_not_in_manifest()
+
+		try:
+			with ThreadPoolExecutor(max_workers = 4) as pool:
+				list(pool.map(repair, bag_paths))
+			for bag_path in bag_paths:
+				updated_bag = update_bag.Repairable_Bag(path = bag_path)
+				self.assertTrue(self.validate(updated_bag))
+		finally:
+			for bag_path in bag_paths:
+				shutil.rmtree(bag_path)
+
+	def test_payload_walked_once(self):
+		bagit.make_bag(self.tmpdir)
+		with open(j(self.tmpdir, 'data', 'new.txt'), 'w') as f:
+			f.write('new')
+		os.remove(j(self.tmpdir, 'data', 'hello.txt'))
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		data_dir = j(self.tmpdir, 'data')
+		with mock.patch('os.walk', wraps = os.walk) as walk:
+			self.assertEqual(list(bag.payload_files_not_in_manifest()), ['data/new.txt'])
+			bag.add_payload_files_not_in_manifest()
+			bag.delete_manifest_files_not_in_payload()
+		data_walks = [call for call in walk.call_args_list if call.args[0] == data_dir]
+		self.assertEqual(len(data_walks), 1)
+		self.assertTrue(self.validate(update_bag.Repairable_Bag(path = self.tmpdir), fast = False))
+
+	def test_payload_stat_once(self):
+		bagit.make_bag(self.tmpdir)
+		data_dir = j(self.tmpdir, 'data')
+		with mock.patch('os.stat', wraps = os.stat) as stat_call:
+			bag = update_bag.Repairable_Bag(path = self.tmpdir)
+			bag.validate(completeness_only = True)
+			self.assertTrue(bag.check_oxum())
+			self.assertFalse(bag.write_baginfo())
+		payload_stats = [call for call in stat_call.call_args_list
+			if str(call.args[0]).startswith(data_dir + os.sep)]
+		self.assertEqual(len(payload_stats), len(bag.payload_snapshot()))
+
 	def test_delete_payload_files_not_in_manifest(self):
 		bagit.make_bag(self.tmpdir)
 		bag = update_bag.Repairable_Bag(path = self.tmpdir)
@@ -182,6 +269,119 @@ class TestSingleProcessValidation(unittest.TestCase):
 		self.assertEqual(updated_bag.premis_events[0]['Event-Human-Agent'],
 			"Yogi Bear")
 
+	def test_validate_fixity(self):
+		bagit.make_bag(self.tmpdir)
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		checkpoint = j(self.tmpdir, 'fixity.jsonl')
+		self.assertTrue(bag.validate_fixity(checkpoint))
+		self.assertFalse(os.path.exists(checkpoint))
+		with open(j(self.tmpdir, 'data', 'hello.txt'), 'a') as f:
+			f.write('corrupted')
+		self.assertRaises(bagit.BagValidationError, bag.validate_fixity, checkpoint)
+
+	def test_validate_fixity_missing_file(self):
+		bagit.make_bag(self.tmpdir)
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		os.remove(j(self.tmpdir, 'data', 'hello.txt'))
+		with self.assertRaises(bagit.BagValidationError) as cm:
+			bag.validate_fixity(j(self.tmpdir, 'fixity.jsonl'))
+		self.assertEqual([str(e) for e in cm.exception.details],
+			[str(bagit.FileMissing('data/hello.txt'))])
+
+	def test_resume_validate_fixity(self):
+		bagit.make_bag(self.tmpdir)
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		checkpoint = j(self.tmpdir, 'fixity.jsonl')
+		check_entry_fixity = bag.check_entry_fixity
+		checked = []
+
+		def interrupted(payload_file):
+			if len(checked) == 2:
+				raise KeyboardInterrupt
+			checked.append(payload_file)
+			return check_entry_fixity(payload_file)
+
+		bag.check_entry_fixity = interrupted
+		self.assertRaises(KeyboardInterrupt, bag.validate_fixity, checkpoint)
+		self.assertTrue(os.path.exists(checkpoint))
+
+		resumed = []
+		def resumed_check(payload_file):
+			resumed.append(payload_file)
+			return check_entry_fixity(payload_file)
+
+		bag.check_entry_fixity = resumed_check
+		self.assertTrue(bag.validate_fixity(checkpoint))
+		self.assertEqual(sorted(checked + resumed), sorted(bag.entries))
+		self.assertFalse(os.path.exists(checkpoint))
+
+	def test_premis_events_appended(self):
+		bagit.make_bag(self.tmpdir)
+		with open(j(self.tmpdir, 'premis-events.json'), 'w') as f:
+			f.write('[{"Event-Type": "Legacy event"}]')
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		bag.add_premisevent(process = "Peek into bag", msg = "Just looking around",
+			outcome = "Pass", sw_agent = "update_bag.py")
+		bag.write_bag_updates()
+		with open(j(self.tmpdir, 'premis-events.jsonl'), 'a') as f:
+			f.write('{"Event-Type": "Cut sh')
+
+		updated_bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		self.assertEqual([event['Event-Type'] for event in updated_bag.premis_events],
+			["Legacy event", "Peek into bag"])
+		updated_bag.add_premisevent(process = "Look again", msg = "Still looking",
+			outcome = "Pass", sw_agent = "update_bag.py")
+		updated_bag.write_premisjson()
+		self.assertEqual(len(update_bag.Repairable_Bag(path = self.tmpdir).premis_events), 3)
+
+	def test_compact_premis_events(self):
+		bagit.make_bag(self.tmpdir)
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		bag.add_premisevent(process = "Peek into bag", msg = "Just looking around",
+			outcome = "Pass", sw_agent = "update_bag.py")
+		bag.write_bag_updates()
+		self.assertTrue(bag.compact_premisjson())
+		self.assertFalse(os.path.exists(j(self.tmpdir, 'premis-events.jsonl')))
+		with open(j(self.tmpdir, 'premis-events.json')) as f:
+			self.assertEqual(len(json.load(f)), 1)
+		self.assertTrue(self.validate(update_bag.Repairable_Bag(path = self.tmpdir), fast = False))
+
+	def test_tag_manifest_reuses_unchanged_hashes(self):
+		bagit.make_bag(self.tmpdir)
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		bag.add_premisevent(process = "Peek into bag", msg = "Just looking around",
+			outcome = "Pass", sw_agent = "update_bag.py")
+		bag.write_bag_updates()
+
+		bag.add_premisevent(process = "Look again", msg = "Still looking",
+			outcome = "Pass", sw_agent = "update_bag.py")
+		with mock.patch.object(bag, 'hash_file', wraps = bag.hash_file) as hash_file, \
+			mock.patch('ami_bag.hashing.update_hashers', wraps = update_bag.hashing.update_hashers) as update_hashers:
+			bag.write_bag_updates()
+		hash_file.assert_not_called()
+		update_hashers.assert_not_called()
+		self.assertTrue(self.validate(update_bag.Repairable_Bag(path = self.tmpdir), fast = False))
+
+	def test_tag_manifest_rehashes_changed_files(self):
+		bagit.make_bag(self.tmpdir)
+		bag = update_bag.Repairable_Bag(path = self.tmpdir)
+		bag.add_premisevent(process = "Peek into bag", msg = "Just looking around",
+			outcome = "Pass", sw_agent = "update_bag.py")
+		bag.write_bag_updates()
+
+		# changed behind the bag's back
+		with open(j(self.tmpdir, 'bag-info.txt'), 'a') as f:
+			f.write('Contact-Name: Someone\n')
+		with open(j(self.tmpdir, 'premis-events.jsonl'), 'a') as f:
+			f.write('{"Event-Type": "Appended elsewhere"}\n')
+
+		bag.add_premisevent(process = "Look again", msg = "Still looking",
+			outcome = "Pass", sw_agent = "update_bag.py")
+		with mock.patch.object(bag, 'hash_file', wraps = bag.hash_file) as hash_file:
+			bag.write_bag_updates()
+		self.assertEqual([call.args[0] for call in hash_file.call_args_list], ['bag-info.txt'])
+		self.assertTrue(self.validate(update_bag.Repairable_Bag(path = self.tmpdir), fast = False))
+
 class TestMultiprocessValidation(TestSingleProcessValidation):
 
 		def validate(self, bag, *args, **kwargs):
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+import bagit
+
+import ami_bag.validation_ledger as validation_ledger
+
+
+class TestValidationLedger(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.bagdir = os.path.join(self.tmpdir, 'bag')
+		shutil.copytree('tests/test-data/json-video-bag', self.bagdir)
+		bagit.make_bag(self.bagdir)
+		self.ledger = validation_ledger.ValidationLedger(os.path.join(self.tmpdir, 'ledger.sqlite'))
+
+	def tearDown(self):
+		self.ledger.close()
+		shutil.rmtree(self.tmpdir)
+
+	def test_fingerprint_is_stable(self):
+		self.assertEqual(validation_ledger.bag_fingerprint(self.bagdir),
+			validation_ledger.bag_fingerprint(self.bagdir))
+
+	def test_fingerprint_changes_with_payload(self):
+		fingerprint = validation_ledger.bag_fingerprint(self.bagdir)
+		with open(os.path.join(self.bagdir, 'data', 'Thumbs.db'), 'w') as f:
+			f.write('x')
+		self.assertNotEqual(fingerprint, validation_ledger.bag_fingerprint(self.bagdir))
+
+	def test_fingerprint_changes_with_baginfo(self):
+		fingerprint = validation_ledger.bag_fingerprint(self.bagdir)
+		with open(os.path.join(self.bagdir, 'bag-info.txt'), 'a') as f:
+			f.write('Contact-Name: Someone\n')
+		self.assertNotEqual(fingerprint, validation_ledger.bag_fingerprint(self.bagdir))
+
+	def test_recorded_verdict(self):
+		fingerprint = validation_ledger.bag_fingerprint(self.bagdir)
+		self.assertIsNone(self.ledger.get(self.bagdir, fingerprint, True, False))
+		self.ledger.put(self.bagdir, fingerprint, True, False, True, False)
+		self.assertEqual(self.ledger.get(self.bagdir, fingerprint, True, False)[0:2], (True, False))
+		self.assertIsNone(self.ledger.get(self.bagdir, fingerprint, True, True))
+		self.assertIsNone(self.ledger.get(self.bagdir, 'changed', True, False))
+
+	def test_verdict_from_other_checks(self):
+		fingerprint = validation_ledger.bag_fingerprint(self.bagdir)
+		self.ledger.put(self.bagdir, fingerprint, True, False, False, True)
+		self.ledger.close()
+		self.ledger = validation_ledger.ValidationLedger(self.ledger.path, checks = 'older build')
+		self.assertIsNone(self.ledger.get(self.bagdir, fingerprint, True, False))
+		self.assertNotEqual(validation_ledger.checks_version(), 'older build')
+
+
+if __name__ == '__main__':
+	unittest.main()